@@ -0,0 +1,59 @@
+"""Compare one-by-one POST /assets with the bulk import endpoint.
+
+    python -m benchmarks.bulk_import --rows 2000
+"""
+import asyncio
+import json
+import time
+
+from benchmarks.common import asgi_client, base_parser, drop_scratch_database, register, use_scratch_database
+
+
+def asset_rows(vault_id: str, count: int, prefix: str) -> list:
+    return [
+        {"vault_id": vault_id, "name": f"{prefix} {i}", "category": "financial", "url": f"https://example.com/{prefix}/{i}"}
+        for i in range(count)
+    ]
+
+
+async def main(args):
+    use_scratch_database(args.mock)
+    async with asgi_client() as client:
+        headers = await register(client, "bulk@example.com")
+        vault_id = (await client.get("/api/vaults", headers=headers)).json()[0]["id"]
+
+        rows = asset_rows(vault_id, args.rows, "single")
+        gate = asyncio.Semaphore(args.concurrency)
+
+        async def post(row):
+            async with gate:
+                response = await client.post("/api/assets", headers=headers, json=row)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(row) for row in rows))
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = await client.post("/api/assets/bulk", headers=headers, json=asset_rows(vault_id, args.rows, "json"))
+        bulk_json = time.perf_counter() - started
+        assert response.json()["inserted"] == args.rows, response.text
+
+        body = "\n".join(json.dumps(row) for row in asset_rows(vault_id, args.rows, "ndjson"))
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/assets/bulk", headers={**headers, "Content-Type": "application/x-ndjson"}, content=body
+        )
+        bulk_ndjson = time.perf_counter() - started
+        assert response.json()["inserted"] == args.rows, response.text
+
+    await drop_scratch_database()
+    for label, seconds in [("POST /assets x N", single), ("bulk JSON array", bulk_json), ("bulk NDJSON", bulk_ndjson)]:
+        print(f"{label:>18}: {args.rows} rows in {seconds:6.2f}s ({args.rows / seconds:>9,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks drive the FastAPI app in process over an ASGI transport. By default
+they use the MongoDB at MONGO_URL with a throwaway database; pass --mock to run
+against mongomock-motor instead when no server is available. mongomock-motor
+is a development dependency:
+
+    pip install -r requirements-dev.txt
+"""
+import argparse
+import os
+import uuid
+
+import httpx
+
+# Every benchmark client shares one IP and a handful of users; measure the
+# server, not the rate limiter. Export RATE_LIMIT_ENABLED=true to include it.
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# Likewise the lag-based load shedder: seeding, bcrypt and mongomock all stall
+# the loop, and a shed request measures nothing. Export LOAD_SHED_LAG_MS to include it.
+os.environ.setdefault("LOAD_SHED_LAG_MS", "inf")
+
+import server  # noqa: E402
+
+
+def base_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of MONGO_URL")
+    return parser
+
+
+def use_scratch_database(mock: bool):
+    """Point the app at a fresh database and return it."""
+    name = f"driv_bench_{uuid.uuid4().hex[:8]}"
+    if mock:
+        from mongomock_motor import AsyncMongoMockClient
+
+        server.client = AsyncMongoMockClient()
+        # mongomock has no $text, so search runs on the in-process index
+        server.search_service.backend = "memory"
+    server.db = server.client[name]
+    return server.db
+
+
+async def drop_scratch_database():
+    await server.client.drop_database(server.db.name)
+
+
+def asgi_client() -> httpx.AsyncClient:
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def register(client: httpx.AsyncClient, email: str, password: str = "bench-password") -> dict:
+    response = await client.post(
+        "/api/auth/register", json={"email": email, "password": password, "full_name": "Bench User"}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,65 @@
+"""Measure credential encryption and reveal throughput.
+
+Data keys are primed straight into data_key_cache, so no database is needed.
+"decrypt inline" unseals each credential on the event loop thread, one at a
+time; "reveal batched" is reveal_asset_credentials(), which unseals in
+CRYPTO_BATCH_SIZE chunks on the crypto thread pool.
+
+    python -m benchmarks.credentials_crypto --rows 1000 20000 --vaults 10
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from server import (
+    credentials_aad, data_key_cache, reveal_asset_credentials, seal_asset_credentials, unseal,
+)
+
+
+def make_docs(count: int, vaults: int) -> list:
+    vault_ids = [str(uuid.uuid4()) for _ in range(vaults)]
+    for vault_id in vault_ids:
+        data_key_cache.set(vault_id, AESGCM(AESGCM.generate_key(bit_length=256)))
+    return [
+        {"id": str(uuid.uuid4()), "vault_id": vault_ids[i % vaults], "credentials": f"user{i}:correct-horse-battery-staple-{i}"}
+        for i in range(count)
+    ]
+
+
+def decrypt_inline(docs: list) -> list:
+    return [
+        unseal(data_key_cache.get(d["vault_id"]), d["credentials_encrypted"], credentials_aad(d["vault_id"], d["id"])).decode()
+        for d in docs
+    ]
+
+
+async def main(args):
+    for count in args.rows:
+        docs = make_docs(count, args.vaults)
+
+        start = time.perf_counter()
+        await seal_asset_credentials(docs)
+        encrypt_rate = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decrypt_inline(docs)
+        inline_rate = count / (time.perf_counter() - start)
+
+        await reveal_asset_credentials(docs[:10])  # warm up the pool
+        start = time.perf_counter()
+        revealed = await reveal_asset_credentials(docs)
+        batched_rate = count / (time.perf_counter() - start)
+        assert all(value is not None for value in revealed.values())
+
+        print(f"{count:>6} rows: encrypt {encrypt_rate:>10,.0f}/s | decrypt inline {inline_rate:>10,.0f}/s | "
+              f"reveal batched {batched_rate:>10,.0f}/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 20000])
+    parser.add_argument("--vaults", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""Queue and drain a large batch of emails through the outbox.
+
+An aiosmtpd server on localhost stands in for the relay, so the numbers cover
+the real SMTP conversation over pooled connections.
+
+    python -m benchmarks.email_outbox --messages 10000 --pool-size 4
+"""
+import asyncio
+import time
+
+from aiosmtpd.controller import Controller
+
+import server
+from benchmarks.common import base_parser, drop_scratch_database, use_scratch_database
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, smtp_server, session, envelope):
+        self.received += 1
+        return "250 Message accepted"
+
+
+async def main(args):
+    database = use_scratch_database(args.mock)
+    await server.ensure_indexes(database)
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    pool = server.SMTPConnectionPool("127.0.0.1", args.port, starttls=False, size=args.pool_size)
+    dispatcher = server.EmailDispatcher(
+        pool, database=database, batch_size=args.batch_size,
+        concurrency=args.pool_size, rate_per_second=args.rate
+    )
+    try:
+        started = time.perf_counter()
+        for i in range(args.messages):
+            await dispatcher.enqueue(f"heir{i}@example.com", "Benchmark", "Outbox throughput benchmark message")
+        enqueue_seconds = time.perf_counter() - started
+
+        sent = await dispatcher.run_once()
+    finally:
+        pool.close()
+        controller.stop()
+        await drop_scratch_database()
+
+    print(f"enqueued {args.messages} in {enqueue_seconds:.2f}s ({args.messages / enqueue_seconds:,.0f} msg/s)")
+    print(
+        f"delivered {sent} in {dispatcher.last_run['seconds']:.2f}s ({dispatcher.last_run['per_second']:,.0f} msg/s) "
+        f"over {pool.connections_opened} SMTP connections; relay received {handler.received}"
+    )
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0, help="messages per second, 0 for unlimited")
+    parser.add_argument("--port", type=int, default=8025)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,282 @@
+"""Mixed-workload load test for the API with per-route latency percentiles.
+
+Seeds a scratch database with a synthetic dataset (users, vaults, assets,
+trusted parties), then runs a weighted mix of logins, dashboard reads, list
+reads, asset creates and death verifications from --concurrency clients.
+Reports throughput and p50/p95/p99 per route.
+
+With --baseline, results are compared against a stored run and the process
+exits 1 if any route's p95 or the overall throughput regressed by more than
+--tolerance; a missing baseline file is an error. --save-baseline writes the
+current run to that file instead. benchmarks/load_baseline.json was recorded
+with --mock and the default workload, so compare against it with the same flags.
+
+Absolute latencies only mean something on the machine that recorded them, so
+every run first times a fixed calibration workload (a bcrypt hash and one
+serialized page of assets) and stores it with the results. A comparison
+scales the baseline up by the ratio of the two calibrations before applying
+--tolerance. A faster machine is held to the recorded figures rather than
+tighter ones, so calibration noise alone cannot fail a run. The ratio tracks
+--mock runs, which are CPU-bound in this process; against a real MongoDB it
+does not account for the database host.
+
+    python -m benchmarks.load --mock --users 20 --assets-per-vault 200 --requests 5000
+    python -m benchmarks.load --mock --baseline benchmarks/load_baseline.json --save-baseline
+    python -m benchmarks.load --mock --baseline benchmarks/load_baseline.json
+"""
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.common import asgi_client, base_parser, drop_scratch_database, percentile, use_scratch_database
+import server
+
+PASSWORD = "bench-password"
+CATEGORIES = [category.value for category in server.AssetCategory]
+DEFAULT_MIX = "login=1,dashboard=3,list_vaults=2,list_assets=4,create_asset=2,verification=1"
+
+
+def calibrate(rounds: int = 5) -> float:
+    """Return the fastest of `rounds` timings of the calibration workload, in ms."""
+    assets = [
+        server.Asset(user_id="calibration", vault_id="calibration", name=f"Asset {a}",
+                     category=CATEGORIES[a % len(CATEGORIES)], url=f"https://example.com/{a}").model_dump()
+        for a in range(server.MAX_PAGE_SIZE)
+    ]
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        server.get_password_hash(PASSWORD)
+        server.fast_list_response(server.Asset, assets)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise SystemExit(f"unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def seed(args) -> list:
+    """Insert the synthetic dataset directly and return one fixture per user."""
+    await server.ensure_indexes(server.db)
+    password_hash = server.get_password_hash(PASSWORD)
+    rng = random.Random(args.seed)
+    fixtures = []
+    for u in range(args.users):
+        user = server.User(email=f"load{u}@example.com", full_name=f"Load User {u}")
+        await server.db.users.insert_one({**user.model_dump(), "password_hash": password_hash})
+        vaults = [server.Vault(user_id=user.id, name=f"Vault {v}") for v in range(args.vaults_per_user)]
+        await server.db.vaults.insert_many([vault.model_dump() for vault in vaults])
+
+        assets, parties = [], []
+        for vault in vaults:
+            for a in range(args.assets_per_vault):
+                asset = server.Asset(
+                    user_id=user.id, vault_id=vault.id, name=f"Asset {a}", category=rng.choice(CATEGORIES),
+                    description="Synthetic asset for load testing", url=f"https://example.com/{a}",
+                    credentials=f"user{a}:secret" if a % 4 == 0 else None,
+                )
+                assets.append(asset.model_dump())
+            party = server.TrustedParty(user_id=user.id, vault_id=vault.id, name="Verifier",
+                                        email=f"verifier{u}@example.com", role=server.RoleType.VERIFIER)
+            parties.append(party.model_dump())
+        await server.seal_asset_credentials(assets)
+        for start in range(0, len(assets), 1000):
+            await server.db.assets.insert_many(assets[start:start + 1000])
+        await server.db.trusted_parties.insert_many(parties)
+        await server.rebuild_user_stats(user.id)
+        for vault in vaults:
+            await server.rebuild_vault_quorum(vault.id)
+        fixtures.append({"email": user.email, "vault_ids": [vault.id for vault in vaults], "party_ids": [p["id"] for p in parties]})
+    return fixtures
+
+
+async def login(client, fixture: dict) -> dict:
+    response = await client.post("/api/auth/login", json={"email": fixture["email"], "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+# Each workload yields (route label, awaitable) pairs so multi-request flows
+# record every request under its own label.
+def w_login(client, fixture, headers, rng):
+    yield "POST /auth/login", client.post("/api/auth/login", json={"email": fixture["email"], "password": PASSWORD})
+
+
+def w_dashboard(client, fixture, headers, rng):
+    yield "GET /analytics/dashboard", client.get("/api/analytics/dashboard", headers=headers)
+
+
+def w_list_vaults(client, fixture, headers, rng):
+    yield "GET /vaults", client.get("/api/vaults", headers=headers)
+
+
+def w_list_assets(client, fixture, headers, rng):
+    params = {"vault_id": rng.choice(fixture["vault_ids"]), "limit": 100}
+    yield "GET /assets", client.get("/api/assets", headers=headers, params=params)
+
+
+def w_create_asset(client, fixture, headers, rng):
+    body = {"vault_id": rng.choice(fixture["vault_ids"]), "name": "Load asset", "category": rng.choice(CATEGORIES)}
+    yield "POST /assets", client.post("/api/assets", headers=headers, json=body)
+
+
+def w_verification(client, fixture, headers, rng):
+    index = rng.randrange(len(fixture["vault_ids"]))
+    body = {"vault_id": fixture["vault_ids"][index], "submitted_by": fixture["party_ids"][index], "evidence_type": "obituary"}
+    response = yield "POST /death-verifications", client.post("/api/death-verifications", headers=headers, json=body)
+    if response.status_code == 200:
+        status = rng.choice(["verified", "rejected"])
+        yield "PATCH /death-verifications/{id}/status", client.patch(
+            f"/api/death-verifications/{response.json()['id']}/status", headers=headers, params={"status": status}
+        )
+
+
+WORKLOADS = {
+    "login": w_login,
+    "dashboard": w_dashboard,
+    "list_vaults": w_list_vaults,
+    "list_assets": w_list_assets,
+    "create_asset": w_create_asset,
+    "verification": w_verification,
+}
+
+
+async def run(client, fixtures: list, sessions: list, weights: dict, args) -> tuple:
+    names, weight_values = list(weights), list(weights.values())
+    samples, errors = {}, {}
+    remaining = [args.requests]
+
+    async def worker(worker_id: int):
+        rng = random.Random(args.seed + worker_id)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            index = rng.randrange(len(fixtures))
+            flow = WORKLOADS[rng.choices(names, weight_values)[0]](client, fixtures[index], sessions[index], rng)
+            response = None
+            while True:
+                try:
+                    label, request = flow.send(response)
+                except StopIteration:
+                    break
+                start = time.perf_counter()
+                response = await request
+                samples.setdefault(label, []).append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    errors[label] = errors.get(label, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    return samples, errors, time.perf_counter() - started
+
+
+def summarize(samples: dict, errors: dict, elapsed: float) -> dict:
+    routes = {
+        label: {
+            "count": len(values),
+            "errors": errors.get(label, 0),
+            "throughput": len(values) / elapsed,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+        for label, values in sorted(samples.items())
+    }
+    total = sum(len(values) for values in samples.values())
+    return {"elapsed": elapsed, "throughput": total / elapsed, "routes": routes}
+
+
+def report(summary: dict):
+    print(f"{'route':<40} {'n':>6} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, r in summary["routes"].items():
+        print(f"{label:<40} {r['count']:>6} {r['errors']:>5} {r['throughput']:>8.1f} "
+              f"{r['p50']:>6.2f}ms {r['p95']:>6.2f}ms {r['p99']:>6.2f}ms")
+    print(f"{'total':<40} {sum(r['count'] for r in summary['routes'].values()):>6} "
+          f"{'':>5} {summary['throughput']:>8.1f}  in {summary['elapsed']:.2f}s")
+    print(f"calibration {summary['calibration_ms']:.1f}ms")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float, slack_ms: float) -> list:
+    # Above 1 this machine is slower than the one that recorded the baseline
+    scale = max(1.0, summary["calibration_ms"] / baseline["calibration_ms"])
+    regressions = []
+    for label, base in baseline["routes"].items():
+        current = summary["routes"].get(label)
+        if current is None:
+            continue
+        limit = base["p95"] * scale * (1 + tolerance) + slack_ms
+        if current["p95"] > limit:
+            regressions.append(f"{label}: p95 {current['p95']:.2f}ms > {limit:.2f}ms "
+                               f"(baseline {base['p95']:.2f}ms, scaled x{scale:.2f})")
+    floor = baseline["throughput"] / scale * (1 - tolerance)
+    if summary["throughput"] < floor:
+        regressions.append(f"throughput {summary['throughput']:.1f} req/s < {floor:.1f} "
+                           f"(baseline {baseline['throughput']:.1f}, scaled x{scale:.2f})")
+    return regressions
+
+
+async def main(args) -> int:
+    weights = parse_mix(args.mix)
+    path = Path(args.baseline) if args.baseline else None
+    if path and not args.save_baseline and not path.exists():
+        print(f"no baseline at {path}; rerun with --save-baseline to create one", file=sys.stderr)
+        return 1
+    calibration_ms = calibrate()
+    use_scratch_database(args.mock)
+    try:
+        started = time.perf_counter()
+        fixtures = await seed(args)
+        print(f"seeded {args.users} users, {args.users * args.vaults_per_user} vaults, "
+              f"{args.users * args.vaults_per_user * args.assets_per_vault} assets in {time.perf_counter() - started:.1f}s")
+        async with asgi_client() as client:
+            sessions = [await login(client, fixture) for fixture in fixtures]
+            samples, errors, elapsed = await run(client, fixtures, sessions, weights, args)
+    finally:
+        await drop_scratch_database()
+
+    summary = summarize(samples, errors, elapsed)
+    summary["calibration_ms"] = calibration_ms
+    summary["config"] = {key: getattr(args, key) for key in
+                         ("mock", "users", "vaults_per_user", "assets_per_vault", "requests", "concurrency", "mix", "seed")}
+    report(summary)
+    if path is None:
+        return 0
+    if args.save_baseline:
+        path.write_text(json.dumps(summary, indent=2) + "\n")
+        print(f"baseline written to {path}")
+        return 0
+    baseline = json.loads(path.read_text())
+    if "calibration_ms" not in baseline:
+        print(f"{path} has no calibration; rerun with --save-baseline to record one", file=sys.stderr)
+        return 1
+    if baseline.get("config") != summary["config"]:
+        print(f"warning: baseline was recorded with a different configuration: {baseline.get('config')}")
+    regressions = compare(summary, baseline, args.tolerance, args.slack_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--vaults-per-user", type=int, default=2)
+    parser.add_argument("--assets-per-vault", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000, help="total workload flows to run")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated workload=weight pairs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="baseline JSON file to compare against (or write, with --save-baseline)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional regression")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="absolute p95 slack added to the tolerance")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,81 @@
+"""Measure latency of an unrelated endpoint while a burst of logins runs.
+
+With bcrypt on the password worker pool, p99 of GET /api/auth/me should stay
+close to its idle value during the storm instead of tracking bcrypt time.
+
+    python -m benchmarks.login_storm --logins 200 --concurrency 50
+"""
+import asyncio
+import time
+
+from benchmarks.common import (
+    asgi_client,
+    base_parser,
+    drop_scratch_database,
+    percentile,
+    register,
+    use_scratch_database,
+)
+
+
+async def sample_latency(client, headers, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/api/auth/me", headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.005)
+
+
+async def login_storm(client, email: str, logins: int, concurrency: int) -> dict:
+    statuses = {}
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            response = await client.post("/api/auth/login", json={"email": email, "password": "bench-password"})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(logins)))
+    return statuses
+
+
+def report(label: str, samples: list):
+    print(
+        f"{label:>8}: n={len(samples):5d}  p50={percentile(samples, 50):7.2f}ms  "
+        f"p95={percentile(samples, 95):7.2f}ms  p99={percentile(samples, 99):7.2f}ms"
+    )
+
+
+async def main(args):
+    use_scratch_database(args.mock)
+    async with asgi_client() as client:
+        email = "storm@example.com"
+        headers = await register(client, email)
+
+        idle, storm = [], []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_latency(client, headers, stop, idle))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        await sampler
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_latency(client, headers, stop, storm))
+        started = time.perf_counter()
+        statuses = await login_storm(client, email, args.logins, args.concurrency)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+
+    report("idle", idle)
+    report("storm", storm)
+    print(f"logins: {args.logins} in {elapsed:.2f}s, statuses={statuses}")
+    await drop_scratch_database()
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,26 @@
+"""Fail if any query shape issued by the routes falls back to a COLLSCAN.
+
+Run from the backend directory against a scratch database:
+
+    DB_NAME=driv_plan_check python -m benchmarks.query_plans
+"""
+import asyncio
+import sys
+
+from server import check_query_plans, client, ensure_indexes
+
+
+async def main() -> int:
+    await ensure_indexes()
+    failures = await check_query_plans()
+    for failure in failures:
+        print(f"COLLSCAN: {failure}")
+    client.close()
+    if failures:
+        return 1
+    print("All query shapes are index-backed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
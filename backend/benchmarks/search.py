@@ -0,0 +1,132 @@
+"""Search latency over one large account.
+
+Seeds a single user with --docs searchable documents (mostly assets, plus
+legacy instructions and trusted parties) spread over --vaults vaults, then
+times GET /api/search for whole-word, prefix, multi-term, vault-filtered,
+category-filtered and deep-page queries. Also reports the first (cold) query,
+which builds the in-process index when the memory backend is active, and how
+long a freshly created asset takes to become searchable.
+
+    python -m benchmarks.search --mock --docs 100000
+    python -m benchmarks.search --docs 100000 --iterations 200
+"""
+import asyncio
+import random
+import time
+
+from benchmarks.common import asgi_client, base_parser, drop_scratch_database, percentile, register, use_scratch_database
+import server
+
+CATEGORIES = [category.value for category in server.AssetCategory]
+WORDS = [
+    "bitcoin", "ethereum", "checking", "savings", "brokerage", "mortgage", "insurance", "pension", "netflix",
+    "spotify", "photos", "mailbox", "domain", "wallet", "ledger", "retirement", "property", "vehicle", "passport",
+    "storage", "backup", "family", "business", "charity",
+]
+
+
+async def seed(args, user_id: str) -> list:
+    """Insert the synthetic documents directly and return the vault ids."""
+    rng = random.Random(args.seed)
+    vaults = [server.Vault(user_id=user_id, name=f"Vault {v}") for v in range(args.vaults)]
+    await server.db.vaults.insert_many([vault.model_dump() for vault in vaults])
+    vault_ids = [vault.id for vault in vaults]
+
+    def phrase(i: int) -> str:
+        return f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}"
+
+    batches = {"assets": [], "legacy_instructions": [], "trusted_parties": []}
+    for i in range(args.docs):
+        vault_id = rng.choice(vault_ids)
+        kind = rng.random()
+        if kind < 0.8:
+            doc = server.Asset(user_id=user_id, vault_id=vault_id, name=phrase(i), category=rng.choice(CATEGORIES),
+                               description=f"{rng.choice(WORDS)} account notes", url=f"https://{rng.choice(WORDS)}.example.com/{i}")
+            batches["assets"].append(doc.model_dump())
+        elif kind < 0.9:
+            doc = server.LegacyInstruction(user_id=user_id, vault_id=vault_id, action_type=server.ActionType.NOTIFY,
+                                           title=phrase(i), description=f"Close the {rng.choice(WORDS)} account",
+                                           target_email=f"contact{i}@example.com")
+            batches["legacy_instructions"].append(doc.model_dump())
+        else:
+            doc = server.TrustedParty(user_id=user_id, vault_id=vault_id, name=f"{rng.choice(WORDS).title()} Contact {i}",
+                                      email=f"party{i}@example.com", role=server.RoleType.VERIFIER)
+            batches["trusted_parties"].append(doc.model_dump())
+        for collection, docs in batches.items():
+            if len(docs) >= 1000:
+                await server.db[collection].insert_many(docs)
+                docs.clear()
+    for collection, docs in batches.items():
+        if docs:
+            await server.db[collection].insert_many(docs)
+    await server.rebuild_user_stats(user_id)
+    return vault_ids
+
+
+def queries(vault_ids: list) -> dict:
+    return {
+        "word": {"q": "bitcoin"},
+        "prefix": {"q": "retir"},
+        "multi-term": {"q": "savings acc"},
+        "vault filter": {"q": "wallet", "vault_id": vault_ids[0]},
+        "category filter": {"q": "insurance", "category": "financial"},
+        "deep page": {"q": "ledger", "cursor": server.encode_search_cursor(400)},
+        "no match": {"q": "zzzzzz"},
+    }
+
+
+async def timed(client, headers, params: dict) -> float:
+    start = time.perf_counter()
+    response = await client.get("/api/search", headers=headers, params=params)
+    elapsed = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    return elapsed
+
+
+def report(label: str, samples: list):
+    print(f"{label:>16}: n={len(samples):5d}  p50={percentile(samples, 50):8.2f}ms  "
+          f"p95={percentile(samples, 95):8.2f}ms  p99={percentile(samples, 99):8.2f}ms")
+
+
+async def main(args):
+    use_scratch_database(args.mock)
+    try:
+        await server.ensure_indexes(server.db)
+        async with asgi_client() as client:
+            headers = await register(client, "search@example.com")
+            user_id = (await client.get("/api/auth/me", headers=headers)).json()["id"]
+            started = time.perf_counter()
+            vault_ids = await seed(args, user_id)
+            print(f"seeded {args.docs} documents in {args.vaults} vaults in {time.perf_counter() - started:.1f}s")
+            # Seeding stalls the event loop; let the admission lag monitor catch up
+            await asyncio.sleep(0.5)
+
+            cold = await timed(client, headers, {"q": "bitcoin"})
+            print(f"backend={server.search_service.backend}  cold query (index build)={cold:.1f}ms")
+
+            for label, params in queries(vault_ids).items():
+                report(label, [await timed(client, headers, params) for _ in range(args.iterations)])
+
+            visible = []
+            for i in range(args.updates):
+                token = f"freshasset{i}"
+                response = await client.post("/api/assets", headers=headers,
+                                             json={"vault_id": vault_ids[0], "name": token, "category": "other"})
+                response.raise_for_status()
+                start = time.perf_counter()
+                found = (await client.get("/api/search", headers=headers, params={"q": token})).json()
+                visible.append((time.perf_counter() - start) * 1000)
+                assert found and found[0]["title"] == token, f"{token} not searchable after create"
+            report("after create", visible)
+    finally:
+        await drop_scratch_database()
+
+
+if __name__ == "__main__":
+    parser = base_parser(__doc__)
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--vaults", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=100, help="requests per query type")
+    parser.add_argument("--updates", type=int, default=50, help="create-then-search round trips")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
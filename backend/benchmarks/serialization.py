@@ -0,0 +1,73 @@
+"""Compare the fast list serializer with the validate-twice route path.
+
+The old path built Model(**doc) per row and then let FastAPI re-validate the
+list against response_model and dump it through the stdlib encoder. The fast
+path is fast_list_response(). No database is needed.
+
+    python -m benchmarks.serialization --rows 1000 10000
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from server import Asset, fast_list_response
+
+
+def make_docs(count: int) -> list:
+    vault_id = str(uuid.uuid4())
+    user_id = str(uuid.uuid4())
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "vault_id": vault_id,
+            "user_id": user_id,
+            "name": f"Asset {i}",
+            "category": "financial",
+            "description": "Brokerage account with quarterly statements",
+            "url": f"https://example.com/accounts/{i}",
+            "value": "12000",
+            "metadata": {"institution": "Example Bank", "index": i},
+            "created_at": datetime.now(timezone.utc),
+        }
+        for i in range(count)
+    ]
+
+
+def validate_twice(docs: list) -> bytes:
+    rows = [Asset(**d) for d in docs]
+    validated = TypeAdapter(List[Asset]).validate_python(rows, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def fast_path(docs: list) -> bytes:
+    return fast_list_response(Asset, docs).body
+
+
+def measure(fn, docs: list, repeat: int) -> float:
+    fn(docs)  # warm up adapters
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(docs)
+    return len(docs) * repeat / (time.perf_counter() - start)
+
+
+def main(args):
+    for count in args.rows:
+        docs = make_docs(count)
+        repeat = max(1, args.budget // count)
+        old = measure(validate_twice, docs, repeat)
+        new = measure(fast_path, docs, repeat)
+        print(f"{count:>6} rows: validate-twice {old:>10,.0f} rows/s | fast path {new:>10,.0f} rows/s | {new / old:4.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--budget", type=int, default=50000, help="approximate rows serialized per measurement")
+    main(parser.parse_args())
@@ -0,0 +1,49 @@
+"""Encrypt asset credentials written before envelope encryption was enabled.
+
+Runs through migration_runner, so it is safe against a live database and
+resumes where an interrupted run stopped. Each update is conditional on the
+credentials still holding the plaintext they were read with.
+
+    python encrypt_credentials.py [--batch-size 500] [--pause 0.05] [--restart]
+"""
+import asyncio
+
+from pymongo import UpdateOne
+
+from migration_runner import clear_checkpoints, migration_parser, run_batches
+from server import CREDENTIALS_REDACTED, client, db, seal_asset_credentials
+
+MIGRATION_NAME = "encrypt_credentials"
+
+
+async def encrypt_batch(batch: list) -> int:
+    plaintexts = {doc["_id"]: doc["credentials"] for doc in batch}
+    await seal_asset_credentials(batch)
+    updates = [
+        UpdateOne(
+            {"_id": doc["_id"], "credentials": plaintexts[doc["_id"]]},
+            {"$set": {"credentials": doc["credentials"], "credentials_encrypted": doc["credentials_encrypted"]}}
+        )
+        for doc in batch
+    ]
+    result = await db.assets.bulk_write(updates, ordered=False)
+    return result.modified_count
+
+
+async def main(args):
+    if args.restart:
+        await clear_checkpoints(MIGRATION_NAME)
+    needs_migration = {
+        "credentials": {"$type": "string", "$ne": CREDENTIALS_REDACTED},
+        "credentials_encrypted": {"$exists": False},
+    }
+    encrypted = await run_batches(
+        MIGRATION_NAME, "assets", needs_migration, {"id": 1, "vault_id": 1, "credentials": 1},
+        encrypt_batch, args.batch_size, args.pause, unit="credentials encrypted",
+    )
+    print(f"Done: {encrypted} credentials encrypted")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(migration_parser(__doc__).parse_args()))
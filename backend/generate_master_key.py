@@ -0,0 +1,37 @@
+"""Create the master key that wraps every vault's data key.
+
+Writes 32 random bytes to MASTER_KEY_FILE (or --path) with mode 0600. The
+server refuses to start without this file. An existing key is never replaced:
+the wrapped data keys in vault_keys only open with the key that wrapped them,
+so a new key would lock every stored credential away for good.
+
+    python generate_master_key.py [--path /run/secrets/driv-master.key]
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from server import MASTER_KEY_FILE
+
+
+def main(args) -> int:
+    path = Path(args.path)
+    try:
+        # O_EXCL: fail rather than overwrite, even if another run races this one
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        print(f"{path} already exists; refusing to replace the master key", file=sys.stderr)
+        return 1
+    with os.fdopen(fd, "wb") as key_file:
+        key_file.write(AESGCM.generate_key(bit_length=256))
+    print(f"Wrote a new master key to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=str(MASTER_KEY_FILE), help="defaults to MASTER_KEY_FILE")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""Rewrite ISO-string datetime fields as native BSON dates.
+
+Runs through migration_runner, so it is safe against a live database and
+resumes where an interrupted run stopped. Each rewrite is conditional on the
+field still holding the string it was read with. A rewritten date serializes
+differently, so the ETag versions of every list and vault export it touches
+are bumped.
+
+    python migrate_datetimes.py [--batch-size 500] [--pause 0.05] [--restart]
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from migration_runner import clear_checkpoints, migration_parser, run_batches
+from server import DATETIME_FIELDS, VAULT_SCOPED_COLLECTIONS, bump_vault_version, client, db
+
+# Collections whose list responses carry an ETag from versions.<collection>
+VERSIONED_COLLECTIONS = {*VAULT_SCOPED_COLLECTIONS, "vaults", "notifications", "subscriptions"}
+
+MIGRATION_NAME = "bson_datetimes"
+
+
+def parse_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def bump_versions(collection: str, docs: list):
+    if collection in VAULT_SCOPED_COLLECTIONS:
+        await bump_vault_version(*{doc["vault_id"] for doc in docs if doc.get("vault_id")})
+    if collection in VERSIONED_COLLECTIONS:
+        # versions.subscriptions also covers the subscriptions in vault exports
+        user_ids = list({doc["user_id"] for doc in docs if doc.get("user_id")})
+        await db.user_stats.update_many({"user_id": {"$in": user_ids}}, {"$inc": {f"versions.{collection}": 1}})
+
+
+async def migrate_collection(collection: str, fields, batch_size: int, pause: float) -> int:
+    async def migrate_batch(batch: list) -> int:
+        updates, touched = [], []
+        for doc in batch:
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    converted = parse_datetime(value)
+                except ValueError:
+                    print(f"{collection}: skipping unparseable {field}={value!r} on {doc['_id']}")
+                    continue
+                updates.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: converted}}))
+                touched.append(doc)
+        if not updates:
+            return 0
+        result = await db[collection].bulk_write(updates, ordered=False)
+        await bump_versions(collection, touched)
+        return result.modified_count
+
+    return await run_batches(
+        MIGRATION_NAME, collection,
+        {"$or": [{field: {"$type": "string"}} for field in fields]},
+        {"user_id": 1, "vault_id": 1, **{field: 1 for field in fields}},
+        migrate_batch, batch_size, pause, unit="fields rewritten",
+    )
+
+
+async def main(args):
+    if args.restart:
+        await clear_checkpoints(MIGRATION_NAME)
+    total = 0
+    for collection, fields in DATETIME_FIELDS.items():
+        total += await migrate_collection(collection, fields, args.batch_size, args.pause)
+    print(f"Done: {total} fields rewritten")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(migration_parser(__doc__).parse_args()))
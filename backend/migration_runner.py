@@ -0,0 +1,64 @@
+"""Resumable batch runner shared by the data migration scripts.
+
+A migration walks one collection in _id order in small batches and hands each
+batch to a callback that writes its updates, each conditional on the field
+still holding the value it was read with, so it is safe against a live
+database. The last _id handled is checkpointed in the `migrations` collection,
+so an interrupted run resumes where it stopped; a finished collection is
+skipped until the script is run with --restart.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List
+
+from server import db
+
+
+def migration_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    return parser
+
+
+async def clear_checkpoints(name: str, database=None):
+    await (db if database is None else database).migrations.delete_many({"name": name})
+
+
+async def run_batches(name: str, collection: str, query: dict, projection: dict,
+                      migrate_batch: Callable[[List[dict]], Awaitable[int]], batch_size: int, pause: float,
+                      unit: str = "documents migrated", database=None) -> int:
+    """Feed every document matching query to migrate_batch, which returns how
+    many it changed. Returns the total for this run."""
+    database = db if database is None else database
+    key = {"name": name, "collection": collection}
+    checkpoint = await database.migrations.find_one(key)
+    if checkpoint and checkpoint.get("done"):
+        print(f"{collection}: already migrated")
+        return 0
+
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    total = 0
+    while True:
+        page = dict(query)
+        if last_id is not None:
+            page["_id"] = {"$gt": last_id}
+        batch = await database[collection].find(page, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        total += await migrate_batch(batch)
+        last_id = batch[-1]["_id"]
+        await database.migrations.update_one(
+            key, {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}}, upsert=True
+        )
+        print(f"{collection}: {total} {unit} (through _id {last_id})")
+        if pause:
+            await asyncio.sleep(pause)
+
+    await database.migrations.update_one(
+        key, {"$set": {"done": True, "updated_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return total
@@ -1,36 +1,356 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, CursorType, IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.monitoring import CommandListener
 import os
+import asyncio
+import base64
+import bisect
+import csv
+import hashlib
+import importlib.util
+import json
 import logging
+import math
+import multiprocessing
+import re
+import smtplib
+import threading
+import time
+import zipfile
+import zlib
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from collections import OrderedDict
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+import httpx
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from enum import Enum
+from email.message import EmailMessage
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Observability
+# Per-route request latency and status counts, plus every Mongo command issued,
+# attributed to the request that issued it. MetricsMiddleware puts a
+# RequestMetrics in the current_request context variable; Motor copies the
+# context into its executor threads, so MongoCommandListener finds it there.
+# Everything is rendered in Prometheus text format at /metrics. This section
+# comes first because the listener has to exist before the client is created.
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, /metrics and the */stats routes accept only it; if not, any signed-in user
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple, values: tuple, le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values: Dict[tuple, list] = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, str(bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, '+Inf')} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+http_requests_total = Counter("driv_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = Histogram("driv_http_request_duration_seconds", "HTTP request latency", ("method", "route"), LATENCY_BUCKETS)
+mongo_commands_total = Counter("driv_mongo_commands_total", "Mongo commands by issuing route", ("route", "command", "collection"))
+mongo_command_duration = Histogram("driv_mongo_command_duration_seconds", "Mongo command latency", ("command", "collection"), LATENCY_BUCKETS)
+mongo_documents_returned = Counter("driv_mongo_documents_returned_total", "Documents returned to each route", ("route", "collection"))
+mongo_commands_per_request = Histogram("driv_mongo_commands_per_request", "Mongo commands issued per request", ("route",), COUNT_BUCKETS)
+admission_rejected_total = Counter("driv_admission_rejected_total", "Requests refused by admission control", ("reason",))
+METRICS = [http_requests_total, http_request_duration, mongo_commands_total, mongo_command_duration,
+           mongo_documents_returned, mongo_commands_per_request, admission_rejected_total]
+
+class RequestMetrics:
+    def __init__(self):
+        self.route = "unmatched"
+        self.commands: Dict[tuple, list] = {}  # (command, collection) -> [count, seconds, documents]
+        self.lock = threading.Lock()
+
+    def record(self, command: str, collection: str, seconds: float, documents: int):
+        with self.lock:
+            entry = self.commands.setdefault((command, collection), [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += documents
+
+    def breakdown(self) -> str:
+        return ", ".join(
+            f"{command} {collection} x{count} {seconds * 1000:.1f}ms {documents} docs"
+            for (command, collection), (count, seconds, documents) in sorted(self.commands.items(), key=lambda i: -i[1][1])
+        )
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+
+class MongoCommandListener(CommandListener):
+    def __init__(self):
+        self.pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self.pending[(event.connection_id, event.request_id)] = (collection, current_request.get())
+
+    def _finish(self, event, documents: int):
+        collection, metrics = self.pending.pop((event.connection_id, event.request_id), ("", None))
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe((event.command_name, collection), seconds)
+        if metrics is None:
+            mongo_commands_total.inc(("background", event.command_name, collection))
+            return
+        metrics.record(event.command_name, collection, seconds, documents)
+
+    def succeeded(self, event):
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor:
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+        elif event.command_name == "findAndModify":
+            documents = 1 if reply.get("value") is not None else 0
+        else:
+            documents = 0
+        self._finish(event, documents)
+
+    def failed(self, event):
+        self._finish(event, 0)
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request to its last body chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        status_code = [500]
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            label = route.path if route is not None else metrics.route
+            method = scope["method"]
+            http_requests_total.inc((method, label, status_code[0]))
+            http_request_duration.observe((method, label), elapsed)
+            commands = 0
+            for (command, collection), (count, _, documents) in metrics.commands.items():
+                commands += count
+                mongo_commands_total.inc((label, command, collection), count)
+                mongo_documents_returned.inc((label, collection), documents)
+            mongo_commands_per_request.observe((label,), commands)
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(f"Slow request {method} {label} {status_code[0]} {elapsed * 1000:.1f}ms; "
+                               f"{commands} mongo commands: {metrics.breakdown() or 'none'}")
+
+def render_metrics() -> bytes:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
 
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "driv-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.environ.get("PASSWORD_HASH_RETRY_AFTER", "1"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.environ.get("TOKEN_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.environ.get("USER_CACHE_TTL_SECONDS", "300"))
+VAULT_CACHE_SIZE = int(os.environ.get("VAULT_CACHE_SIZE", "50000"))
+VAULT_CACHE_TTL_SECONDS = int(os.environ.get("VAULT_CACHE_TTL_SECONDS", "300"))
+
+# Notification streaming
+NOTIFY_BACKEND = os.environ.get("NOTIFY_BACKEND", "local")  # "local" or "mongo"
+NOTIFY_QUEUE_SIZE = int(os.environ.get("NOTIFY_QUEUE_SIZE", "100"))
+NOTIFY_HEARTBEAT_SECONDS = int(os.environ.get("NOTIFY_HEARTBEAT_SECONDS", "15"))
+NOTIFY_REPLAY_LIMIT = int(os.environ.get("NOTIFY_REPLAY_LIMIT", "500"))
+NOTIFY_EVENTS_CAPPED_BYTES = int(os.environ.get("NOTIFY_EVENTS_CAPPED_BYTES", str(16 * 1024 * 1024)))
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_RETENTION_DAYS", "90"))
+UNREAD_RECOUNT_SECONDS = int(os.environ.get("UNREAD_RECOUNT_SECONDS", "3600"))
+TTL_MONITOR_SECONDS = 60  # how often mongod's TTL monitor deletes expired documents
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+
+# Admission control
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")  # "memory" or "mongo"
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "60"))
+RATE_LIMIT_USER_PER_SECOND = float(os.environ.get("RATE_LIMIT_USER_PER_SECOND", "20"))
+RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", "300"))
+RATE_LIMIT_IP_PER_SECOND = float(os.environ.get("RATE_LIMIT_IP_PER_SECOND", "30"))
+RATE_LIMIT_MEMORY_KEYS = int(os.environ.get("RATE_LIMIT_MEMORY_KEYS", "100000"))
+# Only set behind a reverse proxy. FORWARDED_FOR_HOPS is how many proxies append
+# to X-Forwarded-For; the client is that many entries from the right, since
+# anything further left was sent by the client and can be forged.
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "false").lower() == "true"
+FORWARDED_FOR_HOPS = int(os.environ.get("FORWARDED_FOR_HOPS", "1"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "256"))
+LOAD_SHED_LAG_MS = float(os.environ.get("LOAD_SHED_LAG_MS", "200"))
+LOAD_SHED_RETRY_AFTER = int(os.environ.get("LOAD_SHED_RETRY_AFTER", "1"))
+
+# Credential encryption
+MASTER_KEY_FILE = Path(os.environ.get("MASTER_KEY_FILE", str(ROOT_DIR / "master.key")))  # required; see generate_master_key.py
+DATA_KEY_CACHE_SIZE = int(os.environ.get("DATA_KEY_CACHE_SIZE", "10000"))
+DATA_KEY_CACHE_TTL_SECONDS = int(os.environ.get("DATA_KEY_CACHE_TTL_SECONDS", "600"))
+CRYPTO_WORKERS = int(os.environ.get("CRYPTO_WORKERS", "4"))
+CRYPTO_BATCH_SIZE = int(os.environ.get("CRYPTO_BATCH_SIZE", "256"))
+
+# Vault export
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", str(256 * 1024)))
+EXPORT_SIZE_TTL_SECONDS = int(os.environ.get("EXPORT_SIZE_TTL_SECONDS", "86400"))
+
+# Vault analysis
+AI_ANALYZER = os.environ.get("AI_ANALYZER", "rules")  # "rules" or "transformers"
+AI_MODEL_NAME = os.environ.get("AI_MODEL_NAME", "gpt2")
+AI_WORKERS = int(os.environ.get("AI_WORKERS", "1"))
+AI_MAX_NEW_TOKENS = int(os.environ.get("AI_MAX_NEW_TOKENS", "80"))
+AI_CACHE_SIZE = int(os.environ.get("AI_CACHE_SIZE", "10000"))
+AI_CACHE_TTL_SECONDS = int(os.environ.get("AI_CACHE_TTL_SECONDS", "86400"))
+
+# Search
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "auto")  # "auto", "mongo" or "memory"
+SEARCH_MEMORY_USERS = int(os.environ.get("SEARCH_MEMORY_USERS", "200"))
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "500"))
+# Searchable fields and their ranking weights; the first field is the result title
+SEARCH_FIELDS = {
+    "assets": {"name": 10, "description": 3, "url": 2},
+    "legacy_instructions": {"title": 10, "description": 3},
+    "trusted_parties": {"name": 10, "email": 5},
+}
+
+# Legacy instruction scheduler
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_POLL_SECONDS = float(os.environ.get("SCHEDULER_POLL_SECONDS", "30"))
+SCHEDULER_BATCH_SIZE = int(os.environ.get("SCHEDULER_BATCH_SIZE", "50"))
+SCHEDULER_CONCURRENCY = int(os.environ.get("SCHEDULER_CONCURRENCY", "8"))
+SCHEDULER_MAX_ATTEMPTS = int(os.environ.get("SCHEDULER_MAX_ATTEMPTS", "5"))
+SCHEDULER_LEASE_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", "300"))
+SCHEDULER_RETRY_BASE_SECONDS = int(os.environ.get("SCHEDULER_RETRY_BASE_SECONDS", "60"))
+
+# Email outbox
+EMAIL_TRANSPORT = os.environ.get("EMAIL_TRANSPORT", "mock")  # "mock" or "smtp"
+EMAIL_FROM = os.environ.get("EMAIL_FROM", "no-reply@driv.local")
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_USER = os.environ.get("SMTP_USER")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true").lower() == "true"
+EMAIL_POOL_SIZE = int(os.environ.get("EMAIL_POOL_SIZE", "4"))
+EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", "100"))
+EMAIL_RATE_PER_SECOND = float(os.environ.get("EMAIL_RATE_PER_SECOND", "50"))  # 0 disables
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SECONDS = int(os.environ.get("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_LEASE_SECONDS = int(os.environ.get("EMAIL_LEASE_SECONDS", "120"))
+EMAIL_POLL_SECONDS = float(os.environ.get("EMAIL_POLL_SECONDS", "2"))
+
+# Subscription auto-cancel
+CANCEL_PROVIDER = os.environ.get("CANCEL_PROVIDER", "mock")  # "mock" or "webhook"
+CANCEL_WEBHOOK_URL = os.environ.get("CANCEL_WEBHOOK_URL")
+CANCEL_BATCH_SIZE = int(os.environ.get("CANCEL_BATCH_SIZE", "25"))
+CANCEL_CONCURRENCY = int(os.environ.get("CANCEL_CONCURRENCY", "5"))
+CANCEL_MAX_ATTEMPTS = int(os.environ.get("CANCEL_MAX_ATTEMPTS", "3"))
+CANCEL_RETRY_BASE_SECONDS = float(os.environ.get("CANCEL_RETRY_BASE_SECONDS", "2"))
+CANCEL_LEASE_SECONDS = int(os.environ.get("CANCEL_LEASE_SECONDS", "300"))
+CANCEL_POLL_SECONDS = float(os.environ.get("CANCEL_POLL_SECONDS", "60"))
+
+# Cascade deletion
+DELETION_BATCH_SIZE = int(os.environ.get("DELETION_BATCH_SIZE", "500"))
+DELETION_BATCH_PAUSE_SECONDS = float(os.environ.get("DELETION_BATCH_PAUSE_SECONDS", "0.05"))
+DELETION_LEASE_SECONDS = int(os.environ.get("DELETION_LEASE_SECONDS", "300"))
+DELETION_POLL_SECONDS = float(os.environ.get("DELETION_POLL_SECONDS", "60"))
+DELETION_JOB_RETENTION_DAYS = int(os.environ.get("DELETION_JOB_RETENTION_DAYS", "30"))
 
 # Create the main app
-app = FastAPI(title="DRIV - Digital Rights Inheritance Vault")
+app = FastAPI(title="DRIV - Digital Rights Inheritance Vault", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Enums
@@ -104,7 +424,9 @@ class Asset(BaseModel):
     name: str
     category: AssetCategory
     description: Optional[str] = None
-    credentials: Optional[str] = None  # Encrypted
+    # CREDENTIALS_REDACTED; the sealed value is in credentials_encrypted. Rows
+    # written before encryption hold plaintext until encrypt_credentials.py runs
+    credentials: Optional[str] = None
     url: Optional[str] = None
     value: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
@@ -201,6 +523,9 @@ class NotificationCreate(BaseModel):
     message: str
     type: str = "info"
 
+class NotificationReadRequest(BaseModel):
+    ids: List[str] = Field(max_length=1000)
+
 class Subscription(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -212,6 +537,8 @@ class Subscription(BaseModel):
     last_payment_date: Optional[datetime] = None
     auto_cancel_enabled: bool = False
     oauth_connected: bool = False
+    cancel_status: Optional[str] = None  # "cancelled" or "failed", set by the auto-cancel job
+    cancelled_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class SubscriptionCreate(BaseModel):
@@ -221,6 +548,16 @@ class SubscriptionCreate(BaseModel):
     billing_cycle: str
     auto_cancel_enabled: bool = False
 
+class BulkRowError(BaseModel):
+    row: int  # 1-based position in the upload, excluding any CSV header
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    errors: List[BulkRowError]
+
 class AIAnalysisRequest(BaseModel):
     vault_id: str
     analysis_type: str  # "asset_summary", "risk_assessment", "recommendation"
@@ -231,6 +568,495 @@ class AIAnalysisResponse(BaseModel):
     result: str
     generated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Fields stored as BSON dates. Documents written before the switch from ISO
+# strings keep parsing through the models until migrate_datetimes.py rewrites them.
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "vaults": ["created_at", "updated_at"],
+    "assets": ["created_at"],
+    "legacy_instructions": ["created_at", "execution_date"],
+    "trusted_parties": ["created_at", "signed_at"],
+    "death_verifications": ["created_at", "verified_at"],
+    "notifications": ["created_at"],
+    "subscriptions": ["created_at", "last_payment_date"],
+    "user_stats": ["rebuilt_at", "unread_counted_at"],
+}
+
+# Indexes
+# Every query the routes issue must be served by one of these. Declared in one
+# place and created idempotently on startup; QUERY_SHAPES mirrors the filters
+# and sorts used by the routes so check_query_plans() can catch COLLSCANs.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "vaults": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING)], name="user_created"),
+        IndexModel([("user_id", ASCENDING), ("deleted_at", ASCENDING)], name="user_deleted"),
+    ],
+    "assets": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("vault_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_vault_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+        IndexModel([("user_id", ASCENDING), *((field, TEXT) for field in SEARCH_FIELDS["assets"])],
+                   weights=SEARCH_FIELDS["assets"], name="user_text"),
+    ],
+    "legacy_instructions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("is_executed", ASCENDING), ("execution_date", ASCENDING)], name="due_execution"),
+        IndexModel([("claim_token", ASCENDING)], sparse=True, name="claim_token"),
+        IndexModel([("vault_id", ASCENDING), ("execution_date", ASCENDING)], name="vault_execution"),
+        IndexModel([("user_id", ASCENDING), ("vault_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_vault_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+        IndexModel([("user_id", ASCENDING), *((field, TEXT) for field in SEARCH_FIELDS["legacy_instructions"])],
+                   weights=SEARCH_FIELDS["legacy_instructions"], name="user_text"),
+    ],
+    "trusted_parties": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("vault_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_vault_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+        IndexModel([("vault_id", ASCENDING), ("role", ASCENDING)], name="vault_role"),
+        IndexModel([("user_id", ASCENDING), *((field, TEXT) for field in SEARCH_FIELDS["trusted_parties"])],
+                   weights=SEARCH_FIELDS["trusted_parties"], name="user_text"),
+    ],
+    "death_verifications": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("vault_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_vault_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+        IndexModel([("vault_id", ASCENDING), ("status", ASCENDING)], name="vault_status"),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+        IndexModel([("user_id", ASCENDING), ("is_read", ASCENDING)], name="user_unread"),
+        # Retention: the server deletes notifications NOTIFICATION_RETENTION_DAYS after creation
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=NOTIFICATION_RETENTION_DAYS * 86400, name="created_at_ttl"),
+    ],
+    "subscriptions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_page"),
+    ],
+    "subscription_spend": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "deletion_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease"),
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=DELETION_JOB_RETENTION_DAYS * 86400, name="finished_at_ttl"),
+    ],
+    "cancellation_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease"),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        IndexModel([("claim_token", ASCENDING)], sparse=True, name="claim_token"),
+    ],
+    "vault_quorum": [
+        IndexModel([("vault_id", ASCENDING)], unique=True, name="vault_id_unique"),
+    ],
+    "vault_keys": [
+        IndexModel([("vault_id", ASCENDING)], unique=True, name="vault_id_unique"),
+    ],
+    "rate_limits": [
+        IndexModel([("key", ASCENDING)], unique=True, name="key_unique"),
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=3600, name="updated_at_ttl"),
+    ],
+    "vault_exports": [
+        IndexModel([("vault_id", ASCENDING), ("etag", ASCENDING)], unique=True, name="vault_etag_unique"),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=EXPORT_SIZE_TTL_SECONDS, name="created_at_ttl"),
+    ],
+    "revoked_tokens": [
+        IndexModel([("token_digest", ASCENDING)], unique=True, name="token_digest_unique"),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+}
+
+# List endpoints page in this order; see list_page().
+PAGE_SORT = [("created_at", ASCENDING), ("id", ASCENDING)]
+
+# (collection, filter, sort) for every find/count/update/delete the routes issue.
+# Values are placeholders; only the shape matters to the planner.
+QUERY_SHAPES: List[tuple] = [
+    ("users", {"email": "x"}, None),
+    ("users", {"id": "x"}, None),
+    ("vaults", {"user_id": "x"}, None),
+    ("vaults", {"user_id": "x", "deleted_at": None}, None),
+    ("vaults", {"id": "x", "user_id": "x", "deleted_at": None}, None),
+    ("vaults", {"id": {"$in": ["x", "y"]}, "deleted_at": None}, None),
+    ("vaults", {"id": "x"}, None),
+    ("assets", {"user_id": "x"}, PAGE_SORT),
+    ("assets", {"user_id": "x", "vault_id": "x"}, PAGE_SORT),
+    ("assets", {"id": "x", "user_id": "x"}, None),
+    ("legacy_instructions", {"user_id": "x"}, PAGE_SORT),
+    ("legacy_instructions", {"user_id": "x", "vault_id": "x"}, PAGE_SORT),
+    ("legacy_instructions", {"id": "x", "user_id": "x"}, None),
+    ("legacy_instructions", {"is_executed": False, "execution_date": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}, "dead_at": None}, [("execution_date", ASCENDING)]),
+    ("legacy_instructions", {"claim_token": "x"}, None),
+    ("legacy_instructions", {"vault_id": "x", "is_executed": False, "execution_date": None}, None),
+    ("trusted_parties", {"user_id": "x"}, PAGE_SORT),
+    ("trusted_parties", {"user_id": "x", "vault_id": "x"}, PAGE_SORT),
+    ("trusted_parties", {"id": "x", "user_id": "x"}, None),
+    ("trusted_parties", {"vault_id": "x", "role": "verifier"}, None),
+    *((collection, {"user_id": "x", "$text": {"$search": "x"}}, None) for collection in SEARCH_FIELDS),
+    *((collection, {"user_id": "x", "$and": [{"$or": [{field: {"$regex": "x"}} for field in SEARCH_FIELDS[collection]]}]}, None)
+      for collection in SEARCH_FIELDS),
+    ("death_verifications", {"user_id": "x"}, PAGE_SORT),
+    ("death_verifications", {"user_id": "x", "vault_id": "x"}, PAGE_SORT),
+    ("death_verifications", {"id": "x", "user_id": "x"}, None),
+    ("death_verifications", {"vault_id": "x", "status": "verified"}, None),
+    ("notifications", {"user_id": "x"}, [("created_at", DESCENDING)]),
+    ("notifications", {"id": "x", "user_id": "x"}, None),
+    ("notifications", {"user_id": "x", "is_read": False}, None),
+    ("notifications", {"user_id": "x", "id": {"$in": ["x", "y"]}, "is_read": False}, None),
+    ("notifications", {"user_id": "x", "$or": [{"created_at": {"$gt": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, {"created_at": datetime(2000, 1, 1, tzinfo=timezone.utc), "id": {"$gt": "x"}}]}, PAGE_SORT),
+    ("subscriptions", {"user_id": "x"}, PAGE_SORT),
+    ("subscriptions", {"id": "x", "user_id": "x"}, None),
+    ("subscriptions", {"user_id": "x", "cancelled_at": None}, None),
+    ("subscriptions", {"user_id": "x", "auto_cancel_enabled": True, "cancel_status": None}, PAGE_SORT),
+    ("subscription_spend", {"user_id": "x", "version": 1}, None),
+    ("cancellation_jobs", {"user_id": "x"}, None),
+    ("cancellation_jobs", {"status": "running", "$or": [{"lease_until": None}, {"lease_until": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}]}, None),
+    ("user_stats", {"user_id": "x"}, None),
+    ("user_stats", {"user_id": "x", "unread_counted_at": {"$gte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, None),
+    ("revoked_tokens", {"token_digest": {"$in": ["x", "user:x"]}}, None),
+    ("deletion_jobs", {"id": "x", "user_id": "x"}, None),
+    ("deletion_jobs", {"status": "running", "$or": [{"lease_until": None}, {"lease_until": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}]}, None),
+    ("vault_quorum", {"vault_id": "x"}, None),
+    ("vault_keys", {"vault_id": "x"}, None),
+    ("vault_exports", {"vault_id": "x", "etag": "x"}, None),
+    ("rate_limits", {"key": "x"}, None),
+    ("email_outbox", {"status": "pending", "next_attempt_at": {"$lte": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, [("next_attempt_at", ASCENDING)]),
+    ("email_outbox", {"claim_token": "x"}, None),
+]
+
+async def sync_ttl_indexes(database, collection: str, models: List[IndexModel]):
+    """Apply a changed expireAfterSeconds to TTL indexes that already exist.
+
+    create_indexes() rejects an existing index whose options differ, so
+    retention settings like NOTIFICATION_RETENTION_DAYS are changed in place
+    with collMod instead.
+    """
+    ttls = {model.document["name"]: model.document["expireAfterSeconds"]
+            for model in models if "expireAfterSeconds" in model.document}
+    if not ttls:
+        return
+    existing = await database[collection].index_information()
+    for name, seconds in ttls.items():
+        current = existing.get(name, {}).get("expireAfterSeconds")
+        if current is not None and int(current) != seconds:
+            await database.command("collMod", collection, index={"name": name, "expireAfterSeconds": seconds})
+            logger.info(f"Changed TTL of {collection}.{name} from {int(current)}s to {seconds}s")
+
+async def ensure_indexes(database=None):
+    """Create all declared indexes. Safe to call repeatedly."""
+    database = db if database is None else database
+    for collection, models in INDEXES.items():
+        try:
+            await sync_ttl_indexes(database, collection, models)
+            await database[collection].create_indexes(models)
+        except OperationFailure as e:
+            logger.error(f"Failed to create indexes on {collection}: {e}")
+
+def _plan_stages(plan) -> List[str]:
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+        return stages
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _plan_stages(item)]
+    return []
+
+async def check_query_plans(database=None) -> List[str]:
+    """Explain every entry in QUERY_SHAPES and return the ones that COLLSCAN."""
+    database = db if database is None else database
+    failures = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = database[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        if "COLLSCAN" in _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {})):
+            failures.append(f"{collection} {query} sort={sort}")
+    return failures
+
+# Caches
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+# Verified JWT payloads keyed by token digest, never cached past the token's exp.
+# Entries are short-lived so a revocation made on another worker takes effect
+# within TOKEN_CACHE_TTL_SECONDS; revocations made here take effect immediately.
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+# User models for /auth/me; call invalidate_user() whenever a user document changes.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+# vault id -> owning user id, used to authorize writes without a vaults read.
+# Only confirmed owners are cached; call invalidate_vault() on any vault mutation.
+vault_owner_cache = TTLCache(VAULT_CACHE_SIZE, VAULT_CACHE_TTL_SECONDS)
+# token digest -> exp (epoch seconds) for tokens revoked by this process; a
+# deleted account is stored under "user:<id>", revoking every token it holds
+revoked_token_digests: Dict[str, float] = {}
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def invalidate_user(user_id: str):
+    user_cache.invalidate(user_id)
+
+def invalidate_vault(vault_id: str):
+    vault_owner_cache.invalidate(vault_id)
+
+async def owned_vault_ids(vault_ids, user_id: str) -> set:
+    """Return the subset of vault_ids owned by user_id, reading only cache misses."""
+    owned, missing = set(), []
+    for vault_id in set(vault_ids):
+        owner = vault_owner_cache.get(vault_id)
+        if owner is None:
+            missing.append(vault_id)
+        elif owner == user_id:
+            owned.add(vault_id)
+    if missing:
+        vaults = await db.vaults.find(
+            {"id": {"$in": missing}, "deleted_at": None}, {"_id": 0, "id": 1, "user_id": 1}
+        ).to_list(len(missing))
+        for vault in vaults:
+            vault_owner_cache.set(vault["id"], vault["user_id"])
+            if vault["user_id"] == user_id:
+                owned.add(vault["id"])
+    return owned
+
+async def authorize_vault(vault_id: str, user_id: str):
+    """Raise 404 unless user_id owns vault_id."""
+    if vault_id not in await owned_vault_ids([vault_id], user_id):
+        raise HTTPException(status_code=404, detail="Vault not found")
+
+async def is_token_revoked(digest: str, user_id: str) -> bool:
+    if digest in revoked_token_digests or f"user:{user_id}" in revoked_token_digests:
+        return True
+    return await db.revoked_tokens.find_one(
+        {"token_digest": {"$in": [digest, f"user:{user_id}"]}}, {"_id": 1}
+    ) is not None
+
+async def revoke_token(digest: str, exp: float):
+    revoked_token_digests[digest] = exp
+    token_cache.invalidate(digest)
+    now = time.time()
+    for other, other_exp in list(revoked_token_digests.items()):
+        if other_exp <= now:
+            del revoked_token_digests[other]
+    await db.revoked_tokens.update_one(
+        {"token_digest": digest},
+        {"$set": {"token_digest": digest, "expires_at": datetime.fromtimestamp(exp, timezone.utc)}},
+        upsert=True
+    )
+
+# Admission control
+# Token buckets charge each authenticated request to its user and each auth
+# request (login/register, which run bcrypt) to its client IP; expensive routes
+# cost more tokens. Buckets live in this process ("memory") or in Mongo
+# ("mongo") so several workers draw down one shared budget. Independently,
+# AdmissionMiddleware sheds load with 503 once MAX_CONCURRENT_REQUESTS are in
+# flight or the event loop is lagging by more than LOAD_SHED_LAG_MS.
+#
+# Without TRUST_FORWARDED_FOR the IP bucket is keyed on the socket peer. Behind
+# a proxy, or a NAT such as Docker's published ports, that is the same address
+# for every client, so the defaults are sized for one bucket shared by the whole
+# site: 100 logins, then 10 a second, about what PASSWORD_HASH_WORKERS hash.
+# Behind a proxy that sets X-Forwarded-For, set TRUST_FORWARDED_FOR and lower
+# RATE_LIMIT_IP_BURST/_PER_SECOND to a per-client budget.
+RATE_LIMIT_COSTS = {
+    "/api/auth/login": 3,
+    "/api/auth/register": 5,
+    "/api/analytics/dashboard": 3,
+    "/api/analytics/dashboard/rebuild": 10,
+    "/api/ai/analyze": 10,
+    "/api/vaults/{vault_id}/overview": 3,
+    "/api/vaults/{vault_id}/export": 20,
+    "/api/vaults/{vault_id}/credentials": 10,
+    "/api/assets/bulk": 20,
+    "/api/legacy-instructions/bulk": 20,
+    "/api/trusted-parties/bulk": 20,
+}
+
+def route_cost(request: Request) -> float:
+    route = request.scope.get("route")
+    return RATE_LIMIT_COSTS.get(route.path if route is not None else request.url.path, 1)
+
+class MemoryRateLimitBackend:
+    def __init__(self, max_keys: int = RATE_LIMIT_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def take(self, key: str, cost: float, burst: float, rate: float) -> float:
+        """Take cost tokens; return 0 if allowed, else seconds until they would be."""
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+class MongoRateLimitBackend:
+    """Buckets shared by all workers, refilled and charged in one atomic update."""
+
+    def __init__(self, database=None):
+        self.database = database
+
+    @property
+    def collection(self):
+        return (db if self.database is None else self.database).rate_limits
+
+    async def take(self, key: str, cost: float, burst: float, rate: float) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        bucket = await self.collection.find_one_and_update(
+            {"key": key},
+            [
+                {"$set": {"tokens": {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]},
+                          "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            projection={"_id": 0, "tokens": 1, "allowed": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0.0 if bucket["allowed"] else (cost - bucket["tokens"]) / rate
+
+class RateLimiter:
+    def __init__(self, backend, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.enabled = enabled
+
+    async def charge(self, key: str, cost: float, burst: float, rate: float):
+        if not self.enabled:
+            return
+        wait = await self.backend.take(key, cost, burst, rate)
+        if wait > 0:
+            admission_rejected_total.inc((key.split(":", 1)[0],))
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+rate_limiter = RateLimiter(MongoRateLimitBackend() if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimitBackend())
+
+def client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(",")]
+            return hops[max(0, len(hops) - FORWARDED_FOR_HOPS)]
+    return request.client.host if request.client else "unknown"
+
+async def limit_by_ip(request: Request):
+    await rate_limiter.charge(f"ip:{client_ip(request)}", route_cost(request), RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_SECOND)
+
+class AdmissionMiddleware:
+    """Sheds requests with 503 before the worker saturates."""
+
+    exempt_paths = ("/metrics", "/api/notifications/stream")
+
+    def __init__(self, app, max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                 max_lag_ms: float = LOAD_SHED_LAG_MS, retry_after: int = LOAD_SHED_RETRY_AFTER):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_lag_ms = max_lag_ms
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.lag_ms = 0.0
+        self.monitor: Optional[asyncio.Task] = None
+
+    async def _monitor_lag(self, interval: float = 0.1):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.lag_ms = max(0.0, (loop.time() - expected) * 1000)
+
+    async def _reject(self, send, reason: str):
+        admission_rejected_total.inc((reason,))
+        body = json.dumps({"detail": "Server busy, please retry"}).encode()
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(self.retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            return await self.app(scope, receive, send)
+        if self.monitor is None:
+            self.monitor = asyncio.create_task(self._monitor_lag())
+        if self.in_flight >= self.max_concurrent:
+            return await self._reject(send, "concurrency")
+        if self.lag_ms > self.max_lag_ms:
+            return await self._reject(send, "loop_lag")
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
 # Auth utilities
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -238,6 +1064,43 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordWorkerPool:
+    """Runs bcrypt on dedicated threads so it never blocks the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `workers + queue_size` jobs may be pending; beyond that requests
+    are shed with 503 and Retry-After instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, queue_size: int, retry_after: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.capacity = workers + queue_size
+        self.retry_after = retry_after
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service busy, please retry",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+password_pool = PasswordWorkerPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE, PASSWORD_HASH_RETRY_AFTER)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -248,16 +1111,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    token = credentials.credentials
+    digest = token_digest(token)
+    payload = token_cache.get(digest)
+    if payload is None or digest in revoked_token_digests or f"user:{payload['sub']}" in revoked_token_digests:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        return {"user_id": user_id}
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        if payload.get("sub") is None or await is_token_revoked(digest, payload["sub"]):
+            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        token_cache.set(digest, payload, ttl=payload["exp"] - time.time())
+    await rate_limiter.charge(f"user:{payload['sub']}", route_cost(request), RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_SECOND)
+    return {"user_id": payload["sub"], "token_digest": digest, "exp": payload["exp"]}
+
+async def get_stream_user(request: Request, access_token: Optional[str] = None,
+                          credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> dict:
+    """get_current_user for streaming endpoints; EventSource cannot set headers,
+    so the token may also arrive as the access_token query parameter."""
+    if credentials is None:
+        if not access_token:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+    return await get_current_user(request, credentials)
+
+async def require_metrics_token(request: Request,
+                                credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Guards /metrics and the */stats routes, which report process-wide
+    figures rather than anything belonging to the caller. With METRICS_TOKEN
+    set only that token is accepted; without it any signed-in user is."""
+    if not METRICS_TOKEN:
+        if credentials is None:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+        await get_current_user(request, credentials)
+    elif credentials is None or credentials.credentials != METRICS_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
 
 # Mock email service
 async def send_mock_email(to_email: str, subject: str, body: str):
@@ -266,8 +1155,2290 @@ async def send_mock_email(to_email: str, subject: str, body: str):
     # In production, integrate with SMTP provider
     return True
 
+# User stats
+# One document per user holding the dashboard counters. Create/delete routes
+# keep it current with $inc; rebuild_user_stats() recomputes it from the source
+# collections when it is missing or needs repair.
+STATS_COUNTERS = ["vaults", "assets", "legacy_instructions", "trusted_parties", "verifications", "unread_notifications"]
+
+# Counter -> collection whose list responses it describes. Bumping a counter also
+# bumps versions.<collection> in the same update; GET routes derive their ETags
+# from those versions (see conditional_get()).
+STATS_VERSIONS = {
+    "vaults": "vaults",
+    "assets": "assets",
+    "asset_breakdown": "assets",
+    "legacy_instructions": "legacy_instructions",
+    "trusted_parties": "trusted_parties",
+    "verifications": "death_verifications",
+    "unread_notifications": "notifications",
+}
+
+async def bump_user_stats(user_id: str, deltas: Dict[str, int], versions: tuple = ()):
+    touched = set(versions)
+    for key in deltas:
+        counter = key.split(".", 1)[0]
+        if counter in STATS_VERSIONS:
+            touched.add(STATS_VERSIONS[counter])
+    update = {**deltas, **{f"versions.{collection}": 1 for collection in touched}}
+    await db.user_stats.update_one({"user_id": user_id}, {"$inc": update}, upsert=True)
+
+async def bump_user_versions(user_id: str, *collections: str):
+    """For mutations that change a list without changing any counter"""
+    await bump_user_stats(user_id, {}, versions=collections)
+
+async def rebuild_user_stats(user_id: str) -> dict:
+    query = {"user_id": user_id}
+    # Data in vaults awaiting the deletion reaper is no longer counted
+    current = await db.user_stats.find_one(query, {"_id": 0, "deleted_vaults": 1})
+    deleted_vaults = (current or {}).get("deleted_vaults")
+    scoped = {**query, "vault_id": {"$nin": deleted_vaults}} if deleted_vaults else query
+    asset_facets, vaults, instructions, parties, verifications, unread = await asyncio.gather(
+        db.assets.aggregate([
+            {"$match": scoped},
+            {"$facet": {
+                "total": [{"$count": "count"}],
+                "by_category": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            }},
+        ]).to_list(1),
+        db.vaults.count_documents({**query, "deleted_at": None}),
+        db.legacy_instructions.count_documents(scoped),
+        db.trusted_parties.count_documents(scoped),
+        db.death_verifications.count_documents(scoped),
+        db.notifications.count_documents({**query, "is_read": False}),
+    )
+    facets = asset_facets[0]
+    now = datetime.now(timezone.utc)
+    stats = {
+        "user_id": user_id,
+        "vaults": vaults,
+        "assets": facets["total"][0]["count"] if facets["total"] else 0,
+        "legacy_instructions": instructions,
+        "trusted_parties": parties,
+        "verifications": verifications,
+        "asset_breakdown": _enum_counts(facets["by_category"], AssetCategory, fallback=AssetCategory.OTHER),
+        "unread_notifications": unread,
+        "unread_counted_at": now,
+        "rebuilt_at": now,
+    }
+    # $set rather than replace so versions survive a rebuild; they are bumped
+    # because the rebuilt counters may differ from what clients have cached
+    return await db.user_stats.find_one_and_update(
+        {"user_id": user_id},
+        {"$set": stats, "$inc": {f"versions.{collection}": 1 for collection in set(STATS_VERSIONS.values())}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def recount_unread_notifications(user_id: str) -> int:
+    """Reset the unread counter from the collection.
+
+    The TTL monitor deletes expired notifications without touching the counter,
+    so it can drift upward; reads recount it every UNREAD_RECOUNT_SECONDS.
+    """
+    unread = await db.notifications.count_documents({"user_id": user_id, "is_read": False})
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$set": {"unread_notifications": unread, "unread_counted_at": datetime.now(timezone.utc)},
+         "$inc": {"versions.notifications": 1}},
+        upsert=True
+    )
+    return unread
+
+# Serialization
+# Documents read back from Mongo were validated by their model on write, so read
+# endpoints skip a second validation pass: rows are built with model_construct()
+# and dumped to JSON bytes by a cached TypeAdapter. Fields outside the model are
+# still dropped and defaults still filled in.
+_adapters: Dict[Any, TypeAdapter] = {}
+
+def _adapter(tp) -> TypeAdapter:
+    adapter = _adapters.get(tp)
+    if adapter is None:
+        adapter = _adapters[tp] = TypeAdapter(tp)
+    return adapter
+
+def dump_row(model, doc: dict) -> bytes:
+    return _adapter(model).dump_json(model.model_construct(**doc), warnings=False)
+
+def fast_list_response(model, docs: List[dict], headers: Optional[Dict[str, str]] = None) -> Response:
+    rows = [model.model_construct(**doc) for doc in docs]
+    body = _adapter(List[model]).dump_json(rows, warnings=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Death verification quorum
+# One document per vault counting submitted and verified verifications and
+# registered verifiers, kept current with $inc by the verification and
+# trusted-party routes. The unlock is a single conditional update on that
+# document, so it fires exactly once however many submissions race. Every $inc
+# also bumps seq, so a recount only replaces the counters if none moved while
+# it was counting.
+QUORUM_MIN_VERIFIED = 2
+QUORUM_VERIFIER_RATIO = 0.66
+
+async def rebuild_vault_quorum(vault_id: str):
+    """Recount the vault's quorum from the source collections."""
+    while True:
+        current = await db.vault_quorum.find_one({"vault_id": vault_id}, {"_id": 0, "seq": 1})
+        submitted, verified, verifiers = await asyncio.gather(
+            db.death_verifications.count_documents({"vault_id": vault_id}),
+            db.death_verifications.count_documents({"vault_id": vault_id, "status": VerificationStatus.VERIFIED.value}),
+            db.trusted_parties.count_documents({"vault_id": vault_id, "role": RoleType.VERIFIER.value}),
+        )
+        counts = {
+            "submitted": submitted,
+            "verified": verified,
+            "verifiers": verifiers,
+            "rebuilt_at": datetime.now(timezone.utc),
+        }
+        if current is None:
+            try:
+                await db.vault_quorum.insert_one({"vault_id": vault_id, "seq": 0, **counts})
+                return
+            except DuplicateKeyError:
+                continue  # created by an $inc while counting
+        result = await db.vault_quorum.update_one({"vault_id": vault_id, "seq": current.get("seq")}, {"$set": counts})
+        if result.matched_count:
+            return
+        # An $inc landed mid-count and would be overwritten; count again
+
+async def update_vault_quorum(vault_id: str, deltas: Dict[str, int]) -> bool:
+    """Apply counter deltas, then unlock the vault if the threshold is now met.
+
+    Returns True only for the call that performed the unlock.
+    """
+    quorum = await db.vault_quorum.find_one_and_update(
+        {"vault_id": vault_id},
+        {"$inc": {**deltas, "seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if "rebuilt_at" not in quorum:
+        # Vault predates quorum tracking; count once from the source collections
+        await rebuild_vault_quorum(vault_id)
+
+    unlocked_at = datetime.now(timezone.utc)
+    unlocked = await db.vault_quorum.find_one_and_update(
+        {
+            "vault_id": vault_id,
+            "unlocked": {"$ne": True},
+            "$expr": {"$gte": ["$verified", {"$max": [
+                QUORUM_MIN_VERIFIED, {"$multiply": ["$verifiers", QUORUM_VERIFIER_RATIO]}
+            ]}]},
+        },
+        {"$set": {"unlocked": True, "unlocked_at": unlocked_at}}
+    )
+    if unlocked is None:
+        return False
+
+    # If threshold met, trigger vault unlock (mock)
+    vault = await db.vaults.find_one_and_update(
+        {"id": vault_id}, {"$set": {"is_locked": False}}, projection={"_id": 0, "user_id": 1, "name": 1}
+    )
+    logger.info(f"Vault {vault_id} unlocked after verification threshold met")
+    await instruction_scheduler.schedule_vault(vault_id, unlocked_at)
+    if vault:
+        await bump_user_versions(vault["user_id"], "vaults")
+        await notify_user(vault["user_id"], "Vault unlocked",
+                          f"Vault '{vault['name']}' was unlocked after death verification reached quorum.", "alert")
+        await auto_cancel_engine.start(vault["user_id"], vault_id)
+    return True
+
+# Legacy instruction scheduler
+# When a vault unlocks, each pending instruction gets execution_date =
+# unlock time + delay_days. Workers claim due instructions in batches: a batch
+# of candidate ids is stamped with a fresh claim_token and lease in one
+# update_many, and only documents carrying that token are executed, so several
+# workers never run the same instruction. Expired leases become claimable again,
+# failures back off exponentially, and completion is conditional on the token.
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def instruction_recipient(instruction: dict) -> str:
+    # target_email is optional on the model, but these actions have no one else to reach
+    if not instruction.get("target_email"):
+        raise ValueError(f"Legacy instruction {instruction['id']} has no target_email")
+    return instruction["target_email"]
+
+async def execute_send_message(instruction: dict):
+    await enqueue_email(
+        instruction_recipient(instruction),
+        instruction["title"],
+        instruction.get("message_content") or instruction.get("description") or ""
+    )
+
+async def execute_notify(instruction: dict):
+    await enqueue_email(
+        instruction_recipient(instruction),
+        f"DRIV notification: {instruction['title']}",
+        instruction.get("description") or instruction.get("message_content") or ""
+    )
+
+async def execute_mock_action(instruction: dict):
+    # In production, integrate with the asset custodian / provider APIs
+    logger.info(f"[MOCK ACTION] {instruction['action_type']} for instruction {instruction['id']}")
+    if instruction.get("target_email"):
+        await enqueue_email(instruction["target_email"], instruction["title"], instruction.get("description") or "")
+
+INSTRUCTION_HANDLERS = {
+    ActionType.SEND_MESSAGE.value: execute_send_message,
+    ActionType.NOTIFY.value: execute_notify,
+    ActionType.TRANSFER_ASSET.value: execute_mock_action,
+    ActionType.DELETE_ACCOUNT.value: execute_mock_action,
+    ActionType.DONATE.value: execute_mock_action,
+}
+
+class ClaimingWorker:
+    """Base for workers that claim due documents in batches and process them on
+    a bounded pool; `database` and `clock` are injectable.
+
+    Subclasses set `collection_name`, `order_field` (the due-date field),
+    `done_counter`, `label` and `poll_seconds`, and implement _due() and
+    _process(), which bumps `done_counter` on success.
+    """
+
+    collection_name: str
+    order_field: str
+    done_counter: str
+    label: str
+    poll_seconds: float
+
+    def __init__(self, database, clock, batch_size: int, concurrency: int, max_attempts: int,
+                 lease_seconds: int, retry_base_seconds: int):
+        self.database = database
+        self.clock = clock
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.counters = {"claimed": 0, self.done_counter: 0, "retried": 0, "dead": 0, "batches": 0}
+        self.last_run = {self.done_counter: 0, "seconds": 0.0, "per_second": 0.0}
+
+    @property
+    def collection(self):
+        return (db if self.database is None else self.database)[self.collection_name]
+
+    def _due(self, now: datetime) -> dict:
+        """Query for documents ready to be claimed at `now`, unleased or with an expired lease."""
+        raise NotImplementedError
+
+    async def _process(self, doc: dict, slots: asyncio.Semaphore):
+        raise NotImplementedError
+
+    async def claim_batch(self) -> List[dict]:
+        now = self.clock()
+        due = self._due(now)
+        candidates = await self.collection.find(due, {"_id": 0, "id": 1}).sort(self.order_field, ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        token = str(uuid.uuid4())
+        await self.collection.update_many(
+            {**due, "id": {"$in": [c["id"] for c in candidates]}},
+            {"$set": {"claim_token": token, "lease_until": now + timedelta(seconds=self.lease_seconds)}}
+        )
+        claimed = await self.collection.find({"claim_token": token}, {"_id": 0}).to_list(self.batch_size)
+        self.counters["claimed"] += len(claimed)
+        self.counters["batches"] += 1
+        return claimed
+
+    async def run_once(self) -> int:
+        """Process everything that is due now. Returns how many succeeded."""
+        started = time.perf_counter()
+        done_before = self.counters[self.done_counter]
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            batch = await self.claim_batch()
+            if not batch:
+                break
+            await asyncio.gather(*(self._process(doc, slots) for doc in batch))
+        done = self.counters[self.done_counter] - done_before
+        elapsed = time.perf_counter() - started
+        self.last_run = {
+            self.done_counter: done,
+            "seconds": round(elapsed, 4),
+            "per_second": round(done / elapsed, 2) if elapsed else 0.0,
+        }
+        return done
+
+    async def run_forever(self, poll_seconds: Optional[float] = None):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"{self.label} pass failed: {e}")
+            await asyncio.sleep(self.poll_seconds if poll_seconds is None else poll_seconds)
+
+    def stats(self) -> dict:
+        return {**self.counters, "last_run": self.last_run}
+
+class InstructionScheduler(ClaimingWorker):
+    """Claims due legacy instructions and runs them on a bounded worker pool."""
+
+    collection_name = "legacy_instructions"
+    order_field = "execution_date"
+    done_counter = "executed"
+    label = "Legacy instruction scheduler"
+    poll_seconds = SCHEDULER_POLL_SECONDS
+
+    def __init__(self, handlers: Dict[str, Any], database=None, clock=utc_now,
+                 batch_size: int = SCHEDULER_BATCH_SIZE, concurrency: int = SCHEDULER_CONCURRENCY,
+                 max_attempts: int = SCHEDULER_MAX_ATTEMPTS, lease_seconds: int = SCHEDULER_LEASE_SECONDS,
+                 retry_base_seconds: int = SCHEDULER_RETRY_BASE_SECONDS):
+        super().__init__(database, clock, batch_size, concurrency, max_attempts, lease_seconds, retry_base_seconds)
+        self.handlers = handlers
+        self.counters["scheduled"] = 0
+
+    async def schedule_vault(self, vault_id: str, unlocked_at: Optional[datetime] = None) -> int:
+        """Stamp execution_date on every unscheduled instruction in the vault."""
+        unlocked_at = unlocked_at or self.clock()
+        if unlocked_at.tzinfo is None:
+            unlocked_at = unlocked_at.replace(tzinfo=timezone.utc)
+        pending = {"vault_id": vault_id, "is_executed": False, "execution_date": None}
+        scheduled = 0
+        # One update per distinct delay rather than per instruction
+        for delay_days in await self.collection.distinct("delay_days", pending):
+            result = await self.collection.update_many(
+                {**pending, "delay_days": delay_days},
+                {"$set": {"execution_date": unlocked_at + timedelta(days=delay_days or 0), "attempts": 0}}
+            )
+            scheduled += result.modified_count
+        if scheduled:
+            await self._bump_versions(vault_id)
+        self.counters["scheduled"] += scheduled
+        logger.info(f"Scheduled {scheduled} legacy instructions for vault {vault_id}")
+        return scheduled
+
+    def _due(self, now: datetime) -> dict:
+        return {
+            "is_executed": False,
+            "execution_date": {"$lte": now},
+            "dead_at": None,
+            "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}],
+        }
+
+    async def _process(self, instruction: dict, slots: asyncio.Semaphore):
+        async with slots:
+            handler = self.handlers.get(instruction["action_type"])
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for action type {instruction['action_type']}")
+                await handler(instruction)
+            except Exception as e:
+                await self._fail(instruction, e)
+                return
+            result = await self.collection.update_one(
+                {"id": instruction["id"], "claim_token": instruction["claim_token"], "is_executed": False},
+                {"$set": {"is_executed": True, "executed_at": self.clock()},
+                 "$unset": {"claim_token": "", "lease_until": ""}}
+            )
+            if result.modified_count:
+                self.counters["executed"] += 1
+                await self._bump_versions(instruction["vault_id"], instruction["user_id"])
+
+    async def _fail(self, instruction: dict, error: Exception):
+        attempts = instruction.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": str(error)[:500]}
+        if attempts >= self.max_attempts:
+            update["dead_at"] = self.clock()
+            self.counters["dead"] += 1
+            logger.error(f"Legacy instruction {instruction['id']} failed permanently: {error}")
+        else:
+            backoff = self.retry_base_seconds * 2 ** (attempts - 1)
+            update["execution_date"] = self.clock() + timedelta(seconds=backoff)
+            self.counters["retried"] += 1
+            logger.warning(f"Legacy instruction {instruction['id']} failed (attempt {attempts}), retrying in {backoff}s: {error}")
+        result = await self.collection.update_one(
+            {"id": instruction["id"], "claim_token": instruction["claim_token"]},
+            {"$set": update, "$unset": {"claim_token": "", "lease_until": ""}}
+        )
+        if result.modified_count:
+            await self._bump_versions(instruction["vault_id"], instruction["user_id"])
+
+    async def _bump_versions(self, vault_id: str, user_id: Optional[str] = None):
+        """Move the vault export's content_version and the owner's instruction
+        list version (defaulting to the vault's owner); execution_date and
+        is_executed show in both."""
+        database = db if self.database is None else self.database
+        vault = await database.vaults.find_one_and_update(
+            {"id": vault_id}, {"$inc": {"content_version": 1}}, projection={"_id": 0, "user_id": 1}
+        )
+        user_id = user_id or (vault or {}).get("user_id")
+        if user_id:
+            await database.user_stats.update_one({"user_id": user_id}, {"$inc": {"versions.legacy_instructions": 1}})
+
+instruction_scheduler = InstructionScheduler(INSTRUCTION_HANDLERS)
+
+# Email outbox
+# Routes never talk to the mail relay. enqueue_email() inserts into the
+# email_outbox collection and EmailDispatcher drains it in the background:
+# batches are claimed with a token and lease through ClaimingWorker, as the
+# instruction scheduler's are,
+# sent over a small pool of reused SMTP connections at a bounded rate, retried
+# with exponential backoff and dead-lettered after EMAIL_MAX_ATTEMPTS.
+# The outbox insert is a separate write after the route's own insert, not a
+# transaction (docker-compose runs a standalone mongod, which has none), so a
+# crash between the two loses that one email.
+class MockEmailTransport:
+    async def send(self, to_email: str, subject: str, body: str):
+        await send_mock_email(to_email, subject, body)
+
+    def close(self):
+        pass
+
+class SMTPConnectionPool:
+    """Reuses up to `size` authenticated SMTP connections across sends.
+
+    smtplib is blocking, so each send runs on the pool's own threads.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = True, size: int = EMAIL_POOL_SIZE, sender: str = EMAIL_FROM):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="smtp")
+        self.slots = asyncio.Semaphore(size)
+        self.idle: List[smtplib.SMTP] = []
+        self.connections_opened = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username and self.password:
+                conn.login(self.username, self.password)
+        except Exception:
+            conn.close()
+            raise
+        self.connections_opened += 1
+        return conn
+
+    @staticmethod
+    def _quit(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    def _send_blocking(self, conn: Optional[smtplib.SMTP], message: EmailMessage):
+        """Returns (connection worth keeping or None, error or None). Never raises,
+        so a connection opened on this thread always makes it back to the pool."""
+        try:
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                conn.close()
+                conn = None
+                conn = self._connect()
+                conn.send_message(message)
+            return conn, None
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+            # The relay rejected this message; smtplib has reset the session
+            return conn, e
+        except Exception as e:
+            if conn is not None:
+                self._quit(conn)
+            return None, e
+
+    async def send(self, to_email: str, subject: str, body: str):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to_email
+        message["Subject"] = subject
+        message.set_content(body)
+        async with self.slots:
+            conn = self.idle.pop() if self.idle else None
+            conn, error = await asyncio.get_running_loop().run_in_executor(self.executor, self._send_blocking, conn, message)
+            if conn is not None:
+                self.idle.append(conn)
+            if error is not None:
+                raise error
+
+    def close(self):
+        for conn in self.idle:
+            self._quit(conn)
+        self.idle.clear()
+        self.executor.shutdown(wait=False)
+
+class EmailDispatcher(ClaimingWorker):
+    """Drains email_outbox in batches through a transport with retries."""
+
+    collection_name = "email_outbox"
+    order_field = "next_attempt_at"
+    done_counter = "sent"
+    label = "Email dispatcher"
+    poll_seconds = EMAIL_POLL_SECONDS
+
+    def __init__(self, transport, database=None, clock=utc_now, batch_size: int = EMAIL_BATCH_SIZE,
+                 concurrency: int = EMAIL_POOL_SIZE, rate_per_second: float = EMAIL_RATE_PER_SECOND,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, retry_base_seconds: int = EMAIL_RETRY_BASE_SECONDS,
+                 lease_seconds: int = EMAIL_LEASE_SECONDS):
+        super().__init__(database, clock, batch_size, concurrency, max_attempts, lease_seconds, retry_base_seconds)
+        self.transport = transport
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_send = 0.0
+        self._rate_lock = asyncio.Lock()
+        self.counters["enqueued"] = 0
+
+    def _message(self, to_email: str, subject: str, body: str, now: datetime) -> dict:
+        return {
+            "id": str(uuid.uuid4()),
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+
+    async def enqueue(self, to_email: str, subject: str, body: str) -> str:
+        message = self._message(to_email, subject, body, self.clock())
+        await self.collection.insert_one(message)
+        self.counters["enqueued"] += 1
+        return message["id"]
+
+    async def enqueue_many(self, messages: List[tuple]) -> int:
+        """Queue (to_email, subject, body) tuples with a single insert."""
+        if not messages:
+            return 0
+        now = self.clock()
+        await self.collection.insert_many([self._message(*message, now) for message in messages])
+        self.counters["enqueued"] += len(messages)
+        return len(messages)
+
+    async def _throttle(self):
+        if not self.interval:
+            return
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_send - now
+            self._next_send = max(now, self._next_send) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _due(self, now: datetime) -> dict:
+        return {
+            "status": "pending",
+            "next_attempt_at": {"$lte": now},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}],
+        }
+
+    async def _process(self, message: dict, slots: asyncio.Semaphore):
+        async with slots:
+            await self._throttle()
+            try:
+                await self.transport.send(message["to"], message["subject"], message["body"])
+            except Exception as e:
+                await self._fail(message, e)
+                return
+            await self.collection.update_one(
+                {"id": message["id"], "claim_token": message["claim_token"]},
+                {"$set": {"status": "sent", "sent_at": self.clock()},
+                 "$unset": {"claim_token": "", "lease_until": ""}}
+            )
+            self.counters["sent"] += 1
+
+    async def _fail(self, message: dict, error: Exception):
+        attempts = message.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": str(error)[:500]}
+        if attempts >= self.max_attempts:
+            update["status"] = "dead"
+            self.counters["dead"] += 1
+            logger.error(f"Email {message['id']} to {message['to']} dead-lettered: {error}")
+        else:
+            update["next_attempt_at"] = self.clock() + timedelta(seconds=self.retry_base_seconds * 2 ** (attempts - 1))
+            self.counters["retried"] += 1
+        await self.collection.update_one(
+            {"id": message["id"], "claim_token": message["claim_token"]},
+            {"$set": update, "$unset": {"claim_token": "", "lease_until": ""}}
+        )
+
+def create_email_transport():
+    if EMAIL_TRANSPORT == "smtp":
+        return SMTPConnectionPool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_STARTTLS)
+    return MockEmailTransport()
+
+email_dispatcher = EmailDispatcher(create_email_transport())
+
+async def enqueue_email(to_email: str, subject: str, body: str) -> str:
+    return await email_dispatcher.enqueue(to_email, subject, body)
+
+# Subscription spend
+# The spend summary is one aggregation over the user's active subscriptions,
+# normalizing each billing cycle to a monthly amount. Its result is cached in
+# subscription_spend tagged with the versions.subscriptions counter it was
+# computed at; subscription mutations bump that counter and recompute, and a
+# read whose cached version no longer matches recomputes before answering.
+# Cycles not listed here are counted but left out of the totals.
+BILLING_CYCLE_MONTHLY_FACTOR = {
+    "daily": 365 / 12,
+    "weekly": 52 / 12,
+    "biweekly": 26 / 12,
+    "monthly": 1,
+    "month": 1,
+    "quarterly": 1 / 3,
+    "semiannual": 1 / 6,
+    "yearly": 1 / 12,
+    "annual": 1 / 12,
+    "annually": 1 / 12,
+    "year": 1 / 12,
+}
+
+def spend_pipeline(user_id: str) -> List[dict]:
+    cycle = {"$toLower": "$billing_cycle"}
+    return [
+        {"$match": {"user_id": user_id, "cancelled_at": None}},
+        {"$addFields": {"monthly_factor": {"$switch": {
+            "branches": [{"case": {"$eq": [cycle, name]}, "then": factor}
+                         for name, factor in BILLING_CYCLE_MONTHLY_FACTOR.items()],
+            "default": None,
+        }}}},
+        {"$group": {
+            "_id": "$category",
+            "monthly": {"$sum": {"$multiply": ["$amount", {"$ifNull": ["$monthly_factor", 0]}]}},
+            "count": {"$sum": 1},
+            "unrecognized_cycles": {"$sum": {"$cond": [{"$eq": ["$monthly_factor", None]}, 1, 0]}},
+        }},
+        {"$sort": {"monthly": -1, "_id": 1}},
+    ]
+
+async def refresh_subscription_spend(user_id: str, version: Optional[int] = None) -> dict:
+    if version is None:
+        stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "versions": 1})
+        version = (stats or {}).get("versions", {}).get("subscriptions", 0)
+    rows = await db.subscriptions.aggregate(spend_pipeline(user_id)).to_list(None)
+    monthly_total = sum(row["monthly"] for row in rows)
+    rollup = {
+        "user_id": user_id,
+        "version": version,
+        "monthly_total": round(monthly_total, 2),
+        "yearly_total": round(monthly_total * 12, 2),
+        "subscriptions": sum(row["count"] for row in rows),
+        "unrecognized_cycles": sum(row["unrecognized_cycles"] for row in rows),
+        "by_category": [
+            {"category": row["_id"], "monthly": round(row["monthly"], 2), "yearly": round(row["monthly"] * 12, 2),
+             "count": row["count"]}
+            for row in rows
+        ],
+        "computed_at": datetime.now(timezone.utc),
+    }
+    try:
+        # Never overwrite a rollup computed at a later version
+        await db.subscription_spend.update_one(
+            {"user_id": user_id, "version": {"$lte": version}}, {"$set": rollup}, upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    return rollup
+
+async def subscription_mutated(user_id: str):
+    await bump_user_versions(user_id, "subscriptions")
+    await refresh_subscription_spend(user_id)
+
+# Leased background jobs
+# AutoCancelEngine and DeletionReaper keep one document per job. The worker
+# running a job holds a lease (lease_token, lease_until) and renews it as it
+# makes progress; every progress write is conditional on the token, so a
+# worker that lost its lease stops. run_forever() polls for running jobs whose
+# lease has expired, takes them over under a new token and runs them here.
+class LeasedJobRunner:
+    """Base for engines running leased jobs; `database` and `clock` are injectable.
+
+    Subclasses set `jobs_collection`, `label` and `poll_seconds` and implement
+    run_job().
+    """
+
+    jobs_collection: str
+    label: str
+    poll_seconds: float
+
+    def __init__(self, database=None, clock=utc_now, lease_seconds: int = 300):
+        self.database = database
+        self.clock = clock
+        self.lease_seconds = lease_seconds
+        self.tasks: set = set()
+        self.counters = {"jobs": 0, "resumed": 0}
+
+    @property
+    def _db(self):
+        return db if self.database is None else self.database
+
+    def _new_lease(self, now: datetime) -> dict:
+        return {"lease_token": str(uuid.uuid4()), "lease_until": now + timedelta(seconds=self.lease_seconds)}
+
+    async def resume(self) -> int:
+        """Take over running jobs whose lease has expired."""
+        resumed = 0
+        while True:
+            now = self.clock()
+            lease = self._new_lease(now)
+            job = await self._db[self.jobs_collection].find_one_and_update(
+                {"status": "running", "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+                {"$set": lease},
+                projection={"_id": 0}
+            )
+            if job is None:
+                break
+            resumed += 1
+            self._spawn({**job, **lease})
+        self.counters["resumed"] += resumed
+        return resumed
+
+    async def run_forever(self, poll_seconds: Optional[float] = None):
+        while True:
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"{self.label} pass failed: {e}")
+            await asyncio.sleep(self.poll_seconds if poll_seconds is None else poll_seconds)
+
+    def _spawn(self, job: dict):
+        task = asyncio.create_task(self.run_job(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_job(self, job: dict):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {**self.counters, "running": len(self.tasks)}
+
+# Subscription auto-cancel
+# When a vault unlocks, AutoCancelEngine cancels every auto_cancel_enabled
+# subscription of its owner through a cancellation provider. One job document
+# per user in cancellation_jobs records progress; a later unlock reruns it once
+# it has completed, picking up anything enabled since. The job works in chunks of
+# CANCEL_BATCH_SIZE with at most CANCEL_CONCURRENCY provider calls in flight,
+# retrying each call with backoff before marking the subscription failed.
+# Jobs hold a lease renewed after every chunk, so one left behind by a dead
+# worker is resumed by the next poll (CANCEL_POLL_SECONDS); each subscription
+# is marked as it is processed, so a resumed job only sees what is left. A call
+# may repeat after a crash, so providers must treat the subscription id as an
+# idempotency key.
+class MockCancellationProvider:
+    """Logs instead of cancelling. Services in `fail_services` always fail."""
+
+    def __init__(self, fail_services: tuple = ()):
+        self.fail_services = set(fail_services)
+        self.cancelled: List[str] = []
+
+    async def cancel(self, subscription: dict) -> str:
+        if subscription["service_name"] in self.fail_services:
+            raise RuntimeError(f"{subscription['service_name']} refused the cancellation")
+        logger.info(f"[MOCK CANCEL] {subscription['service_name']} for subscription {subscription['id']}")
+        self.cancelled.append(subscription["id"])
+        return f"mock-{subscription['id']}"
+
+    async def close(self):
+        pass
+
+class WebhookCancellationProvider:
+    """POSTs each cancellation to a service that talks to the providers."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def cancel(self, subscription: dict) -> str:
+        response = await self.client.post(
+            self.url,
+            json={key: subscription.get(key) for key in ("id", "user_id", "service_name", "category")},
+            headers={"Idempotency-Key": subscription["id"]},
+        )
+        response.raise_for_status()
+        return response.headers.get("X-Cancellation-Reference", "")
+
+    async def close(self):
+        await self.client.aclose()
+
+class AutoCancelEngine(LeasedJobRunner):
+    """Runs auto-cancel jobs in the background."""
+
+    jobs_collection = "cancellation_jobs"
+    label = "Auto-cancel"
+    poll_seconds = CANCEL_POLL_SECONDS
+
+    def __init__(self, provider, database=None, clock=utc_now, batch_size: int = CANCEL_BATCH_SIZE,
+                 concurrency: int = CANCEL_CONCURRENCY, max_attempts: int = CANCEL_MAX_ATTEMPTS,
+                 retry_base_seconds: float = CANCEL_RETRY_BASE_SECONDS, lease_seconds: int = CANCEL_LEASE_SECONDS):
+        super().__init__(database, clock, lease_seconds)
+        self.provider = provider
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.counters.update({"cancelled": 0, "failed": 0, "retried": 0, "batches": 0})
+
+    async def start(self, user_id: str, vault_id: str) -> Optional[str]:
+        """Create the user's job, or rerun it if it has completed, and run it.
+
+        Returns None while the user's job is still running.
+        """
+        now = self.clock()
+        total = await self._db.subscriptions.count_documents(
+            {"user_id": user_id, "auto_cancel_enabled": True, "cancel_status": None}
+        )
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "vault_id": vault_id,
+            "status": "running",
+            "total": total,
+            "processed": 0,
+            "cancelled": 0,
+            "failed": 0,
+            "created_at": now,
+            "finished_at": None,
+            **self._new_lease(now),
+        }
+        try:
+            await self._db.cancellation_jobs.insert_one(job)
+        except DuplicateKeyError:
+            # Rerun a completed job; a running one already sees every enabled subscription
+            previous = await self._db.cancellation_jobs.find_one_and_update(
+                {"user_id": user_id, "status": "completed"},
+                {"$set": {key: value for key, value in job.items() if key not in ("_id", "user_id")}}
+            )
+            if previous is None:
+                return None
+        self.counters["jobs"] += 1
+        self._spawn(job)
+        return job["id"]
+
+    async def run_job(self, job: dict):
+        lease = {"id": job["id"], "lease_token": job["lease_token"]}
+        remaining = {"user_id": job["user_id"], "auto_cancel_enabled": True, "cancel_status": None}
+        slots = asyncio.Semaphore(self.concurrency)
+        try:
+            while True:
+                batch = await self._db.subscriptions.find(remaining, {"_id": 0}).sort(PAGE_SORT).limit(self.batch_size).to_list(self.batch_size)
+                if not batch:
+                    break
+                outcomes = await asyncio.gather(*(self._cancel(subscription, slots) for subscription in batch))
+                self.counters["batches"] += 1
+                await self._db.user_stats.update_one(
+                    {"user_id": job["user_id"]}, {"$inc": {"versions.subscriptions": 1}}
+                )
+                progress = await self._db.cancellation_jobs.update_one(lease, {
+                    "$inc": {"processed": len(batch), "cancelled": outcomes.count("cancelled"),
+                             "failed": outcomes.count("failed")},
+                    "$set": {"lease_until": self.clock() + timedelta(seconds=self.lease_seconds)},
+                })
+                if not progress.matched_count:
+                    logger.warning(f"Auto-cancel job {job['id']} lost its lease; another worker continues it")
+                    return
+            await self._db.cancellation_jobs.update_one(lease, {
+                "$set": {"status": "completed", "finished_at": self.clock()},
+                "$unset": {"lease_token": "", "lease_until": ""},
+            })
+            logger.info(f"Auto-cancel job {job['id']} finished for user {job['user_id']}")
+        except Exception as e:
+            # Once the lease runs out the next resume() pass picks the job up again
+            logger.error(f"Auto-cancel job {job['id']} failed: {e}")
+
+    async def _cancel(self, subscription: dict, slots: asyncio.Semaphore) -> str:
+        async with slots:
+            error = None
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    self.counters["retried"] += 1
+                    await asyncio.sleep(self.retry_base_seconds * 2 ** (attempt - 1))
+                try:
+                    reference = await self.provider.cancel(subscription)
+                    break
+                except Exception as e:
+                    error = e
+            else:
+                self.counters["failed"] += 1
+                logger.warning(f"Could not cancel subscription {subscription['id']}: {error}")
+                await self._db.subscriptions.update_one(
+                    {"id": subscription["id"], "cancel_status": None},
+                    {"$set": {"cancel_status": "failed", "cancel_error": str(error)[:500]}}
+                )
+                return "failed"
+        self.counters["cancelled"] += 1
+        await self._db.subscriptions.update_one(
+            {"id": subscription["id"], "cancel_status": None},
+            {"$set": {"cancel_status": "cancelled", "cancelled_at": self.clock(), "cancel_reference": reference}}
+        )
+        return "cancelled"
+
+def create_cancellation_provider():
+    if CANCEL_PROVIDER == "webhook":
+        return WebhookCancellationProvider(CANCEL_WEBHOOK_URL)
+    return MockCancellationProvider()
+
+auto_cancel_engine = AutoCancelEngine(create_cancellation_provider())
+
+# Cascade deletion
+# DELETE /vaults/{id} and DELETE /auth/me only tombstone their target and queue
+# a deletion job. Until the job finishes, reads hide the data: a tombstoned
+# vault has deleted_at set and its id listed in the owner's user_stats
+# deleted_vaults, which list routes exclude with $nin; a deleted account's
+# tokens are revoked. DeletionReaper works through a job's stages one
+# collection at a time, removing at most DELETION_BATCH_SIZE documents per
+# delete_many and pausing between batches so the cascade never holds the
+# database for long. Deletion is idempotent, so a job left behind by a dead
+# worker (its lease expired) is simply rerun from its first stage.
+VAULT_SCOPED_COLLECTIONS = ("legacy_instructions", "assets", "trusted_parties", "death_verifications")
+
+def vault_deletion_stages(user_id: str, vault_id: str) -> List[tuple]:
+    scoped = {"user_id": user_id, "vault_id": vault_id}
+    return [
+        *((collection, scoped) for collection in VAULT_SCOPED_COLLECTIONS),
+        ("vault_quorum", {"vault_id": vault_id}),
+        ("vault_keys", {"vault_id": vault_id}),
+        ("vault_exports", {"vault_id": vault_id}),
+        ("vaults", {"id": vault_id}),
+    ]
+
+def user_deletion_stages(user_id: str, vault_ids: List[str]) -> List[tuple]:
+    owned = {"user_id": user_id}
+    stages = [(collection, owned) for collection in (
+        *VAULT_SCOPED_COLLECTIONS, "notifications", "subscriptions", "subscription_spend", "cancellation_jobs"
+    )]
+    for vault_id in vault_ids:
+        stages += [(collection, {"vault_id": vault_id}) for collection in ("vault_quorum", "vault_keys", "vault_exports")]
+    return stages + [("vaults", owned), ("user_stats", owned), ("users", {"id": user_id})]
+
+class DeletionReaper(LeasedJobRunner):
+    """Runs deletion jobs in the background."""
+
+    jobs_collection = "deletion_jobs"
+    label = "Deletion reaper"
+    poll_seconds = DELETION_POLL_SECONDS
+
+    def __init__(self, database=None, clock=utc_now, batch_size: int = DELETION_BATCH_SIZE,
+                 pause_seconds: float = DELETION_BATCH_PAUSE_SECONDS, lease_seconds: int = DELETION_LEASE_SECONDS):
+        super().__init__(database, clock, lease_seconds)
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.counters.update({"completed": 0, "deleted": 0, "batches": 0})
+
+    async def start(self, kind: str, user_id: str, target_id: str) -> str:
+        """Queue the deletion of a vault or user ("vault" or "user") and start it here."""
+        now = self.clock()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user_id,
+            "target_id": target_id,
+            "status": "running",
+            "stage": None,
+            "deleted": {},
+            "created_at": now,
+            "finished_at": None,
+            **self._new_lease(now),
+        }
+        await self._db.deletion_jobs.insert_one(job)
+        self.counters["jobs"] += 1
+        self._spawn(job)
+        return job["id"]
+
+    async def _stages(self, job: dict) -> List[tuple]:
+        if job["kind"] == "vault":
+            return vault_deletion_stages(job["user_id"], job["target_id"])
+        vaults = await self._db.vaults.find({"user_id": job["user_id"]}, {"_id": 0, "id": 1}).to_list(None)
+        return user_deletion_stages(job["user_id"], [vault["id"] for vault in vaults])
+
+    async def run_job(self, job: dict):
+        lease = {"id": job["id"], "lease_token": job["lease_token"]}
+        try:
+            if job["kind"] == "vault":
+                # Take the vault's contents out of the dashboard counters up front
+                await rebuild_user_stats(job["user_id"])
+            for collection, query in await self._stages(job):
+                while True:
+                    batch = await self._db[collection].find(query, {"_id": 1}).limit(self.batch_size).to_list(self.batch_size)
+                    deleted = 0
+                    if batch:
+                        result = await self._db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+                        deleted = result.deleted_count
+                        self.counters["deleted"] += deleted
+                        self.counters["batches"] += 1
+                    progress = await self._db.deletion_jobs.update_one(lease, {
+                        "$set": {"stage": collection, "lease_until": self.clock() + timedelta(seconds=self.lease_seconds)},
+                        "$inc": {f"deleted.{collection}": deleted},
+                    })
+                    if not progress.matched_count:
+                        logger.warning(f"Deletion job {job['id']} lost its lease; another worker continues it")
+                        return
+                    if len(batch) < self.batch_size:
+                        break
+                    await asyncio.sleep(self.pause_seconds)
+            if job["kind"] == "vault":
+                await self._db.user_stats.update_one({"user_id": job["user_id"]}, {"$pull": {"deleted_vaults": job["target_id"]}})
+            await self._db.deletion_jobs.update_one(lease, {
+                "$set": {"status": "completed", "stage": None, "finished_at": self.clock()},
+                "$unset": {"lease_token": "", "lease_until": ""},
+            })
+            self.counters["completed"] += 1
+            logger.info(f"Deletion job {job['id']} removed {job['kind']} {job['target_id']}")
+        except Exception as e:
+            # The lease runs out and the next resume() pass reruns the job
+            logger.error(f"Deletion job {job['id']} failed: {e}")
+
+deletion_reaper = DeletionReaper()
+
+# Notification streaming
+# Connected clients hold a NotificationHub subscription per stream. notify_user()
+# stores a notification and publishes it through the hub's backend: "local"
+# delivers within this process, "mongo" fans out across workers through a
+# capped collection that every worker tails. Each subscription has a bounded
+# queue; a client too slow to drain it is not allowed to block publishers.
+# Instead the queue is dropped and the stream catches up from the notifications
+# collection, which is also how a reconnect resumes from Last-Event-ID.
+class NotificationSubscriber:
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.closed = False
+        self.since = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+    def offer(self, doc: dict):
+        if self.overflowed or self.closed:
+            return
+        try:
+            self.queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue = asyncio.Queue(maxsize=self.queue.maxsize)
+            self.queue.put_nowait(None)  # wake the stream so it catches up
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+class LocalPubSub:
+    deliver = None  # set by NotificationHub
+
+    async def start(self):
+        pass
+
+    async def publish(self, doc: dict):
+        self.deliver(doc)
+
+    async def close(self):
+        pass
+
+class MongoPubSub:
+    """Cross-worker fan-out through a capped collection tailed by every worker."""
+
+    def __init__(self, database=None, collection: str = "notification_events",
+                 size_bytes: int = NOTIFY_EVENTS_CAPPED_BYTES):
+        self.database = database
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.task: Optional[asyncio.Task] = None
+        self.deliver = None  # set by NotificationHub
+
+    @property
+    def collection(self):
+        return (self.database if self.database is not None else db)[self.collection_name]
+
+    async def start(self):
+        database = self.database if self.database is not None else db
+        try:
+            await database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # already exists
+        self.task = asyncio.create_task(self._tail())
+
+    async def _tail(self):
+        newest = await self.collection.find_one({}, {"_id": 1}, sort=[("$natural", DESCENDING)])
+        last_id = newest["_id"] if newest else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                async for event in cursor:
+                    last_id = event["_id"]
+                    self.deliver(event["doc"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Notification event tail failed")
+            await asyncio.sleep(1)  # cursor died (empty collection or error); re-open
+
+    async def publish(self, doc: dict):
+        await self.collection.insert_one({"doc": {k: v for k, v in doc.items() if k != "_id"}})
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+
+class NotificationHub:
+    def __init__(self, backend, queue_size: int = NOTIFY_QUEUE_SIZE):
+        self.backend = backend
+        self.backend.deliver = self.deliver
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, set] = {}
+        self.counters = {"published": 0, "delivered": 0, "overflows": 0}
+
+    async def start(self):
+        await self.backend.start()
+
+    async def publish(self, doc: dict):
+        self.counters["published"] += 1
+        await self.backend.publish(doc)
+
+    def deliver(self, doc: dict):
+        for subscriber in self.subscribers.get(doc["user_id"], ()):
+            was_overflowed = subscriber.overflowed
+            subscriber.offer(doc)
+            if subscriber.overflowed and not was_overflowed:
+                self.counters["overflows"] += 1
+            self.counters["delivered"] += 1
+
+    def subscribe(self, user_id: str) -> NotificationSubscriber:
+        subscriber = NotificationSubscriber(user_id, self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: NotificationSubscriber):
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.user_id]
+
+    async def close(self):
+        for subscribers in list(self.subscribers.values()):
+            for subscriber in subscribers:
+                subscriber.close()
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": NOTIFY_BACKEND,
+            "connections": sum(len(s) for s in self.subscribers.values()),
+            **self.counters,
+        }
+
+notification_hub = NotificationHub(MongoPubSub() if NOTIFY_BACKEND == "mongo" else LocalPubSub())
+
+async def notify_user(user_id: str, title: str, message: str, type: str = "info") -> Notification:
+    # Millisecond precision, as BSON stores it, so live and replayed events order alike
+    now = datetime.now(timezone.utc)
+    notification = Notification(user_id=user_id, title=title, message=message, type=type,
+                                created_at=now.replace(microsecond=now.microsecond // 1000 * 1000))
+    notification_dict = notification.model_dump()
+    await db.notifications.insert_one(notification_dict)
+    await bump_user_stats(user_id, {"unread_notifications": 1})
+    await notification_hub.publish(notification_dict)
+    return notification
+
+def sse_event(doc: dict) -> bytes:
+    return b"id: " + doc["id"].encode() + b"\nevent: notification\ndata: " + dump_row(Notification, doc) + b"\n\n"
+
+async def notifications_after(user_id: str, position: tuple) -> List[dict]:
+    created_at, notification_id = position
+    return await db.notifications.find(
+        {"user_id": user_id, "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": notification_id}},
+        ]},
+        {"_id": 0}
+    ).sort(PAGE_SORT).to_list(NOTIFY_REPLAY_LIMIT)
+
+async def stream_notifications(user_id: str, last_event_id: Optional[str]):
+    # Subscribed before the Last-Event-ID lookup so nothing published meanwhile
+    # is missed, and only once the response starts so the finally always runs
+    subscriber = notification_hub.subscribe(user_id)
+    try:
+        position = None
+        if last_event_id:
+            seen = await db.notifications.find_one(
+                {"id": last_event_id, "user_id": user_id}, {"_id": 0, "created_at": 1, "id": 1}
+            )
+            if seen:
+                position = (seen["created_at"], seen["id"])
+        yield b"retry: 3000\n\n"
+        catch_up = position is not None
+        while not subscriber.closed:
+            if catch_up or subscriber.overflowed:
+                subscriber.overflowed = False
+                if position is None:
+                    position = (subscriber.since, "")
+                for doc in await notifications_after(subscriber.user_id, position):
+                    position = (doc["created_at"], doc["id"])
+                    yield sse_event(doc)
+                catch_up = False
+                continue
+            try:
+                doc = await asyncio.wait_for(subscriber.queue.get(), NOTIFY_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if doc is None:
+                continue
+            if position is not None and (doc["created_at"], doc["id"]) <= position:
+                continue  # already sent while catching up
+            position = (doc["created_at"], doc["id"])
+            yield sse_event(doc)
+    finally:
+        notification_hub.unsubscribe(subscriber)
+
+# Credential encryption
+# Envelope encryption: each vault has a random AES-256 data key, stored only
+# wrapped (AES-GCM) under the master key read from MASTER_KEY_FILE. Unwrapped
+# data keys are cached in memory. Asset credentials are sealed with the vault's
+# data key, bound to the vault and asset ids as associated data, and stored in
+# credentials_encrypted; the credentials field itself only ever holds
+# CREDENTIALS_REDACTED, so list endpoints return it without any crypto work.
+CREDENTIALS_REDACTED = "********"
+NONCE_SIZE = 12
+
+data_key_cache = TTLCache(DATA_KEY_CACHE_SIZE, DATA_KEY_CACHE_TTL_SECONDS)
+crypto_executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+_master_cipher: Optional[AESGCM] = None
+
+def master_cipher() -> AESGCM:
+    global _master_cipher
+    if _master_cipher is None:
+        if not MASTER_KEY_FILE.exists():
+            # Never generated implicitly: a fresh key cannot unwrap the data keys already stored
+            raise RuntimeError(f"Master key file {MASTER_KEY_FILE} not found; create it with generate_master_key.py")
+        _master_cipher = AESGCM(MASTER_KEY_FILE.read_bytes())
+    return _master_cipher
+
+def seal(cipher: AESGCM, plaintext: bytes, aad: bytes) -> bytes:
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, plaintext, aad)
+
+def unseal(cipher: AESGCM, blob: bytes, aad: bytes) -> bytes:
+    return cipher.decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], aad)
+
+def credentials_aad(vault_id: str, asset_id: str) -> bytes:
+    return f"{vault_id}:{asset_id}".encode()
+
+async def get_data_key(vault_id: str) -> AESGCM:
+    cipher = data_key_cache.get(vault_id)
+    if cipher is not None:
+        return cipher
+    aad = vault_id.encode()
+    record = await db.vault_keys.find_one({"vault_id": vault_id}, {"_id": 0, "wrapped_key": 1})
+    if record is None:
+        try:
+            await db.vault_keys.insert_one({
+                "vault_id": vault_id,
+                "wrapped_key": seal(master_cipher(), AESGCM.generate_key(bit_length=256), aad),
+                "created_at": datetime.now(timezone.utc),
+            })
+        except DuplicateKeyError:
+            pass  # another request created it first; use theirs
+        record = await db.vault_keys.find_one({"vault_id": vault_id}, {"_id": 0, "wrapped_key": 1})
+    try:
+        cipher = AESGCM(unseal(master_cipher(), record["wrapped_key"], aad))
+    except InvalidTag:
+        logger.error(f"Data key for vault {vault_id} does not unwrap with the master key in {MASTER_KEY_FILE}")
+        raise HTTPException(status_code=500, detail="Vault key could not be unwrapped with the configured master key")
+    data_key_cache.set(vault_id, cipher)
+    return cipher
+
+async def seal_asset_credentials(docs: List[dict]):
+    """Encrypt plaintext credentials on asset documents in place before insert."""
+    for doc in docs:
+        plaintext = doc.get("credentials")
+        if not plaintext or plaintext == CREDENTIALS_REDACTED:
+            continue
+        cipher = await get_data_key(doc["vault_id"])
+        doc["credentials_encrypted"] = seal(cipher, plaintext.encode(), credentials_aad(doc["vault_id"], doc["id"]))
+        doc["credentials"] = CREDENTIALS_REDACTED
+
+def _unseal_batch(items: List[tuple]) -> List[Optional[str]]:
+    results = []
+    for cipher, blob, aad in items:
+        try:
+            results.append(unseal(cipher, blob, aad).decode())
+        except InvalidTag:
+            results.append(None)
+    return results
+
+async def reveal_asset_credentials(docs: List[dict]) -> Dict[str, Optional[str]]:
+    """Decrypt credentials for many assets, batched on the crypto thread pool.
+
+    Returns asset id -> plaintext (None where there is nothing to reveal).
+    """
+    revealed: Dict[str, Optional[str]] = {}
+    pending = []
+    for doc in docs:
+        blob = doc.get("credentials_encrypted")
+        if blob is None:
+            # Written before encryption was enabled
+            legacy = doc.get("credentials")
+            revealed[doc["id"]] = None if legacy == CREDENTIALS_REDACTED else legacy
+            continue
+        cipher = await get_data_key(doc["vault_id"])
+        pending.append((doc["id"], (cipher, bytes(blob), credentials_aad(doc["vault_id"], doc["id"]))))
+
+    loop = asyncio.get_running_loop()
+    batches = [pending[i:i + CRYPTO_BATCH_SIZE] for i in range(0, len(pending), CRYPTO_BATCH_SIZE)]
+    results = await asyncio.gather(*(
+        loop.run_in_executor(crypto_executor, _unseal_batch, [item for _, item in batch]) for batch in batches
+    ))
+    for batch, plaintexts in zip(batches, results):
+        for (asset_id, _), plaintext in zip(batch, plaintexts):
+            revealed[asset_id] = plaintext
+    return revealed
+
+def redact_asset(doc: dict) -> dict:
+    if doc.get("credentials") not in (None, CREDENTIALS_REDACTED):
+        doc["credentials"] = CREDENTIALS_REDACTED
+    return doc
+
+# Vault analysis
+# /ai/analyze results depend only on a vault's assets, instructions and trusted
+# parties. Every mutation of those bumps vaults.content_version, and results
+# are cached under (vault_id, analysis_type, content_version), so a repeat
+# analysis costs one point read until the vault changes. Concurrent requests
+# for the same key share one computation.
+ANALYSIS_TYPES = ("asset_summary", "risk_assessment", "recommendation")
+
+async def bump_vault_version(*vault_ids: str):
+    await db.vaults.update_many({"id": {"$in": list(set(vault_ids))}}, {"$inc": {"content_version": 1}})
+
+def _enum_counts(rows: List[dict], enum, fallback: Optional[Enum] = None) -> Dict[str, int]:
+    """Sum $group counts by enum value. Values the enum doesn't know (legacy rows,
+    or a missing field) are counted under `fallback`, or left out without one."""
+    counts: Dict[str, int] = {}
+    for row in rows:
+        try:
+            key = enum(row["_id"]).value
+        except ValueError:
+            if fallback is None:
+                continue
+            key = fallback.value
+        counts[key] = counts.get(key, 0) + row["count"]
+    return counts
+
+async def load_vault_facts(user_id: str, vault_id: str) -> dict:
+    scope = {"$match": {"user_id": user_id, "vault_id": vault_id}}
+    assets, instructions, parties = await asyncio.gather(
+        db.assets.aggregate([scope, {"$group": {
+            "_id": "$category",
+            "count": {"$sum": 1},
+            "with_credentials": {"$sum": {"$cond": [{"$ifNull": ["$credentials", False]}, 1, 0]}},
+        }}]).to_list(None),
+        db.legacy_instructions.aggregate([scope, {"$group": {"_id": "$action_type", "count": {"$sum": 1}}}]).to_list(None),
+        db.trusted_parties.aggregate([scope, {"$group": {"_id": "$role", "count": {"$sum": 1}}}]).to_list(None),
+    )
+    return {
+        "asset_breakdown": _enum_counts(assets, AssetCategory, fallback=AssetCategory.OTHER),
+        "with_credentials": sum(row["with_credentials"] for row in assets),
+        "instruction_actions": _enum_counts(instructions, ActionType),
+        "party_roles": _enum_counts(parties, RoleType),
+    }
+
+class RuleBasedAnalyzer:
+    """Deterministic analysis computed from vault facts; needs no model weights."""
+    name = "rules"
+
+    def analyze_sync(self, analysis_type: str, facts: dict) -> str:
+        assets = sum(facts["asset_breakdown"].values())
+        instructions = sum(facts["instruction_actions"].values())
+        verifiers = facts["party_roles"].get(RoleType.VERIFIER.value, 0)
+        heirs = facts["party_roles"].get(RoleType.HEIR.value, 0)
+
+        gaps = []
+        if verifiers < QUORUM_MIN_VERIFIED:
+            gaps.append(f"add {QUORUM_MIN_VERIFIED - verifiers} more trusted verifier(s) so death verification can reach quorum")
+        if assets and not instructions:
+            gaps.append("add legacy instructions describing what should happen to your assets")
+        if assets and not heirs:
+            gaps.append("name at least one heir")
+        if facts["with_credentials"] < assets:
+            gaps.append(f"store access credentials for the {assets - facts['with_credentials']} asset(s) that have none")
+        if assets and not facts["asset_breakdown"].get(AssetCategory.FINANCIAL.value):
+            gaps.append("record bank and brokerage accounts, the assets heirs most often miss")
+
+        if analysis_type == "asset_summary":
+            if not assets:
+                return "[AI ANALYSIS] Your vault has no assets yet. Start with financial accounts and crypto wallets, which are the hardest for heirs to discover."
+            breakdown = ", ".join(f"{count} {category}" for category, count in sorted(facts["asset_breakdown"].items()))
+            return (f"[AI ANALYSIS] Your vault contains {assets} assets ({breakdown}); "
+                    f"{facts['with_credentials']} of them have stored credentials.")
+        if analysis_type == "risk_assessment":
+            level = "LOW" if not gaps else "MEDIUM" if len(gaps) == 1 else "HIGH"
+            detail = f" To reduce it: {'; '.join(gaps)}." if gaps else ""
+            return (f"[AI ANALYSIS] Risk Level: {level}. You have {instructions} legacy instructions and "
+                    f"{verifiers} trusted verifiers configured.{detail}")
+        if analysis_type == "recommendation":
+            if not gaps:
+                return "[AI ANALYSIS] Your vault is well configured. Review it once a year and after major life events."
+            steps = " ".join(f"{i}) {gap[0].upper()}{gap[1:]}." for i, gap in enumerate(gaps, 1))
+            return f"[AI ANALYSIS] Based on your {assets} assets, we recommend: {steps}"
+        return "Analysis type not supported"
+
+    async def analyze(self, analysis_type: str, facts: dict) -> str:
+        return self.analyze_sync(analysis_type, facts)
+
+    def close(self):
+        pass
+
+_generator = None
+
+def _load_generator(model_name: str):
+    global _generator
+    from transformers import pipeline
+    _generator = pipeline("text-generation", model=model_name)
+
+def _generate(prompt: str, max_new_tokens: int) -> str:
+    output = _generator(prompt, max_new_tokens=max_new_tokens, do_sample=False, return_full_text=False)
+    return output[0]["generated_text"].strip()
+
+class TransformersAnalyzer:
+    """Hugging Face text generation in a process pool.
+
+    Each worker process loads the model once, on first use. The rule-based
+    analysis seeds the prompt and is returned as-is if generation fails.
+    """
+    name = "transformers"
+
+    def __init__(self, model_name: str, workers: int = AI_WORKERS, max_new_tokens: int = AI_MAX_NEW_TOKENS):
+        self.model_name = model_name
+        self.workers = workers
+        self.max_new_tokens = max_new_tokens
+        self.rules = RuleBasedAnalyzer()
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_generator,
+                initargs=(self.model_name,),
+            )
+        return self.executor
+
+    async def analyze(self, analysis_type: str, facts: dict) -> str:
+        baseline = self.rules.analyze_sync(analysis_type, facts)
+        if analysis_type not in ANALYSIS_TYPES:
+            return baseline
+        prompt = f"{baseline.removeprefix('[AI ANALYSIS] ')}\nAdvice for the vault owner:"
+        loop = asyncio.get_running_loop()
+        try:
+            generated = await loop.run_in_executor(self._pool(), _generate, prompt, self.max_new_tokens)
+        except Exception:
+            logger.exception(f"{self.model_name} generation failed, returning rule-based analysis")
+            return baseline
+        return f"{baseline} {generated}"
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def create_analyzer():
+    if AI_ANALYZER == "transformers" and importlib.util.find_spec("transformers") is not None:
+        return TransformersAnalyzer(AI_MODEL_NAME)
+    return RuleBasedAnalyzer()
+
+class VaultAnalysisService:
+    def __init__(self, analyzer, cache_size: int = AI_CACHE_SIZE, cache_ttl: int = AI_CACHE_TTL_SECONDS):
+        self.analyzer = analyzer
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.counters = {"computed": 0, "coalesced": 0}
+
+    async def _compute(self, key: tuple, user_id: str) -> str:
+        vault_id, analysis_type, _ = key
+        facts = await load_vault_facts(user_id, vault_id)
+        result = await self.analyzer.analyze(analysis_type, facts)
+        self.counters["computed"] += 1
+        self.cache.set(key, result)
+        return result
+
+    async def analyze(self, user_id: str, vault_id: str, analysis_type: str, version: int) -> str:
+        key = (vault_id, analysis_type, version)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(key, user_id))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.counters["coalesced"] += 1
+        # Shielded so one caller disconnecting doesn't cancel the shared work
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"analyzer": self.analyzer.name, **self.counters, "inflight": len(self.inflight), "cache": self.cache.stats()}
+
+analysis_service = VaultAnalysisService(create_analyzer())
+
+# Vault export
+# GET /vaults/{id}/export streams a ZIP with one NDJSON file per collection and
+# a manifest.json holding each file's row count, size and SHA-256. Rows go from
+# the Motor cursor through an incrementally deflated ZIP entry straight to the
+# client, so memory use does not grow with the vault.
+#
+# The archive is a pure function of the vault contents: entries carry a fixed
+# timestamp and rows are written in PAGE_SORT order. Its ETag is derived from
+# vaults.content_version (bumped by every write to an exported field of the
+# vault's collections, the instruction scheduler's included) plus the owner's
+# versions.subscriptions, so a Range request carrying a matching If-Range can be
+# served by regenerating the stream and slicing it. Total sizes are recorded in
+# vault_exports once an archive has been produced; until then a Range request
+# gets the whole archive with a 200, which records it.
+EXPORT_SECTIONS = [
+    ("assets", Asset),
+    ("legacy_instructions", LegacyInstruction),
+    ("trusted_parties", TrustedParty),
+    ("death_verifications", DeathVerification),
+    ("subscriptions", Subscription),
+]
+EXPORT_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+class _ExportSink:
+    """Write-only, unseekable file object; ZipFile falls back to data descriptors."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.pending = 0
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.pending += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.pending = 0
+        return data
+
+async def vault_export_etag(user_id: str, vault_id: str, content_version: int) -> str:
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "versions.subscriptions": 1})
+    subscriptions_version = (stats or {}).get("versions", {}).get("subscriptions", 0)
+    fingerprint = hashlib.sha256(f"{vault_id}:{content_version}:{subscriptions_version}".encode())
+    return f'"{fingerprint.hexdigest()[:32]}"'
+
+async def _export_rows(section: str, query: dict, model):
+    cursor = db[section].find(query, {"_id": 0}).sort(PAGE_SORT)
+    if section != "assets":
+        async for doc in cursor:
+            yield dump_row(model, doc)
+        return
+    # Credentials are decrypted a batch at a time on the crypto pool
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= CRYPTO_BATCH_SIZE:
+            for row in await _reveal_export_batch(batch):
+                yield row
+            batch = []
+    for row in await _reveal_export_batch(batch):
+        yield row
+
+async def _reveal_export_batch(docs: List[dict]) -> List[bytes]:
+    if not docs:
+        return []
+    revealed = await reveal_asset_credentials(docs)
+    return [dump_row(Asset, {**doc, "credentials": revealed[doc["id"]]}) for doc in docs]
+
+async def iter_vault_export(user_id: str, vault_id: str, etag: str):
+    sink = _ExportSink()
+    manifest = {"vault_id": vault_id, "etag": etag.strip('"'), "files": []}
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for section, model in EXPORT_SECTIONS:
+            query = {"user_id": user_id} if section == "subscriptions" else {"user_id": user_id, "vault_id": vault_id}
+            info = zipfile.ZipInfo(f"{section}.ndjson", date_time=EXPORT_TIMESTAMP)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            digest, rows, size = hashlib.sha256(), 0, 0
+            with archive.open(info, "w", force_zip64=True) as entry:
+                async for row in _export_rows(section, query, model):
+                    line = row + b"\n"
+                    entry.write(line)
+                    digest.update(line)
+                    rows += 1
+                    size += len(line)
+                    if sink.pending >= EXPORT_CHUNK_SIZE:
+                        yield sink.drain()
+            manifest["files"].append({"name": info.filename, "rows": rows, "bytes": size, "sha256": digest.hexdigest()})
+        info = zipfile.ZipInfo("manifest.json", date_time=EXPORT_TIMESTAMP)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, json.dumps(manifest, indent=2, sort_keys=True))
+    yield sink.drain()
+
+async def record_export_size(vault_id: str, etag: str, chunks):
+    """Pass chunks through, storing the archive's total size once it completes."""
+    total = 0
+    async for chunk in chunks:
+        total += len(chunk)
+        yield chunk
+    await db.vault_exports.update_one(
+        {"vault_id": vault_id, "etag": etag},
+        {"$set": {"size": total, "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def slice_stream(chunks, start: int, end: int):
+    """Yield bytes start..end (inclusive) of a chunk stream."""
+    position = 0
+    async for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(0, start - position):end + 1 - position]
+        position = chunk_end
+        if position > end:
+            return
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """Parse a single-range Range header; None means serve the whole archive."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+# Search
+# GET /search looks through the caller's assets, legacy instructions and
+# trusted parties. Every query term must match the start of a word in one of
+# the SEARCH_FIELDS, and results are ranked by the summed field weight of the
+# best match per term (an exact word counts fully, a prefix at
+# SEARCH_PREFIX_WEIGHT).
+#
+# Two backends share that ranking. "mongo" retrieves candidates from the
+# user_text indexes plus a word-prefix regex, which only scans the caller's
+# documents since every query leads with user_id. Where $text is unavailable,
+# "memory" keeps a per-user inverted index in process, built on first search
+# and updated in place by this worker's writes. The index remembers the
+# versions.<collection> counters it reflects; a write from another worker (or a
+# stats rebuild) moves them on, and the next search rebuilds it.
+SEARCH_TOKEN = re.compile(r"[a-z0-9]+")
+SEARCH_PREFIX_WEIGHT = 0.6
+SEARCH_MAX_TERMS = 10
+SEARCH_PAGE_SIZE = 20
+
+def search_tokens(text: Optional[str]) -> List[str]:
+    return SEARCH_TOKEN.findall(text.lower()) if text else []
+
+def search_terms(q: str) -> List[str]:
+    return list(dict.fromkeys(search_tokens(q)))[:SEARCH_MAX_TERMS]
+
+def score_document(collection: str, doc: dict, terms: List[str]) -> float:
+    """Ranking score of doc for terms; 0 unless every term matches."""
+    fields = [(weight, search_tokens(doc.get(field))) for field, weight in SEARCH_FIELDS[collection].items()]
+    score = 0.0
+    for term in terms:
+        best = 0.0
+        for weight, tokens in fields:
+            for token in tokens:
+                if token == term:
+                    best = max(best, weight)
+                elif token.startswith(term):
+                    best = max(best, weight * SEARCH_PREFIX_WEIGHT)
+        if not best:
+            return 0.0
+        score += best
+    return score
+
+def search_result(collection: str, doc: dict) -> dict:
+    title_field, *detail_fields = SEARCH_FIELDS[collection]
+    return {
+        "type": collection,
+        "id": doc["id"],
+        "vault_id": doc.get("vault_id"),
+        "title": doc.get(title_field),
+        "detail": next((doc[field] for field in detail_fields if doc.get(field)), None),
+        "category": doc.get("category"),
+    }
+
+class SearchIndex:
+    """Inverted index over one user's searchable documents."""
+
+    def __init__(self, versions: Dict[str, int]):
+        self.versions = versions
+        self.results: Dict[tuple, dict] = {}  # (collection, id) -> search_result()
+        self.doc_tokens: Dict[tuple, List[str]] = {}
+        self.postings: Dict[str, Dict[tuple, float]] = {}
+        self.vocabulary: List[str] = []  # sorted, so a prefix is a contiguous run
+
+    def add(self, collection: str, doc: dict):
+        key = (collection, doc["id"])
+        self.remove(collection, doc["id"])
+        weights: Dict[str, float] = {}
+        for field, weight in SEARCH_FIELDS[collection].items():
+            for token in search_tokens(doc.get(field)):
+                weights[token] = max(weights.get(token, 0), weight)
+        self.results[key] = search_result(collection, doc)
+        self.doc_tokens[key] = list(weights)
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.vocabulary, token)
+            posting[key] = weight
+
+    def remove(self, collection: str, doc_id: str):
+        key = (collection, doc_id)
+        if self.results.pop(key, None) is None:
+            return
+        for token in self.doc_tokens.pop(key):
+            posting = self.postings[token]
+            del posting[key]
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _matches(self, term: str) -> Dict[tuple, float]:
+        matched: Dict[tuple, float] = {}
+        position = bisect.bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+            token = self.vocabulary[position]
+            factor = 1.0 if token == term else SEARCH_PREFIX_WEIGHT
+            for key, weight in self.postings[token].items():
+                if weight * factor > matched.get(key, 0):
+                    matched[key] = weight * factor
+            position += 1
+        return matched
+
+    def search(self, terms: List[str]) -> List[tuple]:
+        """(score, result) for every document matching all terms."""
+        scores: Optional[Dict[tuple, float]] = None
+        for term in terms:
+            matched = self._matches(term)
+            scores = matched if scores is None else {key: scores[key] + score for key, score in matched.items() if key in scores}
+            if not scores:
+                return []
+        return [(score, self.results[key]) for key, score in scores.items()]
+
+class SearchService:
+    def __init__(self, backend: str = SEARCH_BACKEND, max_users: int = SEARCH_MEMORY_USERS):
+        self.backend = None if backend == "auto" else backend
+        self.max_users = max_users
+        self.indexes: "OrderedDict[str, SearchIndex]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"searches": 0, "builds": 0, "updates": 0}
+
+    async def resolve_backend(self) -> str:
+        if self.backend is None:
+            # Same shape as _mongo_search(); a deployment without the text
+            # indexes rejects it. In-memory test doubles lack $text altogether
+            # and must set SEARCH_BACKEND=memory
+            try:
+                await db.assets.find(
+                    {"user_id": "", "$text": {"$search": "probe"}}, {"_id": 0, "text_score": {"$meta": "textScore"}}
+                ).sort([("text_score", {"$meta": "textScore"})]).limit(1).to_list(1)
+                self.backend = "mongo"
+            except OperationFailure as e:
+                logger.info(f"Text search unavailable, using the memory search backend: {e}")
+                self.backend = "memory"
+        return self.backend
+
+    def apply(self, user_id: str, collection: str, added: List[dict] = (), removed: List[str] = ()):
+        """Mirror a write into the user's loaded index. Call once per bump_user_stats() on the collection."""
+        index = self.indexes.get(user_id)
+        if index is None:
+            return
+        for doc in added:
+            index.add(collection, doc)
+        for doc_id in removed:
+            index.remove(collection, doc_id)
+        index.versions[collection] = index.versions.get(collection, 0) + 1
+        self.counters["updates"] += 1
+
+    def invalidate(self, user_id: str):
+        self.indexes.pop(user_id, None)
+
+    async def _build(self, user_id: str, versions: Dict[str, int], deleted_vaults: List[str]) -> SearchIndex:
+        index = SearchIndex(versions)
+        query = {"user_id": user_id, "vault_id": {"$nin": deleted_vaults}}
+        for collection, fields in SEARCH_FIELDS.items():
+            projection = {"_id": 0, "id": 1, "vault_id": 1, "category": 1, **{field: 1 for field in fields}}
+            async for doc in db[collection].find(query, projection):
+                index.add(collection, doc)
+        self.counters["builds"] += 1
+        self.indexes[user_id] = index
+        while len(self.indexes) > self.max_users:
+            self.indexes.popitem(last=False)
+        return index
+
+    async def _index(self, user_id: str, stats: Optional[dict]) -> SearchIndex:
+        versions = {collection: (stats or {}).get("versions", {}).get(collection, 0) for collection in SEARCH_FIELDS}
+        index = self.indexes.get(user_id)
+        if index is not None and index.versions == versions:
+            self.indexes.move_to_end(user_id)
+            return index
+        task = self.inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(user_id, versions, (stats or {}).get("deleted_vaults", [])))
+            self.inflight[user_id] = task
+            task.add_done_callback(lambda _: self.inflight.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _mongo_search(self, collection: str, query: dict, terms: List[str], want: int) -> List[tuple]:
+        """Whole words (and their stems) come from $text, ranked by textScore. The
+        prefix regex scans the caller's documents, so it only runs when $text
+        found fewer than `want` matches of every term."""
+        fields = SEARCH_FIELDS[collection]
+        projection = {"_id": 0, "id": 1, "vault_id": 1, "category": 1, **{field: 1 for field in fields}}
+        text_hits = await db[collection].find(
+            {**query, "$text": {"$search": " ".join(terms)}},
+            {**projection, "text_score": {"$meta": "textScore"}}
+        ).sort([("text_score", {"$meta": "textScore"})]).limit(want).to_list(want)
+        # $text matches any one of the terms, so a hit must match them all. Only
+        # a single-term query can trust it for a stem-only match ("investing"
+        # for "investment") and keep Mongo's score
+        scored = {}
+        for doc in text_hits:
+            score = score_document(collection, doc, terms) or (doc["text_score"] if len(terms) == 1 else 0)
+            if score:
+                scored[doc["id"]] = (score, doc)
+        if len(scored) < want:
+            prefix_query = {**query, "$and": [
+                {"$or": [{field: {"$regex": rf"\b{re.escape(term)}", "$options": "i"}} for field in fields]}
+                for term in terms
+            ]}
+            for doc in await db[collection].find(prefix_query, projection).limit(want).to_list(want):
+                if doc["id"] not in scored:
+                    scored[doc["id"]] = (score_document(collection, doc, terms), doc)
+        return [(score, search_result(collection, doc)) for score, doc in scored.values() if score]
+
+    async def search(self, user_id: str, terms: List[str], collections: List[str], vault_id: Optional[str],
+                     category: Optional[str], offset: int, limit: int) -> tuple:
+        """Return (page of results, whether more follow)."""
+        self.counters["searches"] += 1
+        want = min(offset + limit + 1, SEARCH_MAX_RESULTS)
+        stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "versions": 1, "deleted_vaults": 1})
+        deleted_vaults = (stats or {}).get("deleted_vaults", [])
+        scored = []
+        if await self.resolve_backend() == "mongo":
+            query = {"user_id": user_id, "vault_id": vault_id or {"$nin": deleted_vaults}}
+            if vault_id in deleted_vaults:
+                return [], False
+            for collection in collections:
+                scoped = {**query, "category": category} if category else query
+                scored += await self._mongo_search(collection, scoped, terms, want)
+        else:
+            index = await self._index(user_id, stats)
+            for score, result in index.search(terms):
+                if (result["type"] in collections and result["vault_id"] not in deleted_vaults
+                        and (not vault_id or result["vault_id"] == vault_id)
+                        and (not category or result["category"] == category)):
+                    scored.append((score, result))
+        scored.sort(key=lambda item: (-item[0], (item[1]["title"] or "").lower(), item[1]["id"]))
+        page = [{**result, "score": round(score, 2)} for score, result in scored[offset:min(offset + limit, want)]]
+        return page, len(scored) > offset + limit and offset + limit < SEARCH_MAX_RESULTS
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, **self.counters, "indexed_users": len(self.indexes),
+                "indexed_documents": sum(len(index.results) for index in self.indexes.values())}
+
+search_service = SearchService()
+
+def encode_search_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+def decode_search_cursor(cursor: str) -> int:
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+# Conditional requests
+# GET routes first read the user's version counters (one point read on
+# user_stats) and derive a weak ETag from them plus the request URL and Accept
+# header. A matching If-None-Match is answered with 304 before any collection
+# query runs. Versions are per user, so the ETag of a vault-filtered list also
+# changes when another vault's data does; that costs a refetch, never a stale read.
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+async def conditional_get(request: Request, user_id: str, *collections: str, stats: Optional[dict] = None,
+                          salt: str = "") -> tuple:
+    """Return (304 response or None, etag) for a GET over the given collections.
+
+    Pass stats when the caller already holds the user's stats document, and a
+    salt for lists that can also change without a version bump.
+    """
+    if stats is None:
+        stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0, "versions": 1})
+    versions = (stats or {}).get("versions", {})
+    fingerprint = hashlib.sha256(
+        f"{user_id}|{request.url.path}?{request.url.query}|{request.headers.get('accept', '')}|".encode()
+        + ",".join(str(versions.get(collection, 0)) for collection in collections).encode()
+        + salt.encode()
+    )
+    etag = f'W/"{fingerprint.hexdigest()[:24]}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"}), etag
+    return None, etag
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# Response compression
+# gzip or, when the brotli package is installed and the client accepts it, br.
+# Buffered responses are compressed once they reach COMPRESSION_MIN_SIZE;
+# NDJSON streams are compressed chunk by chunk with a sync flush so rows still
+# arrive as they are produced. Event streams, ZIP archives and partial content
+# pass through untouched. Every compressible response, and every 304, carries
+# Vary: Accept-Encoding whether or not this one was compressed, so a shared
+# cache never hands a gzip body to a client that did not ask for one.
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/csv")
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.engine = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.engine = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self.engine.process(data)
+            return out + (self.engine.finish() if final else self.engine.flush())
+        out = self.engine.compress(data)
+        return out + self.engine.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    offered = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+def with_vary(headers: list) -> list:
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if value.strip() == b"*" or b"accept-encoding" in value.lower():
+                return headers
+            return headers[:i] + [(name, value + b", Accept-Encoding")] + headers[i + 1:]
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict((k.lower(), v) for k, v in scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                response_headers = dict((k.lower(), v) for k, v in message.get("headers", []))
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+                if b"content-encoding" not in response_headers and (compressible or message["status"] == 304):
+                    message = {**message, "headers": with_vary(list(message.get("headers", [])))}
+                if (encoding is None or message["status"] != 200 or b"content-encoding" in response_headers
+                        or not compressible):
+                    passthrough = True
+                    return await send(message)
+                start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    return await send(message)
+                compressor = _Compressor(encoding)
+                response_headers = [(k, v) for k, v in start_message["headers"] if k.lower() != b"content-length"]
+                response_headers.append((b"content-encoding", encoding.encode()))
+                if not more_body:
+                    compressed = compressor.compress(body, final=True)
+                    response_headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start_message, "headers": response_headers})
+                    return await send({"type": "http.response.body", "body": compressed})
+                await send({**start_message, "headers": response_headers})
+            await send({"type": "http.response.body", "body": compressor.compress(body, final=not more_body),
+                        "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+# Pagination
+# List endpoints use keyset pagination on PAGE_SORT. The next page's cursor is
+# returned in the X-Next-Cursor header so the JSON body stays a plain list.
+# Clients sending "Accept: application/x-ndjson" get the rows streamed straight
+# from the Motor cursor instead, one JSON document per line. Requests without a
+# limit get MAX_PAGE_SIZE rows, as the routes returned before paging existed;
+# the frontend list pages don't follow X-Next-Cursor.
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = MAX_PAGE_SIZE
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_cursor(doc: dict) -> str:
+    position = [doc["created_at"], doc["id"]]
+    if isinstance(doc["created_at"], str):
+        # Rows not yet converted by migrate_datetimes.py still hold ISO strings
+        position.append("str")
+    raw = json.dumps(position, default=_json_default)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        created_at, last_id, *kind = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if kind != ["str"]:
+            created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if kind:
+        # Mongo sorts every string before every date, and $gt only matches
+        # values of the same type, so the page after a string position is the
+        # remaining strings followed by all of the dates
+        return {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}},
+            {"created_at": {"$type": "date"}},
+        ]}
+    return {
+        "created_at": {"$gte": created_at},
+        "$or": [{"created_at": {"$gt": created_at}}, {"id": {"$gt": last_id}}],
+    }
+
+async def stream_ndjson(cursor, model, row_hook=None):
+    async for doc in cursor:
+        if row_hook:
+            doc = row_hook(doc)
+        yield dump_row(model, doc) + b"\n"
+
+async def list_page(collection, query: dict, model, request: Request, cursor: Optional[str],
+                    limit: Optional[int], projection: Optional[dict] = None, row_hook=None) -> Response:
+    stats = await db.user_stats.find_one({"user_id": query["user_id"]}, {"_id": 0, "versions": 1, "deleted_vaults": 1})
+    # Version counters are keyed by collection name (see STATS_VERSIONS)
+    not_modified, etag = await conditional_get(request, query["user_id"], collection.name, stats=stats)
+    if not_modified:
+        return not_modified
+    deleted_vaults = (stats or {}).get("deleted_vaults")
+    if deleted_vaults and collection.name in VAULT_SCOPED_COLLECTIONS:
+        # Contents of tombstoned vaults stay hidden until the reaper removes them
+        query = {**query, "$and": [{"vault_id": {"$nin": deleted_vaults}}]}
+    if cursor:
+        query = {**query, **decode_cursor(cursor)}
+    find = collection.find(query, projection or {"_id": 0}).sort(PAGE_SORT)
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        if limit:
+            find = find.limit(limit)
+        return with_etag(StreamingResponse(stream_ndjson(find, model, row_hook), media_type=NDJSON_MEDIA_TYPE), etag)
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    docs = await find.limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    if row_hook:
+        docs = [row_hook(doc) for doc in docs]
+    return with_etag(fast_list_response(model, docs, headers), etag)
+
+# Bulk import
+# Bulk endpoints accept a JSON array, or stream CSV (text/csv, header row
+# required) or NDJSON (application/x-ndjson) bodies. Rows are validated and
+# written a chunk at a time: each distinct vault_id in a chunk is authorized
+# with one query, valid rows go out in one unordered insert_many, and every
+# rejected row is reported by its position instead of failing the upload.
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "500"))
+CSV_MEDIA_TYPE = "text/csv"
+
+async def iter_body_lines(request: Request):
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig")
+    if pending:
+        yield pending.decode("utf-8-sig")
+
+async def iter_bulk_rows(request: Request):
+    """Yield (row_number, row) pairs; row is a dict or an error string."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    row_number = 0
+    if content_type == NDJSON_MEDIA_TYPE:
+        async for line in iter_body_lines(request):
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = f"Invalid JSON: {e}"
+            yield row_number, row if isinstance(row, (dict, str)) else "Row must be a JSON object"
+    elif content_type == CSV_MEDIA_TYPE:
+        header = None
+        record = ""
+        async for line in iter_body_lines(request):
+            record = f"{record}\n{line}" if record else line
+            if record.count('"') % 2:
+                continue  # quoted field continues on the next line
+            values = next(csv.reader([record.rstrip("\r")]), [])
+            record = ""
+            if not values:
+                continue
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            row_number += 1
+            row = {key: value for key, value in zip(header, values) if value != ""}
+            if "metadata" in row:
+                try:
+                    row["metadata"] = json.loads(row["metadata"])
+                except ValueError:
+                    row = "metadata must be a JSON object"
+            yield row_number, row
+        if record:
+            # The body ended inside a quoted field
+            if header is None:
+                raise HTTPException(status_code=400, detail="CSV header has an unterminated quoted field")
+            yield row_number + 1, "Unterminated quoted field"
+    else:
+        try:
+            rows = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array, CSV or NDJSON")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array, CSV or NDJSON")
+        for row in rows:
+            row_number += 1
+            yield row_number, row if isinstance(row, dict) else "Row must be a JSON object"
+
+async def bulk_import(request: Request, user_id: str, create_model, model, collection, after_insert,
+                      before_insert=None) -> BulkImportResult:
+    """Validate and insert uploaded rows.
+
+    before_insert(docs) may rewrite documents in place; after_insert(docs) sees
+    only the rows that were written. Both run once per chunk.
+    """
+    owned_vaults: Dict[str, bool] = {}
+    errors: List[BulkRowError] = []
+    totals = {"received": 0, "inserted": 0}
+
+    async def flush(chunk: List[tuple]):
+        valid = []
+        for row_number, row in chunk:
+            if isinstance(row, str):
+                errors.append(BulkRowError(row=row_number, error=row))
+                continue
+            try:
+                valid.append((row_number, create_model(**row)))
+            except ValidationError as e:
+                message = "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+                errors.append(BulkRowError(row=row_number, error=message))
+
+        unknown = {item.vault_id for _, item in valid if item.vault_id not in owned_vaults}
+        if unknown:
+            found_ids = await owned_vault_ids(unknown, user_id)
+            for vault_id in unknown:
+                owned_vaults[vault_id] = vault_id in found_ids
+
+        rows, docs = [], []
+        for row_number, item in valid:
+            if not owned_vaults[item.vault_id]:
+                errors.append(BulkRowError(row=row_number, error="Vault not found"))
+                continue
+            rows.append(row_number)
+            docs.append(model(user_id=user_id, **item.model_dump()).model_dump())
+        if not docs:
+            return
+        if before_insert:
+            await before_insert(docs)
+
+        failed_indexes = set()
+        try:
+            await collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed_indexes.add(write_error["index"])
+                errors.append(BulkRowError(row=rows[write_error["index"]], error=write_error.get("errmsg", "Write failed")))
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed_indexes]
+        totals["inserted"] += len(inserted)
+        if inserted:
+            await after_insert(inserted)
+
+    chunk = []
+    try:
+        async for row_number, row in iter_bulk_rows(request):
+            totals["received"] += 1
+            chunk.append((row_number, row))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await flush(chunk)
+                chunk = []
+    except UnicodeDecodeError:
+        detail = "Body must be UTF-8 encoded"
+        if totals["inserted"]:
+            # Earlier chunks are already written
+            detail += f"; {totals['inserted']} rows before the undecodable line were imported"
+        raise HTTPException(status_code=400, detail=detail)
+    if chunk:
+        await flush(chunk)
+
+    errors.sort(key=lambda e: e.row)
+    return BulkImportResult(
+        received=totals["received"],
+        inserted=totals["inserted"],
+        failed=len(errors),
+        errors=errors
+    )
+
 # Routes
-@api_router.post("/auth/register", response_model=Token)
+@api_router.post("/auth/register", response_model=Token, dependencies=[Depends(limit_by_ip)])
 async def register(user_create: UserCreate):
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_create.email})
@@ -275,291 +3446,589 @@ async def register(user_create: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
-    hashed_password = get_password_hash(user_create.password)
+    hashed_password = await password_pool.hash(user_create.password)
     user = User(
         email=user_create.email,
         full_name=user_create.full_name
     )
     user_dict = user.model_dump()
     user_dict["password_hash"] = hashed_password
-    user_dict["created_at"] = user_dict["created_at"].isoformat()
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create default vault
     vault = Vault(user_id=user.id, name="My Primary Vault", description="Default vault for digital assets")
     vault_dict = vault.model_dump()
-    vault_dict["created_at"] = vault_dict["created_at"].isoformat()
-    vault_dict["updated_at"] = vault_dict["updated_at"].isoformat()
     await db.vaults.insert_one(vault_dict)
+    vault_owner_cache.set(vault.id, user.id)
+    await db.user_stats.insert_one({
+        "user_id": user.id,
+        **{counter: 0 for counter in STATS_COUNTERS},
+        "vaults": 1,
+        "asset_breakdown": {},
+        "rebuilt_at": datetime.now(timezone.utc),
+    })
     
     # Send welcome notification
-    await send_mock_email(user.email, "Welcome to DRIV", f"Hello {user.full_name}, welcome to Digital Rights Inheritance Vault!")
+    await enqueue_email(user.email, "Welcome to DRIV", f"Hello {user.full_name}, welcome to Digital Rights Inheritance Vault!")
     
     # Create token
     access_token = create_access_token(data={"sub": user.id})
     return Token(access_token=access_token, user=user)
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, dependencies=[Depends(limit_by_ip)])
 async def login(user_login: UserLogin):
     user_doc = await db.users.find_one({"email": user_login.email})
-    if not user_doc or not verify_password(user_login.password, user_doc["password_hash"]):
+    if not user_doc or user_doc.get("deleted_at") or not await password_pool.verify(user_login.password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
-    # Convert datetime strings back
-    if isinstance(user_doc["created_at"], str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    
     user = User(**{k: v for k, v in user_doc.items() if k != "password_hash"})
+    user_cache.set(user.id, user)
     access_token = create_access_token(data={"sub": user.id})
     return Token(access_token=access_token, user=user)
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
+    user = user_cache.get(current_user["user_id"])
+    if user is not None:
+        return user
     user_doc = await db.users.find_one({"id": current_user["user_id"]}, {"_id": 0, "password_hash": 0})
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
-    if isinstance(user_doc["created_at"], str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(user.id, user)
+    return user
+
+@api_router.delete("/auth/me", status_code=202)
+async def delete_me(current_user: dict = Depends(get_current_user)):
+    """Tombstone the account and revoke its tokens; its data is removed in the background"""
+    user_id = current_user["user_id"]
+    result = await db.users.update_one(
+        {"id": user_id, "deleted_at": None}, {"$set": {"deleted_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Outlives every token issued before now
+    await revoke_token(f"user:{user_id}", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    invalidate_user(user_id)
+    search_service.invalidate(user_id)
+    return {"job_id": await deletion_reaper.start("user", user_id, user_id), "status": "running"}
+
+@api_router.get("/deletions/stats", dependencies=[Depends(require_metrics_token)])
+async def get_deletion_stats():
+    return deletion_reaper.stats()
+
+@api_router.get("/deletions/{job_id}")
+async def get_deletion_progress(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await db.deletion_jobs.find_one(
+        {"id": job_id, "user_id": current_user["user_id"]}, {"_id": 0, "lease_token": 0, "lease_until": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
+
+@api_router.post("/auth/logout", status_code=204)
+async def logout(current_user: dict = Depends(get_current_user)):
+    await revoke_token(current_user["token_digest"], current_user["exp"])
+    return None
+
+@api_router.get("/auth/cache-stats", dependencies=[Depends(require_metrics_token)])
+async def get_auth_cache_stats():
+    return {
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "vault_owner_cache": vault_owner_cache.stats(),
+        "revoked_tokens": len(revoked_token_digests),
+    }
 
 # Vault routes
 @api_router.get("/vaults", response_model=List[Vault])
-async def get_vaults(current_user: dict = Depends(get_current_user)):
-    vaults = await db.vaults.find({"user_id": current_user["user_id"]}, {"_id": 0}).to_list(100)
-    for vault in vaults:
-        for field in ["created_at", "updated_at"]:
-            if isinstance(vault.get(field), str):
-                vault[field] = datetime.fromisoformat(vault[field])
-    return [Vault(**v) for v in vaults]
+async def get_vaults(request: Request, current_user: dict = Depends(get_current_user)):
+    not_modified, etag = await conditional_get(request, current_user["user_id"], "vaults")
+    if not_modified:
+        return not_modified
+    vaults = await db.vaults.find({"user_id": current_user["user_id"], "deleted_at": None}, {"_id": 0}).to_list(100)
+    return with_etag(fast_list_response(Vault, vaults), etag)
 
 @api_router.post("/vaults", response_model=Vault)
 async def create_vault(vault_create: VaultCreate, current_user: dict = Depends(get_current_user)):
     vault = Vault(user_id=current_user["user_id"], **vault_create.model_dump())
     vault_dict = vault.model_dump()
-    vault_dict["created_at"] = vault_dict["created_at"].isoformat()
-    vault_dict["updated_at"] = vault_dict["updated_at"].isoformat()
     await db.vaults.insert_one(vault_dict)
+    vault_owner_cache.set(vault.id, vault.user_id)
+    await bump_user_stats(current_user["user_id"], {"vaults": 1})
     return vault
 
 @api_router.get("/vaults/{vault_id}", response_model=Vault)
 async def get_vault(vault_id: str, current_user: dict = Depends(get_current_user)):
-    vault = await db.vaults.find_one({"id": vault_id, "user_id": current_user["user_id"]}, {"_id": 0})
+    vault = await db.vaults.find_one({"id": vault_id, "user_id": current_user["user_id"], "deleted_at": None}, {"_id": 0})
     if not vault:
         raise HTTPException(status_code=404, detail="Vault not found")
-    for field in ["created_at", "updated_at"]:
-        if isinstance(vault.get(field), str):
-            vault[field] = datetime.fromisoformat(vault[field])
     return Vault(**vault)
 
+@api_router.delete("/vaults/{vault_id}", status_code=202)
+async def delete_vault(vault_id: str, current_user: dict = Depends(get_current_user)):
+    """Tombstone the vault; its contents are removed in the background (see DeletionReaper)"""
+    user_id = current_user["user_id"]
+    result = await db.vaults.update_one(
+        {"id": vault_id, "user_id": user_id, "deleted_at": None}, {"$set": {"deleted_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    invalidate_vault(vault_id)
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$addToSet": {"deleted_vaults": vault_id},
+         "$inc": {f"versions.{collection}": 1 for collection in ("vaults", *VAULT_SCOPED_COLLECTIONS)}},
+        upsert=True
+    )
+    return {"job_id": await deletion_reaper.start("vault", user_id, vault_id), "status": "running"}
+
+# Vault overview
+# Everything the vault page needs in one request. Each section is the first page
+# of the matching list endpoint, and its next_cursor continues there
+# (e.g. /assets?vault_id=...&cursor=...).
+OVERVIEW_SECTIONS = {
+    "assets": Asset,
+    "legacy_instructions": LegacyInstruction,
+    "trusted_parties": TrustedParty,
+    "death_verifications": DeathVerification,
+}
+OVERVIEW_DEFAULT_LIMIT = 50
+
+def _parse_overview_fields(fields: Optional[str], sections: List[str]) -> Dict[str, List[str]]:
+    requested: Dict[str, List[str]] = {}
+    for item in filter(None, (part.strip() for part in (fields or "").split(","))):
+        section, _, field = item.partition(".")
+        if section not in sections or field not in OVERVIEW_SECTIONS[section].model_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown field '{item}'")
+        requested.setdefault(section, []).append(field)
+    return requested
+
+def _parse_overview_limits(limits: Optional[str], default: int) -> Dict[str, int]:
+    parsed = {section: default for section in OVERVIEW_SECTIONS}
+    for item in filter(None, (part.strip() for part in (limits or "").split(","))):
+        section, _, value = item.partition("=")
+        if section not in OVERVIEW_SECTIONS or not value.isdigit() or not 0 <= int(value) <= MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail=f"Invalid limit '{item}'")
+        parsed[section] = int(value)
+    return parsed
+
+async def _overview_section(section: str, query: dict, fields: Optional[List[str]], limit: int) -> dict:
+    model = OVERVIEW_SECTIONS[section]
+    # Projecting to model fields keeps internal fields (claim tokens, ciphertext) out
+    projection = {"_id": 0, "id": 1, "created_at": 1, **{field: 1 for field in (fields or model.model_fields)}}
+    docs = await db[section].find(query, projection).sort(PAGE_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]) if docs else None
+    if section == "assets":
+        docs = [redact_asset(doc) for doc in docs]
+    return {"items": docs, "next_cursor": next_cursor}
+
+@api_router.get("/vaults/{vault_id}/overview")
+async def get_vault_overview(
+    vault_id: str,
+    sections: Optional[str] = Query(None, description="comma-separated sections; default all"),
+    fields: Optional[str] = Query(None, description="section.field pairs to project, e.g. assets.name,assets.category"),
+    limit: int = Query(OVERVIEW_DEFAULT_LIMIT, ge=0, le=MAX_PAGE_SIZE, description="items per section"),
+    limits: Optional[str] = Query(None, description="per-section overrides, e.g. assets=20,trusted_parties=5"),
+    current_user: dict = Depends(get_current_user),
+):
+    """The vault plus the first page of each of its sections"""
+    wanted = [part.strip() for part in sections.split(",")] if sections else list(OVERVIEW_SECTIONS)
+    unknown = [section for section in wanted if section not in OVERVIEW_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown section '{unknown[0]}'")
+    projections = _parse_overview_fields(fields, wanted)
+    section_limits = _parse_overview_limits(limits, limit)
+
+    # Sections are scoped by user_id, so they can run alongside the vault read
+    # that authorizes the request; nothing is returned if that read misses.
+    query = {"user_id": current_user["user_id"], "vault_id": vault_id}
+    vault, *results = await asyncio.gather(
+        db.vaults.find_one(
+            {"id": vault_id, "user_id": current_user["user_id"], "deleted_at": None},
+            {"_id": 0, **{field: 1 for field in Vault.model_fields}}
+        ),
+        *(_overview_section(section, query, projections.get(section), section_limits[section]) for section in wanted),
+    )
+    if not vault:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    return {"vault": vault, **dict(zip(wanted, results))}
+
+@api_router.get("/vaults/{vault_id}/export")
+async def export_vault(vault_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """ZIP of NDJSON files for the vault's collections, with a checksummed manifest"""
+    user_id = current_user["user_id"]
+    vault = await db.vaults.find_one({"id": vault_id, "user_id": user_id, "deleted_at": None}, {"_id": 0, "content_version": 1})
+    if not vault:
+        raise HTTPException(status_code=404, detail="Vault not found")
+    etag = await vault_export_etag(user_id, vault_id, vault.get("content_version", 0))
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="vault-{vault_id}.zip"',
+    }
+    recorded = await db.vault_exports.find_one({"vault_id": vault_id, "etag": etag}, {"_id": 0, "size": 1})
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # Without a recorded size the Range is ignored (RFC 9110 allows it): sizing
+    # the archive first would mean generating it twice
+    if range_header and recorded and (if_range is None or if_range == etag):
+        size = recorded["size"]
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                slice_stream(iter_vault_export(user_id, vault_id, etag), start, end),
+                status_code=206, media_type="application/zip", headers=headers,
+            )
+
+    if recorded:
+        headers["Content-Length"] = str(recorded["size"])
+        body = iter_vault_export(user_id, vault_id, etag)
+    else:
+        body = record_export_size(vault_id, etag, iter_vault_export(user_id, vault_id, etag))
+    return StreamingResponse(body, media_type="application/zip", headers=headers)
+
+@api_router.get("/vaults/{vault_id}/credentials")
+async def export_vault_credentials(vault_id: str, current_user: dict = Depends(get_current_user)):
+    """Decrypt every asset credential in a vault"""
+    await authorize_vault(vault_id, current_user["user_id"])
+    assets = await db.assets.find(
+        {"user_id": current_user["user_id"], "vault_id": vault_id, "credentials": {"$ne": None}},
+        {"_id": 0, "id": 1, "vault_id": 1, "name": 1, "credentials": 1, "credentials_encrypted": 1}
+    ).to_list(None)
+    revealed = await reveal_asset_credentials(assets)
+    return [{"asset_id": a["id"], "name": a["name"], "credentials": revealed[a["id"]]} for a in assets]
+
 # Asset routes
 @api_router.get("/assets", response_model=List[Asset])
-async def get_assets(vault_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_assets(request: Request, vault_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     query = {"user_id": current_user["user_id"]}
     if vault_id:
         query["vault_id"] = vault_id
-    assets = await db.assets.find(query, {"_id": 0}).to_list(1000)
-    for asset in assets:
-        if isinstance(asset.get("created_at"), str):
-            asset["created_at"] = datetime.fromisoformat(asset["created_at"])
-    return [Asset(**a) for a in assets]
+    return await list_page(db.assets, query, Asset, request, cursor, limit,
+                           projection={"_id": 0, "credentials_encrypted": 0}, row_hook=redact_asset)
 
 @api_router.post("/assets", response_model=Asset)
 async def create_asset(asset_create: AssetCreate, current_user: dict = Depends(get_current_user)):
-    # Verify vault ownership
-    vault = await db.vaults.find_one({"id": asset_create.vault_id, "user_id": current_user["user_id"]})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
+    await authorize_vault(asset_create.vault_id, current_user["user_id"])
     
     asset = Asset(user_id=current_user["user_id"], **asset_create.model_dump())
     asset_dict = asset.model_dump()
-    asset_dict["created_at"] = asset_dict["created_at"].isoformat()
+    await seal_asset_credentials([asset_dict])
     await db.assets.insert_one(asset_dict)
-    return asset
+    await bump_user_stats(current_user["user_id"], {"assets": 1, f"asset_breakdown.{asset.category.value}": 1})
+    search_service.apply(current_user["user_id"], "assets", added=[asset_dict])
+    await bump_vault_version(asset.vault_id)
+    return asset.model_copy(update={"credentials": asset_dict["credentials"]})
+
+@api_router.post("/assets/bulk", response_model=BulkImportResult)
+async def bulk_create_assets(request: Request, current_user: dict = Depends(get_current_user)):
+    async def after_insert(docs: List[dict]):
+        deltas = {"assets": len(docs)}
+        for doc in docs:
+            key = f"asset_breakdown.{AssetCategory(doc['category']).value}"
+            deltas[key] = deltas.get(key, 0) + 1
+        await bump_user_stats(current_user["user_id"], deltas)
+        search_service.apply(current_user["user_id"], "assets", added=docs)
+        await bump_vault_version(*(doc["vault_id"] for doc in docs))
+    
+    return await bulk_import(request, current_user["user_id"], AssetCreate, Asset, db.assets, after_insert,
+                             before_insert=seal_asset_credentials)
+
+@api_router.get("/assets/{asset_id}/credentials")
+async def reveal_credentials(asset_id: str, current_user: dict = Depends(get_current_user)):
+    asset = await db.assets.find_one(
+        {"id": asset_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "id": 1, "vault_id": 1, "credentials": 1, "credentials_encrypted": 1}
+    )
+    if not asset:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    await authorize_vault(asset["vault_id"], current_user["user_id"])
+    revealed = await reveal_asset_credentials([asset])
+    return {"asset_id": asset_id, "credentials": revealed[asset_id]}
 
 @api_router.delete("/assets/{asset_id}", status_code=204)
 async def delete_asset(asset_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.assets.delete_one({"id": asset_id, "user_id": current_user["user_id"]})
-    if result.deleted_count == 0:
+    asset = await db.assets.find_one_and_delete(
+        {"id": asset_id, "user_id": current_user["user_id"]},
+        projection={"_id": 0, "vault_id": 1, "category": 1}
+    )
+    if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
+    try:
+        category = AssetCategory(asset.get("category")).value
+    except ValueError:
+        # Counted under OTHER by rebuild_user_stats, like any category the enum dropped
+        category = AssetCategory.OTHER.value
+    await bump_user_stats(current_user["user_id"], {"assets": -1, f"asset_breakdown.{category}": -1})
+    search_service.apply(current_user["user_id"], "assets", removed=[asset_id])
+    await bump_vault_version(asset["vault_id"])
     return None
 
 # Legacy instructions
 @api_router.get("/legacy-instructions", response_model=List[LegacyInstruction])
-async def get_legacy_instructions(vault_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_legacy_instructions(request: Request, vault_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     query = {"user_id": current_user["user_id"]}
     if vault_id:
         query["vault_id"] = vault_id
-    instructions = await db.legacy_instructions.find(query, {"_id": 0}).to_list(1000)
-    for inst in instructions:
-        for field in ["created_at", "execution_date"]:
-            if inst.get(field) and isinstance(inst[field], str):
-                inst[field] = datetime.fromisoformat(inst[field])
-    return [LegacyInstruction(**i) for i in instructions]
+    return await list_page(db.legacy_instructions, query, LegacyInstruction, request, cursor, limit)
 
 @api_router.post("/legacy-instructions", response_model=LegacyInstruction)
 async def create_legacy_instruction(instruction_create: LegacyInstructionCreate, current_user: dict = Depends(get_current_user)):
-    vault = await db.vaults.find_one({"id": instruction_create.vault_id, "user_id": current_user["user_id"]})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
+    await authorize_vault(instruction_create.vault_id, current_user["user_id"])
     
     instruction = LegacyInstruction(user_id=current_user["user_id"], **instruction_create.model_dump())
     instruction_dict = instruction.model_dump()
-    instruction_dict["created_at"] = instruction_dict["created_at"].isoformat()
-    if instruction_dict.get("execution_date"):
-        instruction_dict["execution_date"] = instruction_dict["execution_date"].isoformat()
     await db.legacy_instructions.insert_one(instruction_dict)
+    await bump_user_stats(current_user["user_id"], {"legacy_instructions": 1})
+    search_service.apply(current_user["user_id"], "legacy_instructions", added=[instruction_dict])
+    await bump_vault_version(instruction.vault_id)
     return instruction
 
+@api_router.post("/legacy-instructions/bulk", response_model=BulkImportResult)
+async def bulk_create_legacy_instructions(request: Request, current_user: dict = Depends(get_current_user)):
+    async def after_insert(docs: List[dict]):
+        await bump_user_stats(current_user["user_id"], {"legacy_instructions": len(docs)})
+        search_service.apply(current_user["user_id"], "legacy_instructions", added=docs)
+        await bump_vault_version(*(doc["vault_id"] for doc in docs))
+    
+    return await bulk_import(request, current_user["user_id"], LegacyInstructionCreate, LegacyInstruction, db.legacy_instructions, after_insert)
+
 @api_router.delete("/legacy-instructions/{instruction_id}", status_code=204)
 async def delete_legacy_instruction(instruction_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.legacy_instructions.delete_one({"id": instruction_id, "user_id": current_user["user_id"]})
-    if result.deleted_count == 0:
+    instruction = await db.legacy_instructions.find_one_and_delete(
+        {"id": instruction_id, "user_id": current_user["user_id"]},
+        projection={"_id": 0, "vault_id": 1}
+    )
+    if not instruction:
         raise HTTPException(status_code=404, detail="Legacy instruction not found")
+    await bump_user_stats(current_user["user_id"], {"legacy_instructions": -1})
+    search_service.apply(current_user["user_id"], "legacy_instructions", removed=[instruction_id])
+    await bump_vault_version(instruction["vault_id"])
     return None
 
 # Trusted parties
 @api_router.get("/trusted-parties", response_model=List[TrustedParty])
-async def get_trusted_parties(vault_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_trusted_parties(request: Request, vault_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     query = {"user_id": current_user["user_id"]}
     if vault_id:
         query["vault_id"] = vault_id
-    parties = await db.trusted_parties.find(query, {"_id": 0}).to_list(1000)
-    for party in parties:
-        for field in ["created_at", "signed_at"]:
-            if party.get(field) and isinstance(party[field], str):
-                party[field] = datetime.fromisoformat(party[field])
-    return [TrustedParty(**p) for p in parties]
+    return await list_page(db.trusted_parties, query, TrustedParty, request, cursor, limit)
 
 @api_router.post("/trusted-parties", response_model=TrustedParty)
 async def create_trusted_party(party_create: TrustedPartyCreate, current_user: dict = Depends(get_current_user)):
-    vault = await db.vaults.find_one({"id": party_create.vault_id, "user_id": current_user["user_id"]})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
+    await authorize_vault(party_create.vault_id, current_user["user_id"])
     
     party = TrustedParty(user_id=current_user["user_id"], **party_create.model_dump())
     party_dict = party.model_dump()
-    party_dict["created_at"] = party_dict["created_at"].isoformat()
-    if party_dict.get("signed_at"):
-        party_dict["signed_at"] = party_dict["signed_at"].isoformat()
     await db.trusted_parties.insert_one(party_dict)
+    await bump_user_stats(current_user["user_id"], {"trusted_parties": 1})
+    search_service.apply(current_user["user_id"], "trusted_parties", added=[party_dict])
+    await bump_vault_version(party.vault_id)
+    if party.role == RoleType.VERIFIER:
+        await update_vault_quorum(party.vault_id, {"verifiers": 1})
     
     # Send notification
-    await send_mock_email(party.email, "You've been added as a trusted party", 
-                         f"You have been designated as a {party.role} for {current_user['user_id']}'s digital vault.")
+    await enqueue_email(party.email, "You've been added as a trusted party",
+                        f"You have been designated as a {party.role.value} for {current_user['user_id']}'s digital vault.")
     return party
 
+@api_router.post("/trusted-parties/bulk", response_model=BulkImportResult)
+async def bulk_create_trusted_parties(request: Request, current_user: dict = Depends(get_current_user)):
+    async def after_insert(docs: List[dict]):
+        await bump_user_stats(current_user["user_id"], {"trusted_parties": len(docs)})
+        search_service.apply(current_user["user_id"], "trusted_parties", added=docs)
+        await bump_vault_version(*(doc["vault_id"] for doc in docs))
+        verifiers: Dict[str, int] = {}
+        for doc in docs:
+            if doc["role"] == RoleType.VERIFIER:
+                verifiers[doc["vault_id"]] = verifiers.get(doc["vault_id"], 0) + 1
+        for vault_id, count in verifiers.items():
+            await update_vault_quorum(vault_id, {"verifiers": count})
+        await email_dispatcher.enqueue_many([
+            (doc["email"], "You've been added as a trusted party",
+             f"You have been designated as a {RoleType(doc['role']).value} for {current_user['user_id']}'s digital vault.")
+            for doc in docs
+        ])
+    
+    return await bulk_import(request, current_user["user_id"], TrustedPartyCreate, TrustedParty, db.trusted_parties, after_insert)
+
 @api_router.delete("/trusted-parties/{party_id}", status_code=204)
 async def delete_trusted_party(party_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.trusted_parties.delete_one({"id": party_id, "user_id": current_user["user_id"]})
-    if result.deleted_count == 0:
+    party = await db.trusted_parties.find_one_and_delete(
+        {"id": party_id, "user_id": current_user["user_id"]},
+        projection={"_id": 0, "vault_id": 1, "role": 1}
+    )
+    if not party:
         raise HTTPException(status_code=404, detail="Trusted party not found")
+    await bump_user_stats(current_user["user_id"], {"trusted_parties": -1})
+    search_service.apply(current_user["user_id"], "trusted_parties", removed=[party_id])
+    await bump_vault_version(party["vault_id"])
+    if party.get("role") == RoleType.VERIFIER:
+        await update_vault_quorum(party["vault_id"], {"verifiers": -1})
     return None
 
 # Death verification
 @api_router.get("/death-verifications", response_model=List[DeathVerification])
-async def get_death_verifications(vault_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_death_verifications(request: Request, vault_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
     query = {"user_id": current_user["user_id"]}
     if vault_id:
         query["vault_id"] = vault_id
-    verifications = await db.death_verifications.find(query, {"_id": 0}).to_list(1000)
-    for ver in verifications:
-        for field in ["created_at", "verified_at"]:
-            if ver.get(field) and isinstance(ver[field], str):
-                ver[field] = datetime.fromisoformat(ver[field])
-    return [DeathVerification(**v) for v in verifications]
+    return await list_page(db.death_verifications, query, DeathVerification, request, cursor, limit)
 
 @api_router.post("/death-verifications", response_model=DeathVerification)
 async def create_death_verification(verification_create: DeathVerificationCreate, current_user: dict = Depends(get_current_user)):
-    vault = await db.vaults.find_one({"id": verification_create.vault_id, "user_id": current_user["user_id"]})
-    if not vault:
-        raise HTTPException(status_code=404, detail="Vault not found")
+    await authorize_vault(verification_create.vault_id, current_user["user_id"])
     
     verification = DeathVerification(user_id=current_user["user_id"], **verification_create.model_dump())
     verification_dict = verification.model_dump()
-    verification_dict["created_at"] = verification_dict["created_at"].isoformat()
-    if verification_dict.get("verified_at"):
-        verification_dict["verified_at"] = verification_dict["verified_at"].isoformat()
     await db.death_verifications.insert_one(verification_dict)
-    
-    # Check if threshold met for multi-signature
-    all_verifications = await db.death_verifications.find(
-        {"vault_id": verification_create.vault_id, "status": "verified"}
-    ).to_list(1000)
-    
-    trusted_parties_count = await db.trusted_parties.count_documents(
-        {"vault_id": verification_create.vault_id, "role": "verifier"}
-    )
-    
-    # If 2/3 threshold met, trigger vault unlock (mock)
-    if len(all_verifications) >= max(2, trusted_parties_count * 0.66):
-        await db.vaults.update_one(
-            {"id": verification_create.vault_id},
-            {"$set": {"is_locked": False}}
-        )
-        logger.info(f"Vault {verification_create.vault_id} unlocked after verification threshold met")
-    
+    await bump_user_stats(current_user["user_id"], {"verifications": 1})
+    await bump_vault_version(verification.vault_id)
+    await update_vault_quorum(verification.vault_id, {"submitted": 1})
     return verification
 
 @api_router.patch("/death-verifications/{verification_id}/status")
 async def update_verification_status(verification_id: str, status: VerificationStatus, current_user: dict = Depends(get_current_user)):
     update_data = {"status": status}
     if status == VerificationStatus.VERIFIED:
-        update_data["verified_at"] = datetime.now(timezone.utc).isoformat()
+        update_data["verified_at"] = datetime.now(timezone.utc)
     
-    result = await db.death_verifications.update_one(
-        {"id": verification_id, "user_id": current_user["user_id"]},
-        {"$set": update_data}
+    # Only a real status transition matches, so the verified counter moves exactly once
+    previous = await db.death_verifications.find_one_and_update(
+        {"id": verification_id, "user_id": current_user["user_id"], "status": {"$ne": status}},
+        {"$set": update_data},
+        projection={"_id": 0, "vault_id": 1, "status": 1}
     )
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Verification not found")
+    if previous is None:
+        exists = await db.death_verifications.find_one({"id": verification_id, "user_id": current_user["user_id"]}, {"_id": 1})
+        if not exists:
+            raise HTTPException(status_code=404, detail="Verification not found")
+        return {"message": "Status updated"}
+    
+    await bump_vault_version(previous["vault_id"])
+    await bump_user_versions(current_user["user_id"], "death_verifications")
+    if status == VerificationStatus.VERIFIED:
+        await update_vault_quorum(previous["vault_id"], {"verified": 1})
+    elif previous.get("status") == VerificationStatus.VERIFIED:
+        await update_vault_quorum(previous["vault_id"], {"verified": -1})
     return {"message": "Status updated"}
 
 # Notifications
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: dict = Depends(get_current_user)):
+async def get_notifications(request: Request, current_user: dict = Depends(get_current_user)):
+    # The TTL monitor deletes expired notifications without a version bump, so
+    # the ETag also rolls over once per monitor pass
+    ttl_pass = str(int(time.time() // TTL_MONITOR_SECONDS))
+    not_modified, etag = await conditional_get(request, current_user["user_id"], "notifications", salt=ttl_pass)
+    if not_modified:
+        return not_modified
     notifications = await db.notifications.find({"user_id": current_user["user_id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    for notif in notifications:
-        if isinstance(notif.get("created_at"), str):
-            notif["created_at"] = datetime.fromisoformat(notif["created_at"])
-    return [Notification(**n) for n in notifications]
+    return with_etag(fast_list_response(Notification, notifications), etag)
 
 @api_router.post("/notifications", response_model=Notification)
 async def create_notification(notification_create: NotificationCreate, current_user: dict = Depends(get_current_user)):
-    notification = Notification(user_id=current_user["user_id"], **notification_create.model_dump())
-    notification_dict = notification.model_dump()
-    notification_dict["created_at"] = notification_dict["created_at"].isoformat()
-    await db.notifications.insert_one(notification_dict)
-    return notification
+    return await notify_user(current_user["user_id"], **notification_create.model_dump())
+
+@api_router.get("/notifications/stream")
+async def stream_notification_events(request: Request, current_user: dict = Depends(get_stream_user)):
+    """Server-Sent Events feed of new notifications.
+
+    Reconnects resume after the Last-Event-ID header (or last_event_id query
+    parameter) from storage, so nothing published in between is lost.
+    """
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    return StreamingResponse(
+        stream_notifications(current_user["user_id"], last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.get("/notifications/stream/stats", dependencies=[Depends(require_metrics_token)])
+async def get_notification_stream_stats():
+    return notification_hub.stats()
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_notification_count(current_user: dict = Depends(get_current_user)):
+    fresh_since = datetime.now(timezone.utc) - timedelta(seconds=UNREAD_RECOUNT_SECONDS)
+    stats = await db.user_stats.find_one(
+        {"user_id": current_user["user_id"], "unread_counted_at": {"$gte": fresh_since}},
+        {"_id": 0, "unread_notifications": 1}
+    )
+    if not stats:
+        return {"unread": await recount_unread_notifications(current_user["user_id"])}
+    return {"unread": max(0, stats.get("unread_notifications", 0))}
+
+async def mark_notifications_read(user_id: str, query: dict) -> int:
+    result = await db.notifications.update_many({**query, "user_id": user_id, "is_read": False}, {"$set": {"is_read": True}})
+    if result.modified_count:
+        await bump_user_stats(user_id, {"unread_notifications": -result.modified_count})
+    return result.modified_count
+
+@api_router.patch("/notifications/read-all")
+async def mark_all_notifications_read(current_user: dict = Depends(get_current_user)):
+    return {"updated": await mark_notifications_read(current_user["user_id"], {})}
+
+@api_router.patch("/notifications/read")
+async def mark_notifications_read_bulk(request: NotificationReadRequest, current_user: dict = Depends(get_current_user)):
+    return {"updated": await mark_notifications_read(current_user["user_id"], {"id": {"$in": request.ids}})}
 
 @api_router.patch("/notifications/{notification_id}/read", status_code=204)
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user["user_id"]},
-        {"$set": {"is_read": True}}
-    )
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Notification not found")
+    if await mark_notifications_read(current_user["user_id"], {"id": notification_id}) == 0:
+        exists = await db.notifications.find_one({"id": notification_id, "user_id": current_user["user_id"]}, {"_id": 1})
+        if not exists:
+            raise HTTPException(status_code=404, detail="Notification not found")
     return None
 
 # Subscriptions
 @api_router.get("/subscriptions", response_model=List[Subscription])
-async def get_subscriptions(current_user: dict = Depends(get_current_user)):
-    subscriptions = await db.subscriptions.find({"user_id": current_user["user_id"]}, {"_id": 0}).to_list(1000)
-    for sub in subscriptions:
-        for field in ["created_at", "last_payment_date"]:
-            if sub.get(field) and isinstance(sub[field], str):
-                sub[field] = datetime.fromisoformat(sub[field])
-    return [Subscription(**s) for s in subscriptions]
+async def get_subscriptions(request: Request, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), current_user: dict = Depends(get_current_user)):
+    return await list_page(db.subscriptions, {"user_id": current_user["user_id"]}, Subscription, request, cursor, limit)
+
+@api_router.get("/subscriptions/spend")
+async def get_subscription_spend(request: Request, current_user: dict = Depends(get_current_user)):
+    stats = await db.user_stats.find_one({"user_id": current_user["user_id"]}, {"_id": 0, "versions": 1})
+    not_modified, etag = await conditional_get(request, current_user["user_id"], "subscriptions", stats=stats)
+    if not_modified:
+        return not_modified
+    version = (stats or {}).get("versions", {}).get("subscriptions", 0)
+    rollup = await db.subscription_spend.find_one({"user_id": current_user["user_id"], "version": version}, {"_id": 0})
+    if rollup is None:
+        rollup = await refresh_subscription_spend(current_user["user_id"], version)
+    rollup.pop("version")
+    return with_etag(ORJSONResponse(rollup), etag)
+
+@api_router.get("/subscriptions/auto-cancel")
+async def get_auto_cancel_progress(current_user: dict = Depends(get_current_user)):
+    job = await db.cancellation_jobs.find_one(
+        {"user_id": current_user["user_id"]}, {"_id": 0, "lease_token": 0, "lease_until": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="No auto-cancel job for this user")
+    return job
+
+@api_router.get("/subscriptions/auto-cancel/stats", dependencies=[Depends(require_metrics_token)])
+async def get_auto_cancel_stats():
+    return auto_cancel_engine.stats()
 
 @api_router.post("/subscriptions", response_model=Subscription)
 async def create_subscription(subscription_create: SubscriptionCreate, current_user: dict = Depends(get_current_user)):
     subscription = Subscription(user_id=current_user["user_id"], **subscription_create.model_dump())
     subscription_dict = subscription.model_dump()
-    subscription_dict["created_at"] = subscription_dict["created_at"].isoformat()
-    if subscription_dict.get("last_payment_date"):
-        subscription_dict["last_payment_date"] = subscription_dict["last_payment_date"].isoformat()
     await db.subscriptions.insert_one(subscription_dict)
+    await subscription_mutated(current_user["user_id"])
     return subscription
 
 @api_router.delete("/subscriptions/{subscription_id}", status_code=204)
@@ -567,6 +4036,7 @@ async def delete_subscription(subscription_id: str, current_user: dict = Depends
     result = await db.subscriptions.delete_one({"id": subscription_id, "user_id": current_user["user_id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Subscription not found")
+    await subscription_mutated(current_user["user_id"])
     return None
 
 @api_router.post("/subscriptions/oauth-mock")
@@ -579,29 +4049,46 @@ async def mock_oauth_connect(current_user: dict = Depends(get_current_user)):
         "connected_services": ["Gmail", "Google Calendar", "Microsoft Outlook"]
     }
 
+# Search
+@api_router.get("/search")
+async def search(q: str = Query(min_length=1, max_length=200), types: Optional[str] = None,
+                 vault_id: Optional[str] = None, category: Optional[AssetCategory] = None, cursor: Optional[str] = None,
+                 limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=100), current_user: dict = Depends(get_current_user)):
+    """Ranked, prefix-matching search; types is a comma-separated subset of assets,legacy_instructions,trusted_parties"""
+    collections = [t.strip() for t in types.split(",")] if types else list(SEARCH_FIELDS)
+    unknown = set(collections) - set(SEARCH_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(sorted(unknown))}")
+    if category:
+        # Only assets have a category
+        collections = [collection for collection in collections if collection == "assets"]
+    terms = search_terms(q)
+    offset = decode_search_cursor(cursor) if cursor else 0
+    if not terms or not collections:
+        return ORJSONResponse([])
+    page, more = await search_service.search(current_user["user_id"], terms, collections, vault_id,
+                                             category.value if category else None, offset, limit)
+    headers = {NEXT_CURSOR_HEADER: encode_search_cursor(offset + limit)} if more else None
+    return ORJSONResponse(page, headers=headers)
+
+@api_router.get("/search/stats", dependencies=[Depends(require_metrics_token)])
+async def get_search_stats():
+    return search_service.stats()
+
 # AI Analysis
 @api_router.post("/ai/analyze", response_model=AIAnalysisResponse)
 async def analyze_with_ai(request: AIAnalysisRequest, current_user: dict = Depends(get_current_user)):
-    """AI-powered asset analysis using Hugging Face Transformers (mock for now)"""
-    # In production, load actual HF model for text generation
-    # from transformers import pipeline
-    # generator = pipeline('text-generation', model='gpt2')
-    
-    # Mock analysis for now
-    vault = await db.vaults.find_one({"id": request.vault_id, "user_id": current_user["user_id"]})
+    """Vault analysis from the configured analyzer backend (see AI_ANALYZER)"""
+    vault = await db.vaults.find_one(
+        {"id": request.vault_id, "user_id": current_user["user_id"], "deleted_at": None},
+        {"_id": 0, "content_version": 1}
+    )
     if not vault:
         raise HTTPException(status_code=404, detail="Vault not found")
     
-    assets_count = await db.assets.count_documents({"vault_id": request.vault_id})
-    instructions_count = await db.legacy_instructions.count_documents({"vault_id": request.vault_id})
-    
-    analysis_results = {
-        "asset_summary": f"[AI ANALYSIS] Your vault contains {assets_count} assets across multiple categories. Recommendation: Consider organizing financial assets separately and adding encryption to sensitive credentials.",
-        "risk_assessment": f"[AI ANALYSIS] Risk Level: LOW. You have {instructions_count} legacy instructions configured. Suggestion: Add at least 2 trusted verifiers for enhanced security.",
-        "recommendation": f"[AI ANALYSIS] Based on your {assets_count} assets, we recommend: 1) Enable auto-cancellation for subscriptions, 2) Add detailed legacy instructions, 3) Verify trusted party contact information."
-    }
-    
-    result = analysis_results.get(request.analysis_type, "Analysis type not supported")
+    result = await analysis_service.analyze(
+        current_user["user_id"], request.vault_id, request.analysis_type, vault.get("content_version", 0)
+    )
     
     return AIAnalysisResponse(
         vault_id=request.vault_id,
@@ -609,41 +4096,70 @@ async def analyze_with_ai(request: AIAnalysisRequest, current_user: dict = Depen
         result=result
     )
 
+@api_router.get("/ai/stats", dependencies=[Depends(require_metrics_token)])
+async def get_ai_stats():
+    return analysis_service.stats()
+
+@api_router.get("/scheduler/stats", dependencies=[Depends(require_metrics_token)])
+async def get_scheduler_stats():
+    return instruction_scheduler.stats()
+
+@api_router.get("/email/stats", dependencies=[Depends(require_metrics_token)])
+async def get_email_stats():
+    return email_dispatcher.stats()
+
 # Analytics
+DASHBOARD_VERSIONS = ("vaults", "assets", "legacy_instructions", "trusted_parties", "death_verifications")
+
 @api_router.get("/analytics/dashboard")
-async def get_dashboard_analytics(current_user: dict = Depends(get_current_user)):
-    vaults_count = await db.vaults.count_documents({"user_id": current_user["user_id"]})
-    assets_count = await db.assets.count_documents({"user_id": current_user["user_id"]})
-    instructions_count = await db.legacy_instructions.count_documents({"user_id": current_user["user_id"]})
-    trusted_parties_count = await db.trusted_parties.count_documents({"user_id": current_user["user_id"]})
-    verifications_count = await db.death_verifications.count_documents({"user_id": current_user["user_id"]})
-    
-    # Asset breakdown by category
-    assets = await db.assets.find({"user_id": current_user["user_id"]}, {"_id": 0, "category": 1}).to_list(1000)
-    category_breakdown = {}
-    for asset in assets:
-        cat = asset.get("category", "other")
-        category_breakdown[cat] = category_breakdown.get(cat, 0) + 1
+async def get_dashboard_analytics(request: Request, current_user: dict = Depends(get_current_user)):
+    stats = await db.user_stats.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+    if not stats or "rebuilt_at" not in stats:
+        # First read for a user that predates the stats document
+        stats = await rebuild_user_stats(current_user["user_id"])
+    not_modified, etag = await conditional_get(request, current_user["user_id"], *DASHBOARD_VERSIONS, stats=stats)
+    if not_modified:
+        return not_modified
+    return with_etag(ORJSONResponse(dashboard_payload(stats)), etag)
+
+@api_router.post("/analytics/dashboard/rebuild")
+async def rebuild_dashboard_analytics(current_user: dict = Depends(get_current_user)):
+    """Recompute the stats document from the source collections"""
+    return dashboard_payload(await rebuild_user_stats(current_user["user_id"]))
+
+def dashboard_payload(stats: dict) -> dict:
+    assets_count = stats.get("assets", 0)
+    instructions_count = stats.get("legacy_instructions", 0)
+    trusted_parties_count = stats.get("trusted_parties", 0)
     
     return {
-        "vaults": vaults_count,
+        "vaults": stats.get("vaults", 0),
         "assets": assets_count,
         "legacy_instructions": instructions_count,
         "trusted_parties": trusted_parties_count,
-        "verifications": verifications_count,
-        "asset_breakdown": category_breakdown,
+        "verifications": stats.get("verifications", 0),
+        "asset_breakdown": {cat: n for cat, n in stats.get("asset_breakdown", {}).items() if n > 0},
         "completion_percentage": min(100, (assets_count * 20 + instructions_count * 30 + trusted_parties_count * 50))
     }
 
 # Include router
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Content-Range", "Content-Disposition"],
 )
 
 logging.basicConfig(
@@ -652,6 +4168,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def check_master_key():
+    # Fail before serving anything rather than on the first credential write
+    master_cipher()
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def start_instruction_scheduler():
+    if SCHEDULER_ENABLED:
+        app.state.scheduler_task = asyncio.create_task(instruction_scheduler.run_forever())
+
+@app.on_event("shutdown")
+async def stop_instruction_scheduler():
+    task = getattr(app.state, "scheduler_task", None)
+    if task:
+        task.cancel()
+
+@app.on_event("startup")
+async def start_deletion_reaper():
+    app.state.reaper_task = asyncio.create_task(deletion_reaper.run_forever())
+
+@app.on_event("shutdown")
+async def stop_deletion_reaper():
+    app.state.reaper_task.cancel()
+    for task in list(deletion_reaper.tasks):
+        task.cancel()
+
+@app.on_event("startup")
+async def start_auto_cancel_engine():
+    app.state.auto_cancel_task = asyncio.create_task(auto_cancel_engine.run_forever())
+
+@app.on_event("shutdown")
+async def stop_auto_cancel_engine():
+    app.state.auto_cancel_task.cancel()
+    for task in list(auto_cancel_engine.tasks):
+        task.cancel()
+    await auto_cancel_engine.provider.close()
+
+@app.on_event("startup")
+async def start_notification_hub():
+    await notification_hub.start()
+
+@app.on_event("shutdown")
+async def stop_notification_hub():
+    await notification_hub.close()
+
+@app.on_event("startup")
+async def start_email_dispatcher():
+    app.state.email_task = asyncio.create_task(email_dispatcher.run_forever())
+
+@app.on_event("shutdown")
+async def stop_email_dispatcher():
+    app.state.email_task.cancel()
+    email_dispatcher.transport.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_pool():
+    password_pool.executor.shutdown(wait=False)
+
+@app.on_event("shutdown")
+async def shutdown_crypto_pool():
+    crypto_executor.shutdown(wait=False)
+
+@app.on_event("shutdown")
+async def shutdown_analyzer():
+    analysis_service.analyzer.close()
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Shared fixtures for the backend tests.
+
+The engines under test take an injectable database and clock, so every test
+runs against mongomock-motor (see backend/requirements-dev.txt) with a clock it
+advances by hand; no MongoDB server or real sleeping is needed. Route tests
+drive the app in process through `client`, on the same database.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "driv_test")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("SEARCH_BACKEND", "memory")
+if "MASTER_KEY_FILE" not in os.environ:
+    key_file = Path(tempfile.mkdtemp()) / "master.key"
+    key_file.write_bytes(os.urandom(32))
+    os.environ["MASTER_KEY_FILE"] = str(key_file)
+
+import server  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for utc_now; time only moves when a test calls advance()."""
+
+    def __init__(self, start: datetime = datetime(2030, 1, 1, tzinfo=timezone.utc)):
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def database(monkeypatch):
+    from mongomock_motor import AsyncMongoMockClient
+
+    database = AsyncMongoMockClient()["driv_test"]
+    # Helpers like bump_user_stats() use the module-level db
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+@pytest.fixture
+async def client(database):
+    """The app over an in-process ASGI transport, backed by `database`."""
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def register(client):
+    """Sign up a user and return their Authorization header."""
+    async def register(email: str, password: str = "test-password", full_name: str = "Test User") -> dict:
+        response = await client.post(
+            "/api/auth/register", json={"email": email, "password": password, "full_name": full_name}
+        )
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return register
+
+
+@pytest.fixture
+def drain():
+    """Wait for every job an engine has spawned, including ones spawned meanwhile."""
+    async def drain(engine):
+        while engine.tasks:
+            await asyncio.gather(*list(engine.tasks))
+    return drain
+
+
+@pytest.fixture
+def load(database):
+    """Fetch one document without its _id, e.g. load("deletion_jobs", id=job_id)."""
+    async def load(collection: str, **query) -> dict:
+        return await database[collection].find_one(query, {"_id": 0})
+    return load
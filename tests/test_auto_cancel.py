@@ -0,0 +1,149 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class GatedProvider(server.MockCancellationProvider):
+    """Holds every cancellation until `gate` is set."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.gate = asyncio.Event()
+
+    async def cancel(self, subscription: dict) -> str:
+        await self.gate.wait()
+        return await super().cancel(subscription)
+
+
+@pytest.fixture
+async def indexed(database):
+    await server.ensure_indexes(database)
+    return database
+
+
+def make_engine(database, clock, provider=None, **kwargs):
+    kwargs.setdefault("retry_base_seconds", 0)
+    return server.AutoCancelEngine(provider or server.MockCancellationProvider(), database=database, clock=clock, **kwargs)
+
+
+async def insert_subscriptions(database, clock, services, auto_cancel_enabled=True) -> list:
+    docs = [
+        server.Subscription(
+            user_id="user-1", service_name=service, category="streaming", amount=9.99, billing_cycle="monthly",
+            auto_cancel_enabled=auto_cancel_enabled, created_at=clock(),
+        ).model_dump()
+        for service in services
+    ]
+    await database.subscriptions.insert_many(docs)
+    return [doc["id"] for doc in docs]
+
+
+async def test_job_cancels_every_enabled_subscription(indexed, clock, drain, load):
+    ids = await insert_subscriptions(indexed, clock, [f"Service {i}" for i in range(5)])
+    await insert_subscriptions(indexed, clock, ["Kept"], auto_cancel_enabled=False)
+    engine = make_engine(indexed, clock, batch_size=2)
+
+    job_id = await engine.start("user-1", "vault-1")
+    await drain(engine)
+
+    assert sorted(engine.provider.cancelled) == sorted(ids)
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert job["id"] == job_id
+    assert job["status"] == "completed"
+    assert (job["total"], job["processed"], job["cancelled"], job["failed"]) == (5, 5, 5, 0)
+    assert "lease_token" not in job and "lease_until" not in job
+    assert engine.counters["batches"] == 3
+    assert await indexed.subscriptions.count_documents({"cancel_status": "cancelled"}) == 5
+    assert (await indexed.subscriptions.find_one({"service_name": "Kept"}))["cancel_status"] is None
+
+
+async def test_failing_service_is_retried_then_marked_failed(indexed, clock, drain, load):
+    await insert_subscriptions(indexed, clock, ["Streaming", "Gym"])
+    provider = server.MockCancellationProvider(fail_services=("Gym",))
+    engine = make_engine(indexed, clock, provider, max_attempts=3)
+
+    await engine.start("user-1", "vault-1")
+    await drain(engine)
+
+    gym = await indexed.subscriptions.find_one({"service_name": "Gym"})
+    assert gym["cancel_status"] == "failed"
+    assert "refused" in gym["cancel_error"]
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert (job["processed"], job["cancelled"], job["failed"]) == (2, 1, 1)
+    assert (engine.counters["retried"], engine.counters["failed"]) == (2, 1)
+
+
+async def test_start_while_running_returns_none(indexed, clock, drain, load):
+    await insert_subscriptions(indexed, clock, ["Streaming"])
+    engine = make_engine(indexed, clock, GatedProvider())
+
+    job_id = await engine.start("user-1", "vault-1")
+    assert await engine.start("user-1", "vault-2") is None
+
+    engine.provider.gate.set()
+    await drain(engine)
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert (job["id"], job["vault_id"], job["status"]) == (job_id, "vault-1", "completed")
+
+
+async def test_later_unlock_reruns_a_completed_job(indexed, clock, drain, load):
+    await insert_subscriptions(indexed, clock, ["Streaming", "Music"])
+    engine = make_engine(indexed, clock)
+    first_id = await engine.start("user-1", "vault-1")
+    await drain(engine)
+
+    [added] = await insert_subscriptions(indexed, clock, ["Gym"])
+    clock.advance(3600)
+    second_id = await engine.start("user-1", "vault-2")
+    await drain(engine)
+
+    assert second_id is not None and second_id != first_id
+    assert engine.provider.cancelled[-1] == added
+    assert await indexed.cancellation_jobs.count_documents({}) == 1
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert (job["id"], job["vault_id"], job["status"]) == (second_id, "vault-2", "completed")
+    assert (job["total"], job["processed"], job["cancelled"], job["failed"]) == (1, 1, 1, 0)
+
+
+async def test_expired_lease_is_resumed(indexed, clock, drain, load):
+    ids = await insert_subscriptions(indexed, clock, ["Streaming", "Music"])
+    await indexed.cancellation_jobs.insert_one({
+        "id": "job-1", "user_id": "user-1", "vault_id": "vault-1", "status": "running",
+        "total": 2, "processed": 0, "cancelled": 0, "failed": 0, "created_at": clock(), "finished_at": None,
+        "lease_token": "dead-worker", "lease_until": clock() + timedelta(seconds=300),
+    })
+    engine = make_engine(indexed, clock)
+
+    assert await engine.resume() == 0
+    clock.advance(301)
+    assert await engine.resume() == 1
+    await drain(engine)
+
+    assert sorted(engine.provider.cancelled) == sorted(ids)
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert (job["status"], job["processed"]) == ("completed", 2)
+    assert engine.counters["resumed"] == 1
+    assert await engine.resume() == 0
+
+
+async def test_worker_that_lost_its_lease_stops(indexed, clock, load):
+    await insert_subscriptions(indexed, clock, [f"Service {i}" for i in range(4)])
+    job = {
+        "id": "job-1", "user_id": "user-1", "vault_id": "vault-1", "status": "running",
+        "total": 4, "processed": 0, "cancelled": 0, "failed": 0, "created_at": clock(), "finished_at": None,
+        "lease_token": "current", "lease_until": clock() + timedelta(seconds=300),
+    }
+    await indexed.cancellation_jobs.insert_one(dict(job))
+    engine = make_engine(indexed, clock, batch_size=2)
+
+    await engine.run_job({**job, "lease_token": "stale"})
+
+    # The stale worker finishes its chunk, then leaves the rest to the lease holder
+    assert len(engine.provider.cancelled) == 2
+    job = await load("cancellation_jobs", user_id="user-1")
+    assert (job["status"], job["processed"], job["lease_token"]) == ("running", 0, "current")
@@ -0,0 +1,52 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def account(client, register):
+    headers = await register("bulk@example.com")
+    vault_id = (await client.get("/api/vaults", headers=headers)).json()[0]["id"]
+    return headers, vault_id
+
+
+async def upload_csv(client, headers, body: bytes):
+    return await client.post("/api/assets/bulk", headers={**headers, "Content-Type": "text/csv"}, content=body)
+
+
+async def test_csv_rows_are_imported(client, account):
+    headers, vault_id = account
+    body = f'vault_id,name,category,description\n{vault_id},Savings,financial,"two\nlines"\n{vault_id},Photos,personal,\n'
+
+    result = (await upload_csv(client, headers, body.encode())).json()
+
+    assert (result["received"], result["inserted"], result["failed"]) == (2, 2, 0)
+
+
+async def test_unterminated_quote_in_last_row_is_reported(client, account):
+    headers, vault_id = account
+    body = f'vault_id,name,category\n{vault_id},Savings,financial\n{vault_id},"Photos,personal\n'
+
+    result = (await upload_csv(client, headers, body.encode())).json()
+
+    assert (result["received"], result["inserted"], result["failed"]) == (2, 1, 1)
+    assert result["errors"] == [{"row": 2, "error": "Unterminated quoted field"}]
+
+
+async def test_unterminated_quote_in_header_is_rejected(client, account):
+    headers, _ = account
+    response = await upload_csv(client, headers, b'vault_id,"name,category\n')
+    assert response.status_code == 400
+
+
+async def test_non_utf8_body_is_rejected(client, account):
+    headers, vault_id = account
+    body = f"vault_id,name,category\n{vault_id},Café,financial\n".encode("latin-1")
+
+    response = await upload_csv(client, headers, body)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Body must be UTF-8 encoded"
+    assert await server.db.assets.count_documents({"name": {"$regex": "^Caf"}}) == 0
@@ -0,0 +1,40 @@
+import pytest
+from starlette.requests import Request
+
+import server
+
+
+def make_request(forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": ("10.0.0.2", 50000)})
+
+
+def test_forwarded_for_is_ignored_unless_trusted(monkeypatch):
+    monkeypatch.setattr(server, "TRUST_FORWARDED_FOR", False)
+    assert server.client_ip(make_request("203.0.113.9")) == "10.0.0.2"
+
+
+@pytest.mark.parametrize("forwarded, hops, expected", [
+    ("203.0.113.9", 1, "203.0.113.9"),
+    # A client-supplied entry on the left must not pick the bucket
+    ("1.2.3.4, 203.0.113.9", 1, "203.0.113.9"),
+    ("1.2.3.4, 203.0.113.9, 10.0.0.5", 2, "203.0.113.9"),
+    ("203.0.113.9", 2, "203.0.113.9"),
+])
+def test_client_is_counted_from_the_right(monkeypatch, forwarded, hops, expected):
+    monkeypatch.setattr(server, "TRUST_FORWARDED_FOR", True)
+    monkeypatch.setattr(server, "FORWARDED_FOR_HOPS", hops)
+    assert server.client_ip(make_request(forwarded)) == expected
+
+
+def test_missing_header_falls_back_to_peer(monkeypatch):
+    monkeypatch.setattr(server, "TRUST_FORWARDED_FOR", True)
+    assert server.client_ip(make_request()) == "10.0.0.2"
+
+
+@pytest.mark.anyio
+async def test_default_ip_budget_holds_a_site_sharing_one_address():
+    limiter = server.RateLimiter(server.MemoryRateLimitBackend(), enabled=True)
+    login = server.RATE_LIMIT_COSTS["/api/auth/login"]
+    for _ in range(100):
+        await limiter.charge("ip:172.17.0.1", login, server.RATE_LIMIT_IP_BURST, server.RATE_LIMIT_IP_PER_SECOND)
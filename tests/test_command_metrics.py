@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class ObservedCollection:
+    """Reports each awaited call to a MongoCommandListener the way Motor does:
+    from an executor thread running a copy of the caller's context."""
+
+    request_ids = itertools.count()
+
+    def __init__(self, collection, listener):
+        self.collection = collection
+        self.listener = listener
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def observed(*args, **kwargs):
+            result = await attr(*args, **kwargs)
+            await self.emit(result)
+            return result
+        return observed
+
+    async def emit(self, result):
+        event = SimpleNamespace(
+            command_name="find", command={"find": self.collection.name}, connection_id=("mongo", 27017),
+            request_id=next(self.request_ids), duration_micros=1500,
+            reply={"cursor": {"firstBatch": [result] if result else []}},
+        )
+        loop = asyncio.get_running_loop()
+        for handler in (self.listener.started, self.listener.succeeded):
+            await loop.run_in_executor(None, contextvars.copy_context().run, handler, event)
+
+
+class ObservedDatabase:
+    def __init__(self, database, listener):
+        self.database = database
+        self.listener = listener
+
+    def __getattr__(self, name):
+        return ObservedCollection(self.database[name], self.listener)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+def per_request_count(route: str) -> int:
+    series = server.mongo_commands_per_request.values.get((route,))
+    return series[-1] if series else 0
+
+
+def route_commands(route: str) -> int:
+    return sum(count for (label, _, _), count in server.mongo_commands_total.values.items() if label == route)
+
+
+async def test_commands_are_attributed_to_the_issuing_route(monkeypatch, client, database, register):
+    headers = await register("owner@example.com")
+    monkeypatch.setattr(server, "db", ObservedDatabase(database, server.MongoCommandListener()))
+    key = ("/api/vaults", "find", "user_stats")
+    before_key = server.mongo_commands_total.values.get(key, 0)
+    before_route = route_commands("/api/vaults")
+    before_series = list(server.mongo_commands_per_request.values.get(("/api/vaults",), [0] * (len(server.COUNT_BUCKETS) + 2)))
+
+    assert (await client.get("/api/vaults", headers=headers)).status_code == 200
+
+    assert server.mongo_commands_total.values[key] == before_key + 1
+    issued = route_commands("/api/vaults") - before_route
+    series = server.mongo_commands_per_request.values[("/api/vaults",)]
+    # One observation, of every command the request issued
+    assert (series[-1] - before_series[-1], series[-2] - before_series[-2]) == (1, issued)
+
+
+async def test_unrouted_requests_are_labelled_unmatched(client):
+    before = per_request_count("unmatched")
+
+    assert (await client.get("/api/no-such-route")).status_code == 404
+
+    assert per_request_count("unmatched") == before + 1
+    assert ("GET", "unmatched", 404) in server.http_requests_total.values
+
+
+async def test_commands_outside_a_request_count_as_background(database):
+    observed = ObservedDatabase(database, server.MongoCommandListener())
+    before = server.mongo_commands_total.values.get(("background", "find", "vaults"), 0)
+
+    await observed.vaults.find_one({})
+
+    assert server.mongo_commands_total.values[("background", "find", "vaults")] == before + 1
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_subscription(client, headers, service: str = "Streaming"):
+    response = await client.post(
+        "/api/subscriptions",
+        json={"service_name": service, "category": "streaming", "amount": 9.99, "billing_cycle": "monthly"},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+
+async def test_matching_etag_on_a_list_route_is_not_modified(client, register):
+    headers = await register("owner@example.com")
+    await add_subscription(client, headers)
+    etag = (await client.get("/api/subscriptions", headers=headers)).headers["etag"]
+
+    response = await client.get("/api/subscriptions", headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert (response.headers["etag"], response.headers["vary"]) == (etag, "Accept-Encoding")
+
+
+async def test_writes_change_the_list_etag(client, register):
+    headers = await register("owner@example.com")
+    await add_subscription(client, headers)
+    etag = (await client.get("/api/subscriptions", headers=headers)).headers["etag"]
+
+    await add_subscription(client, headers, "Music")
+
+    response = await client.get("/api/subscriptions", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert len(response.json()) == 2
+
+
+async def test_ndjson_stream_is_gzipped(client, register):
+    headers = await register("owner@example.com")
+    for service in ("Streaming", "Music"):
+        await add_subscription(client, headers, service)
+
+    response = await client.get(
+        "/api/subscriptions", headers={**headers, "Accept": server.NDJSON_MEDIA_TYPE, "Accept-Encoding": "gzip"}
+    )
+
+    # Streamed, so compressed however small
+    assert (response.headers["content-encoding"], response.headers["vary"]) == ("gzip", "Accept-Encoding")
+    assert "content-length" not in response.headers
+    assert sorted(json.loads(line)["service_name"] for line in response.text.splitlines()) == ["Music", "Streaming"]
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip", "identity"])
+async def test_small_bodies_still_vary_on_accept_encoding(client, register, accept_encoding):
+    headers = await register("owner@example.com")
+
+    response = await client.get("/api/subscriptions", headers={**headers, "Accept-Encoding": accept_encoding})
+
+    assert response.json() == []
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+async def test_large_json_body_is_gzipped(client, register):
+    headers = await register("owner@example.com")
+    for i in range(20):
+        await add_subscription(client, headers, f"Service {i}")
+
+    response = await client.get("/api/subscriptions", headers={**headers, "Accept-Encoding": "gzip"})
+
+    assert (response.headers["content-encoding"], response.headers["vary"]) == ("gzip", "Accept-Encoding")
+    assert len(response.content) >= server.COMPRESSION_MIN_SIZE
+    assert len(response.json()) == 20
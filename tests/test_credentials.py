@@ -0,0 +1,43 @@
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def fresh_keys(monkeypatch):
+    monkeypatch.setattr(server, "_master_cipher", None)
+    monkeypatch.setattr(server, "data_key_cache", server.TTLCache(100, 60))
+
+
+def test_missing_master_key_is_not_generated(monkeypatch, tmp_path, fresh_keys):
+    key_file = tmp_path / "master.key"
+    monkeypatch.setattr(server, "MASTER_KEY_FILE", key_file)
+
+    with pytest.raises(RuntimeError, match="generate_master_key.py"):
+        server.master_cipher()
+    assert not key_file.exists()
+
+
+async def test_data_key_round_trips(database, fresh_keys):
+    sealed = server.seal(await server.get_data_key("vault-1"), b"secret", b"aad")
+    server.data_key_cache.clear()
+
+    assert server.unseal(await server.get_data_key("vault-1"), sealed, b"aad") == b"secret"
+
+
+async def test_data_key_wrapped_under_another_master_key(database, fresh_keys):
+    other_master = AESGCM(AESGCM.generate_key(bit_length=256))
+    await database.vault_keys.insert_one({
+        "vault_id": "vault-1",
+        "wrapped_key": server.seal(other_master, AESGCM.generate_key(bit_length=256), b"vault-1"),
+    })
+
+    with pytest.raises(HTTPException) as error:
+        await server.get_data_key("vault-1")
+    assert error.value.status_code == 500
+    assert "master key" in error.value.detail
+    assert server.data_key_cache.get("vault-1") is None
@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def make_reaper(database, clock, **kwargs):
+    kwargs.setdefault("batch_size", 2)
+    kwargs.setdefault("pause_seconds", 0)
+    return server.DeletionReaper(database=database, clock=clock, **kwargs)
+
+
+async def seed_vault(database, vault_id: str, user_id: str = "user-1", assets: int = 0, instructions: int = 0):
+    await database.vaults.insert_one({"id": vault_id, "user_id": user_id, "name": vault_id, "deleted_at": None})
+    await database.vault_keys.insert_one({"vault_id": vault_id, "wrapped_key": b"sealed"})
+    for i in range(assets):
+        await database.assets.insert_one(
+            {"id": f"{vault_id}-asset-{i}", "user_id": user_id, "vault_id": vault_id, "category": "financial"}
+        )
+    for i in range(instructions):
+        await database.legacy_instructions.insert_one(
+            {"id": f"{vault_id}-instruction-{i}", "user_id": user_id, "vault_id": vault_id}
+        )
+
+
+async def tombstone(database, clock, vault_id: str, user_id: str = "user-1"):
+    await database.vaults.update_one({"id": vault_id}, {"$set": {"deleted_at": clock()}})
+    await database.user_stats.update_one(
+        {"user_id": user_id}, {"$addToSet": {"deleted_vaults": vault_id}}, upsert=True
+    )
+
+
+def running_job(clock, lease_token: str, lease_seconds: int = 300, **fields) -> dict:
+    return {
+        "id": "job-1", "kind": "vault", "user_id": "user-1", "target_id": "vault-1", "status": "running",
+        "stage": None, "deleted": {}, "created_at": clock(), "finished_at": None,
+        "lease_token": lease_token, "lease_until": clock() + timedelta(seconds=lease_seconds), **fields,
+    }
+
+
+async def test_vault_deletion_removes_its_documents_in_batches(database, clock, drain, load):
+    await seed_vault(database, "vault-1", assets=5, instructions=2)
+    await seed_vault(database, "vault-2", assets=1)
+    await tombstone(database, clock, "vault-1")
+    reaper = make_reaper(database, clock)
+
+    job_id = await reaper.start("vault", "user-1", "vault-1")
+    await drain(reaper)
+
+    assert [doc["vault_id"] for doc in await database.assets.find().to_list(None)] == ["vault-2"]
+    assert await database.legacy_instructions.count_documents({}) == 0
+    assert [doc["id"] for doc in await database.vaults.find().to_list(None)] == ["vault-2"]
+    assert [doc["vault_id"] for doc in await database.vault_keys.find().to_list(None)] == ["vault-2"]
+    job = await load("deletion_jobs", id=job_id)
+    assert (job["status"], job["stage"]) == ("completed", None)
+    assert "lease_token" not in job and "lease_until" not in job
+    deleted = job["deleted"]
+    assert (deleted["assets"], deleted["legacy_instructions"], deleted["vault_keys"], deleted["vaults"]) == (5, 2, 1, 1)
+    # assets 2+2+1, instructions 2, one key, one vault
+    assert (reaper.counters["batches"], reaper.counters["deleted"], reaper.counters["completed"]) == (6, 9, 1)
+
+
+async def test_vault_deletion_rebuilds_the_owners_stats(database, clock, drain):
+    await seed_vault(database, "vault-1", assets=3, instructions=1)
+    await seed_vault(database, "vault-2", assets=1)
+    await tombstone(database, clock, "vault-1")
+    reaper = make_reaper(database, clock)
+
+    await reaper.start("vault", "user-1", "vault-1")
+    await drain(reaper)
+
+    stats = await database.user_stats.find_one({"user_id": "user-1"})
+    assert (stats["vaults"], stats["assets"], stats["legacy_instructions"]) == (1, 1, 0)
+    assert stats["asset_breakdown"] == {"financial": 1}
+    assert stats["deleted_vaults"] == []
+
+
+async def test_user_deletion_removes_everything_they_own(database, clock, drain, load):
+    await seed_vault(database, "vault-1", assets=3, instructions=1)
+    await seed_vault(database, "vault-2", assets=2)
+    await seed_vault(database, "other-vault", user_id="user-2", assets=1)
+    await database.users.insert_many([{"id": "user-1"}, {"id": "user-2"}])
+    await database.subscriptions.insert_one({"id": "subscription-1", "user_id": "user-1"})
+    await database.notifications.insert_one({"id": "notification-1", "user_id": "user-1", "is_read": False})
+    await database.user_stats.insert_many([{"user_id": "user-1"}, {"user_id": "user-2"}])
+    reaper = make_reaper(database, clock)
+
+    job_id = await reaper.start("user", "user-1", "user-1")
+    await drain(reaper)
+
+    for collection in ("assets", "legacy_instructions", "vaults", "subscriptions", "notifications", "user_stats"):
+        assert await database[collection].count_documents({"user_id": "user-1"}) == 0, collection
+    assert [doc["vault_id"] for doc in await database.vault_keys.find().to_list(None)] == ["other-vault"]
+    assert [doc["id"] for doc in await database.users.find().to_list(None)] == ["user-2"]
+    assert await database.assets.count_documents({"user_id": "user-2"}) == 1
+    job = await load("deletion_jobs", id=job_id)
+    assert job["status"] == "completed"
+    assert (job["deleted"]["assets"], job["deleted"]["vault_keys"], job["deleted"]["users"]) == (5, 2, 1)
+
+
+async def test_expired_lease_is_rerun_from_the_start(database, clock, drain, load):
+    await seed_vault(database, "vault-1", assets=3)
+    await tombstone(database, clock, "vault-1")
+    # A worker died part way through the assets stage
+    await database.deletion_jobs.insert_one(
+        running_job(clock, "dead-worker", stage="assets", deleted={"assets": 2})
+    )
+    reaper = make_reaper(database, clock)
+
+    assert await reaper.resume() == 0
+    clock.advance(301)
+    assert await reaper.resume() == 1
+    await drain(reaper)
+
+    assert await database.assets.count_documents({}) == 0
+    assert await database.vaults.count_documents({}) == 0
+    job = await load("deletion_jobs", id="job-1")
+    assert job["status"] == "completed"
+    assert job["deleted"]["assets"] == 5
+    assert reaper.counters["resumed"] == 1
+
+
+async def test_completed_job_is_not_resumed(database, clock, drain):
+    await seed_vault(database, "vault-1")
+    await tombstone(database, clock, "vault-1")
+    reaper = make_reaper(database, clock)
+    await reaper.start("vault", "user-1", "vault-1")
+    await drain(reaper)
+
+    clock.advance(3600)
+    assert await reaper.resume() == 0
+    assert reaper.counters["resumed"] == 0
+
+
+async def test_worker_that_lost_its_lease_stops(database, clock, load):
+    await seed_vault(database, "vault-1", instructions=5)
+    await tombstone(database, clock, "vault-1")
+    job = running_job(clock, "current")
+    await database.deletion_jobs.insert_one(dict(job))
+    reaper = make_reaper(database, clock)
+
+    await reaper.run_job({**job, "lease_token": "stale"})
+
+    # The stale worker finishes its batch, then leaves the rest to the lease holder
+    assert await database.legacy_instructions.count_documents({}) == 3
+    assert await database.vaults.count_documents({}) == 1
+    job = await load("deletion_jobs", id="job-1")
+    assert (job["status"], job["stage"], job["lease_token"]) == ("running", None, "current")
+    assert reaper.counters["completed"] == 0
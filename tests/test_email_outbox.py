@@ -0,0 +1,121 @@
+import smtplib
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class RelayHandler:
+    """Accepts everything except recipients listed in `refuse`."""
+
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.received = []
+
+    async def handle_RCPT(self, smtp_server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return "550 No such user here"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, smtp_server, session, envelope):
+        self.received.extend(envelope.rcpt_tos)
+        return "250 Message accepted"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def relay():
+    handler = RelayHandler(refuse={"nobody@example.com"})
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def pool(relay):
+    pool = server.SMTPConnectionPool(relay.hostname, relay.port, starttls=False, size=2)
+    yield pool
+    pool.close()
+
+
+def make_dispatcher(pool, database, clock, **kwargs):
+    kwargs.setdefault("rate_per_second", 0)
+    kwargs.setdefault("retry_base_seconds", 30)
+    return server.EmailDispatcher(pool, database=database, clock=clock, **kwargs)
+
+
+async def test_outbox_is_delivered_over_reused_connections(relay, pool, database, clock):
+    dispatcher = make_dispatcher(pool, database, clock, concurrency=2)
+    recipients = [f"heir{i}@example.com" for i in range(10)]
+    for to_email in recipients:
+        await dispatcher.enqueue(to_email, "Hello", "Outbox test message")
+
+    assert await dispatcher.run_once() == 10
+    assert sorted(relay.handler.received) == sorted(recipients)
+    assert pool.connections_opened <= 2
+    assert await database.email_outbox.count_documents({"status": "sent"}) == 10
+    assert await dispatcher.run_once() == 0
+
+
+async def test_rejected_recipient_keeps_the_connection(relay, pool):
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        await pool.send("nobody@example.com", "Hello", "Refused")
+    assert len(pool.idle) == 1
+
+    await pool.send("heir@example.com", "Hello", "Accepted")
+    assert pool.connections_opened == 1
+    assert relay.handler.received == ["heir@example.com"]
+
+
+async def test_unreachable_relay_leaves_nothing_in_the_pool():
+    pool = server.SMTPConnectionPool("127.0.0.1", free_port(), starttls=False, size=1)
+    try:
+        with pytest.raises(OSError):
+            await pool.send("heir@example.com", "Hello", "No relay")
+        assert pool.idle == []
+    finally:
+        pool.close()
+
+
+async def test_rejected_message_is_retried_then_dead_lettered(relay, pool, database, clock):
+    dispatcher = make_dispatcher(pool, database, clock, concurrency=1, max_attempts=3)
+    message_id = await dispatcher.enqueue("nobody@example.com", "Hello", "Refused every time")
+    await dispatcher.enqueue("heir@example.com", "Hello", "Accepted")
+
+    assert await dispatcher.run_once() == 1
+    message = await database.email_outbox.find_one({"id": message_id})
+    assert message["status"] == "pending"
+    assert message["attempts"] == 1
+    assert "No such user" in message["last_error"]
+
+    # Backoff doubles: 30s, then 60s
+    clock.advance(29)
+    assert await dispatcher.claim_batch() == []
+    clock.advance(1)
+    assert await dispatcher.run_once() == 0
+    clock.advance(60)
+    assert await dispatcher.run_once() == 0
+
+    message = await database.email_outbox.find_one({"id": message_id})
+    assert message["status"] == "dead"
+    assert message["attempts"] == 3
+    assert (dispatcher.counters["sent"], dispatcher.counters["retried"], dispatcher.counters["dead"]) == (1, 2, 1)
+    assert pool.connections_opened == 1
+
+
+async def test_instruction_without_recipient_fails(database):
+    instruction = {"id": "instruction-1", "title": "Goodbye", "target_email": None}
+    with pytest.raises(ValueError, match="no target_email"):
+        await server.execute_notify(instruction)
+    assert await database.email_outbox.count_documents({}) == 0
@@ -0,0 +1,36 @@
+import pytest
+from pymongo import ASCENDING, IndexModel
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_changed_ttl_is_applied_with_collmod(monkeypatch, database):
+    await server.ensure_indexes(database)
+    commands = []
+
+    async def command(name, value, **kwargs):
+        commands.append((name, value, kwargs))
+
+    monkeypatch.setattr(database, "command", command)
+    monkeypatch.setitem(server.INDEXES, "notifications", [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=7 * 86400, name="created_at_ttl"),
+    ])
+
+    await server.ensure_indexes(database)
+
+    assert commands == [("collMod", "notifications", {"index": {"name": "created_at_ttl", "expireAfterSeconds": 7 * 86400}})]
+
+
+async def test_unchanged_ttls_issue_no_collmod(monkeypatch, database):
+    await server.ensure_indexes(database)
+    commands = []
+
+    async def command(*args, **kwargs):
+        commands.append(args)
+
+    monkeypatch.setattr(database, "command", command)
+    await server.ensure_indexes(database)
+
+    assert commands == []
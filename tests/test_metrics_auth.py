@@ -0,0 +1,40 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+STATS_ROUTES = [
+    "/metrics",
+    "/api/search/stats",
+    "/api/deletions/stats",
+    "/api/subscriptions/auto-cancel/stats",
+    "/api/notifications/stream/stats",
+    "/api/ai/stats",
+    "/api/email/stats",
+    "/api/auth/cache-stats",
+    "/api/scheduler/stats",
+]
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("path", STATS_ROUTES)
+async def test_stats_routes_require_metrics_token(monkeypatch, client, path):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+    assert (await client.get(path)).status_code == 401
+    # A user's access token is not enough
+    user_token = server.create_access_token({"sub": "user-1"})
+    assert (await client.get(path, headers=bearer(user_token))).status_code == 401
+    assert (await client.get(path, headers=bearer("scrape-secret"))).status_code == 200
+
+
+@pytest.mark.parametrize("path", STATS_ROUTES)
+async def test_stats_routes_require_a_user_without_metrics_token(monkeypatch, client, path):
+    monkeypatch.setattr(server, "METRICS_TOKEN", None)
+    assert (await client.get(path)).status_code == 403
+    assert (await client.get(path, headers=bearer("not-a-jwt"))).status_code == 401
+    user_token = server.create_access_token({"sub": "user-1"})
+    assert (await client.get(path, headers=bearer(user_token))).status_code == 200
@@ -0,0 +1,55 @@
+import pytest
+
+from migration_runner import run_batches
+
+pytestmark = pytest.mark.anyio
+
+
+class Interrupted(Exception):
+    pass
+
+
+def uppercase_names(database, fail_on_call=None):
+    calls = []
+
+    async def migrate_batch(batch):
+        calls.append([doc["_id"] for doc in batch])
+        if len(calls) == fail_on_call:
+            raise Interrupted
+        for doc in batch:
+            await database.items.update_one({"_id": doc["_id"], "name": doc["name"]}, {"$set": {"name": doc["name"].upper()}})
+        return len(batch)
+
+    return migrate_batch, calls
+
+
+async def migrate(database, migrate_batch):
+    return await run_batches(
+        "uppercase", "items", {"name": {"$regex": "^[a-z]"}}, {"name": 1}, migrate_batch,
+        batch_size=2, pause=0, database=database,
+    )
+
+
+async def test_interrupted_run_resumes_after_the_checkpoint(database):
+    await database.items.insert_many([{"_id": i, "name": f"item{i}"} for i in range(5)])
+
+    migrate_batch, calls = uppercase_names(database, fail_on_call=2)
+    with pytest.raises(Interrupted):
+        await migrate(database, migrate_batch)
+    assert (await database.migrations.find_one({"name": "uppercase", "collection": "items"}))["last_id"] == 1
+
+    migrate_batch, calls = uppercase_names(database)
+    assert await migrate(database, migrate_batch) == 3
+    assert calls == [[2, 3], [4]]
+    assert sorted(doc["name"] for doc in await database.items.find().to_list(None)) == [f"ITEM{i}" for i in range(5)]
+
+
+async def test_finished_collection_is_skipped(database):
+    await database.items.insert_one({"_id": 1, "name": "item"})
+    migrate_batch, _ = uppercase_names(database)
+    assert await migrate(database, migrate_batch) == 1
+
+    await database.items.insert_one({"_id": 2, "name": "late"})
+    migrate_batch, calls = uppercase_names(database)
+    assert await migrate(database, migrate_batch) == 0
+    assert calls == []
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_notification_etag_rolls_over_with_the_ttl_monitor(monkeypatch, client, register):
+    headers = await register("notify@example.com")
+    now = [1_000_000.0]
+    monkeypatch.setattr(server.time, "time", lambda: now[0])
+
+    etag = (await client.get("/api/notifications", headers=headers)).headers["etag"]
+    assert (await client.get("/api/notifications", headers={**headers, "If-None-Match": etag})).status_code == 304
+
+    # Expired notifications may have been deleted since; revalidate
+    now[0] += server.TTL_MONITOR_SECONDS
+    assert (await client.get("/api/notifications", headers={**headers, "If-None-Match": etag})).status_code == 200
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = server.NotificationHub(server.LocalPubSub(), queue_size=2)
+    monkeypatch.setattr(server, "notification_hub", hub)
+    return hub
+
+
+@pytest.fixture
+def database(monkeypatch):
+    from mongomock_motor import AsyncMongoMockClient
+
+    # Stream positions compare stored and live created_at values, so read them
+    # back tz-aware as the production client does
+    database = AsyncMongoMockClient(tz_aware=True)["driv_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+async def next_event_id(stream) -> str:
+    chunk = await asyncio.wait_for(anext(stream), 1)
+    assert chunk.startswith(b"id: "), chunk
+    return chunk.split(b"\n")[0][4:].decode()
+
+
+async def notify(database, count: int) -> list:
+    """Publish count notifications; returns their ids in stream order, which
+    breaks created_at ties by id."""
+    ids = [(await server.notify_user("user-1", f"Notice {i}", "")).id for i in range(count)]
+    docs = await database.notifications.find({"id": {"$in": ids}}).sort(server.PAGE_SORT).to_list(None)
+    return [doc["id"] for doc in docs]
+
+
+async def test_stream_resumes_after_last_event_id(database, hub):
+    first, *missed = await notify(database, 3)
+    stream = server.stream_notifications("user-1", first)
+
+    assert await anext(stream) == b"retry: 3000\n\n"
+    assert [await next_event_id(stream) for _ in missed] == missed
+    [live] = await notify(database, 1)
+    assert await next_event_id(stream) == live
+
+    await stream.aclose()
+    assert hub.subscribers == {}
+
+
+async def test_overflowed_queue_catches_up_from_storage(database, hub):
+    stream = server.stream_notifications("user-1", None)
+    assert await anext(stream) == b"retry: 3000\n\n"
+
+    # Five notifications into a queue of two, with nothing reading
+    published = await notify(database, 5)
+    assert hub.counters["overflows"] == 1
+    assert [await next_event_id(stream) for _ in published] == published
+    [live] = await notify(database, 1)
+    assert await next_event_id(stream) == live
+
+    await stream.aclose()
+
+
+async def test_failed_resume_lookup_unsubscribes(monkeypatch, database, hub):
+    async def find_one(*args, **kwargs):
+        raise ConnectionError("connection refused")
+
+    class Database:
+        notifications = type("Notifications", (), {"find_one": staticmethod(find_one)})
+
+    monkeypatch.setattr(server, "db", Database())
+    stream = server.stream_notifications("user-1", "notification-1")
+
+    with pytest.raises(ConnectionError):
+        await anext(stream)
+    assert hub.subscribers == {}
@@ -0,0 +1,109 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2030, 1, 1)
+
+
+@pytest.fixture
+async def user(database, register):
+    headers = await register("owner@example.com")
+    user = await database.users.find_one({"email": "owner@example.com"})
+    return user["id"], headers
+
+
+async def insert_subscriptions(database, user_id: str, created: list):
+    """Insert one subscription per (id, created_at) pair."""
+    await database.subscriptions.insert_many([
+        {"id": doc_id, "user_id": user_id, "service_name": doc_id, "category": "streaming", "amount": 9.99,
+         "billing_cycle": "monthly", "created_at": created_at}
+        for doc_id, created_at in created
+    ])
+
+
+async def walk(client, headers, limit: int) -> list:
+    """Follow X-Next-Cursor to the end, returning the ids of each page."""
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/subscriptions", params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append([row["id"] for row in response.json()])
+        cursor = response.headers.get(server.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+
+
+async def test_rows_sharing_created_at_are_split_by_id(client, database, user):
+    user_id, headers = user
+    # Three rows share a timestamp and straddle the page boundary
+    await insert_subscriptions(database, user_id, [
+        ("b", START), ("a", START), ("d", START + timedelta(seconds=1)), ("c", START),
+    ])
+
+    assert await walk(client, headers, limit=2) == [["a", "b"], ["c", "d"]]
+
+
+async def test_last_page_has_no_next_cursor(client, database, user):
+    user_id, headers = user
+    await insert_subscriptions(database, user_id, [(f"s{i}", START + timedelta(seconds=i)) for i in range(4)])
+
+    # A full final page still answers without a cursor once nothing follows it
+    assert await walk(client, headers, limit=2) == [["s0", "s1"], ["s2", "s3"]]
+    response = await client.get("/api/subscriptions", params={"limit": 5}, headers=headers)
+    assert server.NEXT_CURSOR_HEADER not in response.headers
+
+
+async def test_legacy_string_dates_page_before_converted_rows(client, database, user):
+    user_id, headers = user
+    # Rows migrate_datetimes.py has not reached yet still hold ISO strings,
+    # which Mongo sorts before every date
+    await insert_subscriptions(database, user_id, [
+        ("legacy-1", (START + timedelta(days=5)).isoformat()),
+        ("legacy-2", (START + timedelta(days=6)).isoformat()),
+        ("new-1", START),
+        ("new-2", START + timedelta(days=1)),
+    ])
+
+    assert await walk(client, headers, limit=1) == [["legacy-1"], ["legacy-2"], ["new-1"], ["new-2"]]
+
+
+def test_cursor_records_whether_the_row_held_a_string_date():
+    string_cursor = server.encode_cursor({"created_at": START.isoformat(), "id": "a"})
+    date_cursor = server.encode_cursor({"created_at": START, "id": "a"})
+
+    assert {"created_at": {"$type": "date"}} in server.decode_cursor(string_cursor)["$or"]
+    assert server.decode_cursor(date_cursor)["created_at"] == {"$gte": START}
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps(["yesterday", "a"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"created_at": "2030-01-01"}).encode()).decode(),
+])
+async def test_malformed_cursor_is_rejected(client, user, cursor):
+    _, headers = user
+
+    response = await client.get("/api/subscriptions", params={"cursor": cursor}, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+async def test_ndjson_streams_one_row_per_line(client, database, user):
+    user_id, headers = user
+    await insert_subscriptions(database, user_id, [(f"s{i}", START + timedelta(seconds=i)) for i in range(3)])
+
+    response = await client.get(
+        "/api/subscriptions", params={"limit": 2}, headers={**headers, "Accept": server.NDJSON_MEDIA_TYPE}
+    )
+
+    assert response.headers["content-type"] == server.NDJSON_MEDIA_TYPE
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["s0", "s1"]
@@ -0,0 +1,172 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingHandler:
+    def __init__(self, fail_times: int = 0):
+        self.calls = []
+        self.fail_times = fail_times
+
+    async def __call__(self, instruction: dict):
+        self.calls.append(instruction["id"])
+        if len(self.calls) <= self.fail_times:
+            raise RuntimeError("relay unavailable")
+
+
+def make_scheduler(database, clock, handler, **kwargs):
+    kwargs.setdefault("lease_seconds", 300)
+    kwargs.setdefault("retry_base_seconds", 60)
+    return server.InstructionScheduler({"notify": handler}, database=database, clock=clock, **kwargs)
+
+
+async def insert_due(database, clock, count: int = 1) -> list:
+    vault_id = str(uuid.uuid4())
+    docs = []
+    for i in range(count):
+        instruction = server.LegacyInstruction(
+            user_id="user-1", vault_id=vault_id, action_type=server.ActionType.NOTIFY,
+            title=f"Instruction {i}", target_email="heir@example.com", execution_date=clock(),
+        )
+        docs.append({**instruction.model_dump(), "action_type": "notify"})
+    await database.legacy_instructions.insert_many(docs)
+    return [doc["id"] for doc in docs]
+
+
+def naive(value):
+    # mongomock hands datetimes back without tzinfo
+    return value.replace(tzinfo=None)
+
+
+async def test_claimed_batch_is_not_claimed_again(database, clock):
+    ids = await insert_due(database, clock, count=3)
+    first = make_scheduler(database, clock, RecordingHandler())
+    second = make_scheduler(database, clock, RecordingHandler())
+
+    claimed = await first.claim_batch()
+
+    assert sorted(doc["id"] for doc in claimed) == sorted(ids)
+    assert len({doc["claim_token"] for doc in claimed}) == 1
+    assert await second.claim_batch() == []
+
+
+async def test_run_once_executes_each_instruction_once(database, clock, load):
+    ids = await insert_due(database, clock, count=5)
+    handler = RecordingHandler()
+    scheduler = make_scheduler(database, clock, handler, batch_size=2)
+
+    assert await scheduler.run_once() == 5
+    assert sorted(handler.calls) == sorted(ids)
+    for instruction_id in ids:
+        doc = await load("legacy_instructions", id=instruction_id)
+        assert doc["is_executed"] is True
+        assert "claim_token" not in doc and "lease_until" not in doc
+    assert await scheduler.run_once() == 0
+
+
+async def test_failure_backs_off_exponentially(database, clock, load):
+    [instruction_id] = await insert_due(database, clock)
+    handler = RecordingHandler(fail_times=2)
+    scheduler = make_scheduler(database, clock, handler)
+
+    assert await scheduler.run_once() == 0
+    doc = await load("legacy_instructions", id=instruction_id)
+    assert doc["attempts"] == 1
+    assert doc["last_error"] == "relay unavailable"
+    assert naive(doc["execution_date"]) == naive(clock.now + timedelta(seconds=60))
+
+    # Not due again until the backoff has passed
+    clock.advance(59)
+    assert await scheduler.run_once() == 0
+    assert len(handler.calls) == 1
+
+    clock.advance(1)
+    assert await scheduler.run_once() == 0
+    doc = await load("legacy_instructions", id=instruction_id)
+    assert doc["attempts"] == 2
+    assert naive(doc["execution_date"]) == naive(clock.now + timedelta(seconds=120))
+
+    clock.advance(120)
+    assert await scheduler.run_once() == 1
+    assert (await load("legacy_instructions", id=instruction_id))["is_executed"] is True
+    assert scheduler.counters["retried"] == 2
+
+
+async def test_instruction_is_dead_lettered_after_max_attempts(database, clock, load):
+    [instruction_id] = await insert_due(database, clock)
+    handler = RecordingHandler(fail_times=10)
+    scheduler = make_scheduler(database, clock, handler, max_attempts=3)
+
+    for _ in range(3):
+        await scheduler.run_once()
+        clock.advance(3600)
+
+    doc = await load("legacy_instructions", id=instruction_id)
+    assert doc["attempts"] == 3
+    assert doc["dead_at"] is not None
+    assert doc["is_executed"] is False
+    assert scheduler.counters["dead"] == 1
+
+    clock.advance(86400)
+    assert await scheduler.run_once() == 0
+    assert len(handler.calls) == 3
+
+
+async def test_missing_handler_counts_as_failure(database, clock, load):
+    [instruction_id] = await insert_due(database, clock)
+    await database.legacy_instructions.update_one({"id": instruction_id}, {"$set": {"action_type": "donate"}})
+    scheduler = make_scheduler(database, clock, RecordingHandler())
+
+    assert await scheduler.run_once() == 0
+    assert "No handler" in (await load("legacy_instructions", id=instruction_id))["last_error"]
+
+
+async def test_expired_lease_is_reclaimed_and_stale_completion_ignored(database, clock, load):
+    [instruction_id] = await insert_due(database, clock)
+    crashed = make_scheduler(database, clock, RecordingHandler(), lease_seconds=300)
+    survivor_handler = RecordingHandler()
+    survivor = make_scheduler(database, clock, survivor_handler, lease_seconds=300)
+
+    [stale] = await crashed.claim_batch()
+    assert await survivor.claim_batch() == []
+
+    clock.advance(301)
+    assert await survivor.run_once() == 1
+    assert survivor_handler.calls == [instruction_id]
+
+    # The first worker finishing late must not record a second execution
+    await crashed._process(stale, asyncio.Semaphore(1))
+    assert crashed.counters["executed"] == 0
+    assert survivor.counters["executed"] == 1
+    doc = await load("legacy_instructions", id=instruction_id)
+    assert doc["is_executed"] is True
+    assert naive(doc["executed_at"]) == naive(clock.now)
+
+
+async def test_every_instruction_write_bumps_export_and_list_versions(database, clock, load):
+    [instruction_id] = await insert_due(database, clock)
+    doc = await load("legacy_instructions", id=instruction_id)
+    vault_id = doc["vault_id"]
+    await database.legacy_instructions.update_one({"id": instruction_id}, {"$set": {"execution_date": None}})
+    await database.vaults.insert_one({"id": vault_id, "user_id": "user-1", "content_version": 0})
+    await database.user_stats.insert_one({"user_id": "user-1", "versions": {"legacy_instructions": 0}})
+    scheduler = make_scheduler(database, clock, RecordingHandler(fail_times=1))
+
+    async def versions():
+        vault = await database.vaults.find_one({"id": vault_id})
+        stats = await database.user_stats.find_one({"user_id": "user-1"})
+        return vault["content_version"], stats["versions"]["legacy_instructions"]
+
+    assert await scheduler.schedule_vault(vault_id, unlocked_at=clock()) == 1
+    assert await versions() == (1, 1)
+    assert await scheduler.run_once() == 0
+    assert await versions() == (2, 2)
+    clock.advance(60)
+    assert await scheduler.run_once() == 1
+    assert await versions() == (3, 3)
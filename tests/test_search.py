@@ -0,0 +1,80 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeCursor:
+    def __init__(self, docs=(), error=None):
+        self.docs = list(docs)
+        self.error = error
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, count):
+        return self
+
+    async def to_list(self, length):
+        if self.error:
+            raise self.error
+        return self.docs
+
+
+class FakeCollection:
+    """Answers $text queries with `text_hits` and every other query with nothing."""
+
+    def __init__(self, text_hits=(), error=None):
+        self.text_hits = text_hits
+        self.error = error
+
+    def find(self, query, projection=None):
+        return FakeCursor(self.text_hits if "$text" in query else (), self.error)
+
+
+class FakeDatabase:
+    def __init__(self, collection: FakeCollection):
+        self.assets = collection
+
+    def __getitem__(self, name):
+        return self.assets
+
+
+def asset(doc_id: str, name: str, text_score: float) -> dict:
+    return {"id": doc_id, "vault_id": "vault-1", "category": "financial", "name": name, "text_score": text_score}
+
+
+async def test_missing_text_index_falls_back_to_memory(monkeypatch):
+    error = OperationFailure("text index required for $text query", code=27)
+    monkeypatch.setattr(server, "db", FakeDatabase(FakeCollection(error=error)))
+    service = server.SearchService(backend="auto")
+
+    assert await service.resolve_backend() == "memory"
+
+
+async def test_other_errors_are_not_mistaken_for_missing_text_support(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDatabase(FakeCollection(error=ConnectionError("connection refused"))))
+    service = server.SearchService(backend="auto")
+
+    with pytest.raises(ConnectionError):
+        await service.resolve_backend()
+    assert service.backend is None
+
+
+async def test_text_hit_matching_only_some_terms_is_dropped(monkeypatch):
+    hits = [asset("both", "Bitcoin wallet", 2.0), asset("one", "Bitcoin savings", 1.5)]
+    monkeypatch.setattr(server, "db", FakeDatabase(FakeCollection(hits)))
+
+    results = await server.search_service._mongo_search("assets", {"user_id": "user-1"}, ["bitcoin", "wallet"], 10)
+
+    assert [result["id"] for _, result in results] == ["both"]
+
+
+async def test_single_term_stem_match_keeps_the_text_score(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDatabase(FakeCollection([asset("stem", "Investing account", 1.1)])))
+
+    results = await server.search_service._mongo_search("assets", {"user_id": "user-1"}, ["investment"], 10)
+
+    assert [(score, result["id"]) for score, result in results] == [(1.1, "stem")]
@@ -0,0 +1,56 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def user(database, register):
+    headers = await register("owner@example.com")
+    user = await database.users.find_one({"email": "owner@example.com"})
+    return user["id"], headers
+
+
+def second_token(user_id: str) -> dict:
+    # Another session for the same user; the extra claim keeps its digest distinct
+    token = server.create_access_token({"sub": user_id, "session": "second"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def test_logout_rejects_the_cached_token(client, user):
+    user_id, headers = user
+    other = second_token(user_id)
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 200
+    assert server.token_cache.get(server.token_digest(headers["Authorization"].split()[1])) is not None
+
+    assert (await client.post("/api/auth/logout", headers=headers)).status_code == 204
+
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+    # Only the session that logged out is revoked
+    assert (await client.get("/api/auth/me", headers=other)).status_code == 200
+
+
+async def test_logout_is_seen_by_another_worker(monkeypatch, client, user):
+    _, headers = user
+    assert (await client.post("/api/auth/logout", headers=headers)).status_code == 204
+
+    # A worker that never saw the logout has no in-memory record or cached payload
+    monkeypatch.setattr(server, "revoked_token_digests", {})
+    server.token_cache.invalidate(server.token_digest(headers["Authorization"].split()[1]))
+
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+
+
+async def test_deleting_the_account_revokes_every_token(client, user, drain):
+    user_id, headers = user
+    other = second_token(user_id)
+    for session in (headers, other):
+        assert (await client.get("/api/auth/me", headers=session)).status_code == 200
+
+    response = await client.delete("/api/auth/me", headers=headers)
+    assert response.status_code == 202
+    await drain(server.deletion_reaper)
+
+    for session in (headers, other):
+        assert (await client.get("/api/auth/me", headers=session)).status_code == 401
@@ -0,0 +1,45 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_vault(client, headers, name: str = "Estate") -> str:
+    response = await client.post("/api/vaults", json={"name": name}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+async def add_asset(client, headers, vault_id: str):
+    return await client.post(
+        "/api/assets", json={"vault_id": vault_id, "name": "Savings", "category": "financial"}, headers=headers
+    )
+
+
+async def test_writes_are_refused_right_after_the_vault_is_deleted(client, register, drain):
+    headers = await register("owner@example.com")
+    vault_id = await create_vault(client, headers)
+    assert (await add_asset(client, headers, vault_id)).status_code == 200
+
+    assert (await client.delete(f"/api/vaults/{vault_id}", headers=headers)).status_code == 202
+
+    # The owner was cached by the writes above; the tombstone must not be served from it
+    assert (await add_asset(client, headers, vault_id)).status_code == 404
+    await drain(server.deletion_reaper)
+    assert (await add_asset(client, headers, vault_id)).status_code == 404
+
+
+async def test_another_users_vault_is_never_authorized(client, database, register):
+    owner = await register("owner@example.com")
+    intruder = await register("intruder@example.com")
+    vault_id = await create_vault(client, owner)
+    intruder_id = (await database.users.find_one({"email": "intruder@example.com"}))["id"]
+
+    for _ in range(2):
+        # The second attempt is answered from the cache
+        assert (await add_asset(client, intruder, vault_id)).status_code == 404
+    assert await database.assets.count_documents({}) == 0
+    assert server.vault_owner_cache.get(vault_id) != intruder_id
+    assert await server.owned_vault_ids([vault_id, "missing-vault"], intruder_id) == set()
+
@@ -0,0 +1,42 @@
+import io
+import zipfile
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def vault(client, register):
+    headers = await register("export@example.com")
+    vault_id = (await client.get("/api/vaults", headers=headers)).json()[0]["id"]
+    for i in range(3):
+        await client.post("/api/assets", headers=headers, json={"vault_id": vault_id, "name": f"Asset {i}", "category": "other"})
+    return headers, vault_id
+
+
+async def test_range_before_size_is_known_returns_whole_archive(client, vault):
+    headers, vault_id = vault
+    url = f"/api/vaults/{vault_id}/export"
+
+    first = await client.get(url, headers={**headers, "Range": "bytes=0-99"})
+    assert first.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(first.content)).testzip() is None
+
+    second = await client.get(url, headers={**headers, "Range": "bytes=0-99", "If-Range": first.headers["etag"]})
+    assert second.status_code == 206
+    assert second.headers["content-range"] == f"bytes 0-99/{len(first.content)}"
+    assert second.content == first.content[:100]
+
+
+async def test_etag_follows_subscription_changes(client, vault):
+    headers, vault_id = vault
+    url = f"/api/vaults/{vault_id}/export"
+    before = (await client.get(url, headers=headers)).headers["etag"]
+
+    await client.post("/api/subscriptions", headers=headers,
+                      json={"service_name": "Music", "category": "media", "amount": 10, "billing_cycle": "monthly"})
+
+    assert (await client.get(url, headers=headers)).headers["etag"] != before
@@ -0,0 +1,51 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_unknown_enum_values_do_not_break_vault_facts(database):
+    scope = {"user_id": "user-1", "vault_id": "vault-1"}
+    await database.assets.insert_many([
+        {**scope, "id": "a1", "category": "financial", "credentials": "********"},
+        {**scope, "id": "a2", "category": "other"},
+        {**scope, "id": "a3", "category": "gaming"},
+        {**scope, "id": "a4"},
+    ])
+    await database.legacy_instructions.insert_many([
+        {**scope, "id": "i1", "action_type": "notify"},
+        {**scope, "id": "i2", "action_type": "archive"},
+    ])
+    await database.trusted_parties.insert_many([
+        {**scope, "id": "p1", "role": "verifier"},
+        {**scope, "id": "p2", "role": "guardian"},
+    ])
+
+    facts = await server.load_vault_facts("user-1", "vault-1")
+
+    assert facts["asset_breakdown"] == {"financial": 1, "other": 3}
+    assert facts["with_credentials"] == 1
+    assert facts["instruction_actions"] == {"notify": 1}
+    assert facts["party_roles"] == {"verifier": 1}
+
+
+async def test_deleting_a_legacy_category_asset_counts_it_as_other(client, database, register):
+    headers = await register("owner@example.com")
+    user_id = (await database.users.find_one({"email": "owner@example.com"}))["id"]
+    vault_id = (await client.post("/api/vaults", json={"name": "Estate"}, headers=headers)).json()["id"]
+    scope = {"user_id": user_id, "vault_id": vault_id}
+    await database.assets.insert_many([
+        {**scope, "id": "a1", "category": "gaming"},
+        {**scope, "id": "a2", "category": "financial"},
+        {**scope, "id": "a3"},
+    ])
+    stats = await server.rebuild_user_stats(user_id)
+    assert stats["asset_breakdown"] == {"financial": 1, "other": 2}
+
+    for asset_id in ("a1", "a3"):
+        assert (await client.delete(f"/api/assets/{asset_id}", headers=headers)).status_code == 204
+
+    stats = await database.user_stats.find_one({"user_id": user_id})
+    assert stats["assets"] == 1
+    assert stats["asset_breakdown"] == {"financial": 1, "other": 0}
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class RacingCollection:
+    """Runs `after_count` once, right after the first count_documents returns."""
+
+    def __init__(self, collection, after_count):
+        self.collection = collection
+        self.after_count = after_count
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def count_documents(self, *args, **kwargs):
+        count = await self.collection.count_documents(*args, **kwargs)
+        if self.after_count:
+            after_count, self.after_count = self.after_count, None
+            await after_count()
+        return count
+
+
+class RacingDatabase:
+    def __init__(self, database, name, after_count):
+        self.database = database
+        self.racing = RacingCollection(database[name], after_count)
+        self.name = name
+
+    def __getattr__(self, name):
+        return self.racing if name == self.name else getattr(self.database, name)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+@pytest.fixture
+def unlocks(monkeypatch):
+    """Record the work an unlock kicks off instead of running it."""
+    calls = {"scheduled": [], "cancelled": []}
+
+    async def schedule_vault(vault_id, unlocked_at):
+        calls["scheduled"].append(vault_id)
+
+    async def start(user_id, vault_id):
+        calls["cancelled"].append((user_id, vault_id))
+
+    monkeypatch.setattr(server.instruction_scheduler, "schedule_vault", schedule_vault)
+    monkeypatch.setattr(server.auto_cancel_engine, "start", start)
+    return calls
+
+
+async def seed_vault(database, verifiers: int, verified: int = 0, pending: int = 0):
+    await server.ensure_indexes(database)
+    await database.vaults.insert_one({"id": "vault-1", "user_id": "user-1", "name": "Estate", "is_locked": True})
+    await database.trusted_parties.insert_many([
+        {"id": f"party-{i}", "vault_id": "vault-1", "role": server.RoleType.VERIFIER.value} for i in range(verifiers)
+    ])
+    statuses = [server.VerificationStatus.VERIFIED.value] * verified + [server.VerificationStatus.PENDING.value] * pending
+    if statuses:
+        await database.death_verifications.insert_many([
+            {"id": f"verification-{i}", "vault_id": "vault-1", "status": status} for i, status in enumerate(statuses)
+        ])
+
+
+async def test_concurrent_verifications_unlock_once(database, unlocks, load):
+    await seed_vault(database, verifiers=3, pending=4)
+    await server.update_vault_quorum("vault-1", {"submitted": 4})
+    await database.death_verifications.update_many({}, {"$set": {"status": server.VerificationStatus.VERIFIED.value}})
+
+    results = await asyncio.gather(*(server.update_vault_quorum("vault-1", {"verified": 1}) for _ in range(4)))
+
+    assert results.count(True) == 1
+    assert unlocks == {"scheduled": ["vault-1"], "cancelled": [("user-1", "vault-1")]}
+    assert (await load("vaults", id="vault-1"))["is_locked"] is False
+    quorum = await load("vault_quorum", vault_id="vault-1")
+    assert (quorum["submitted"], quorum["verified"], quorum["verifiers"], quorum["unlocked"]) == (4, 4, 3, True)
+
+
+async def test_legacy_vault_rebuilding_concurrently_unlocks_once(database, unlocks, load):
+    # Verifications predate quorum tracking, so every call starts with a rebuild
+    await seed_vault(database, verifiers=3, verified=3)
+
+    results = await asyncio.gather(*(server.update_vault_quorum("vault-1", {"verified": 0}) for _ in range(3)))
+
+    assert results.count(True) == 1
+    assert unlocks == {"scheduled": ["vault-1"], "cancelled": [("user-1", "vault-1")]}
+    quorum = await load("vault_quorum", vault_id="vault-1")
+    assert (quorum["verified"], quorum["verifiers"]) == (3, 3)
+
+
+async def test_increment_during_rebuild_is_not_overwritten(monkeypatch, database, unlocks, load):
+    await seed_vault(database, verifiers=2, pending=1)
+
+    async def add_verifier():
+        # A trusted party is registered after the rebuild counted verifiers
+        await database.trusted_parties.insert_one(
+            {"id": "party-late", "vault_id": "vault-1", "role": server.RoleType.VERIFIER.value}
+        )
+        await database.vault_quorum.update_one({"vault_id": "vault-1"}, {"$inc": {"verifiers": 1, "seq": 1}})
+
+    monkeypatch.setattr(server, "db", RacingDatabase(database, "trusted_parties", add_verifier))
+
+    assert await server.update_vault_quorum("vault-1", {"submitted": 1}) is False
+
+    quorum = await load("vault_quorum", vault_id="vault-1")
+    assert (quorum["submitted"], quorum["verified"], quorum["verifiers"]) == (1, 0, 3)
+    assert unlocks == {"scheduled": [], "cancelled": []}
+
+
+async def test_rebuild_creates_a_missing_quorum(database, load):
+    await seed_vault(database, verifiers=2, verified=1, pending=1)
+
+    await server.rebuild_vault_quorum("vault-1")
+
+    quorum = await load("vault_quorum", vault_id="vault-1")
+    assert (quorum["submitted"], quorum["verified"], quorum["verifiers"], quorum["seq"]) == (2, 1, 2, 0)